@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Dart 소스 토크나이저 + 메서드 범위 추출 (split_dart_file.py 용)
+
+정규식으로 메서드 시작을 찾고 매번 문자 단위로 중괄호를 세면 문자열/주석/문자열 보간
+${...} 안의 중괄호까지 세어 범위가 틀어지고, 반환 타입 패턴에 없는 시그니처는 놓칩니다.
+여기서는 파일을 한 번만 훑어(O(n)) 중괄호/';'/'=>' 위치와 짝을 미리 구해 두고,
+클래스 본문/최상위 수준에서 본문 바로 앞의 선언 머리만 토큰으로 나눠 메서드인지 판별합니다.
+
+- 문자열: '...', "...", '''...''', \"\"\"...\"\"\", r'...'(raw), 보간 ${...} 안의 중첩 문자열/중괄호
+- 주석: //, /// (문서 주석은 메서드 범위에 포함), /* */ (중첩 가능)
+- 선언: 메서드/최상위 함수, getter/setter, 생성자(이름 있는 생성자, factory), operator,
+  제네릭 반환 타입/타입 매개변수, async/async*/sync*, 화살표 본문(=> ...;)
+- 메서드 안의 지역 함수는 바깥 메서드 범위에 포함되고 따로 추출하지 않음
+
+사용 예:
+    for member in extract_members(source):
+        print(member['kind'], member['name'], member['start'], member['end'])
+"""
+
+import re
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<line_comment>//[^\n]*)
+  | (?P<block_comment>/\*)
+  | (?P<string>r?(?:'''|\"\"\"|'|"))
+  | (?P<id>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<num>0[xX][0-9a-fA-F]+|\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<op>=>|==|!=|<=|>=|\?\?=|\?\?|\?\.|\.\.\.|\.\.|&&|\|\||[-+*/%~^&|]=|.)
+""", re.VERBOSE | re.DOTALL)
+
+_BLOCK_COMMENT_EDGE = re.compile(r'/\*|\*/')
+
+# 구조 표시: 주석, 문자열(보간이 없으면 정규식 안에서 통째로, 있으면 시작만), 화살표, 중괄호, 문장 끝
+# 앞의 lookahead로 후보 글자가 아닌 위치는 정규식 엔진이 바로 건너뜀 (raw 문자열은 r 접두어를 따로 확인)
+_STRUCTURE = re.compile(r"""(?=[/'"={};])(?:
+    //[^\n]*
+  | /\*
+  | '''[^'\\$]*(?:(?:\\.|\$(?!\{)|'(?!''))[^'\\$]*)*'''
+  | \"\"\"[^"\\$]*(?:(?:\\.|\$(?!\{)|"(?!""))[^"\\$]*)*\"\"\"
+  | '''|\"\"\"
+  | '[^'\\\n$]*(?:(?:\\.|\$(?!\{))[^'\\\n$]*)*'
+  | "[^"\\\n$]*(?:(?:\\.|\$(?!\{))[^"\\\n$]*)*"
+  | ['"]
+  | =>|[{};]
+)""", re.VERBOSE)
+
+# 따옴표별 문자열 안의 특수 문자 (이스케이프, 보간 시작, 닫는 따옴표)
+_STRING_SPECIAL = {quote: re.compile(r"\\.|\$\{|" + re.escape(quote), re.DOTALL)
+                   for quote in ("'''", '"""', "'", '"')}
+
+_OPENERS = {'(': ')', '[': ']', '{': '}'}
+_CLOSERS = {')': '(', ']': '[', '}': '{'}
+
+_TYPE_KEYWORDS = ('class', 'mixin', 'extension', 'enum')
+
+
+class Token:
+    """토큰 (kind: id / num / str / op / comment)"""
+
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r}, {self.start}, {self.end})"
+
+
+def _skip_block_comment(text, pos):
+    """pos('/*' 다음)부터 중첩된 블록 주석의 끝 위치"""
+    depth = 1
+    for match in _BLOCK_COMMENT_EDGE.finditer(text, pos):
+        depth += 1 if match.group() == '/*' else -1
+        if depth == 0:
+            return match.end()
+    return len(text)
+
+
+def _skip_string(text, pos, quote, raw):
+    """pos(여는 따옴표 다음)부터 문자열 끝 위치 (보간 ${...}은 코드로 건너뜀)"""
+    if raw:
+        end = text.find(quote, pos)
+        return len(text) if end < 0 else end + len(quote)
+    special = _STRING_SPECIAL[quote]
+    while True:
+        match = special.search(text, pos)
+        if match is None:
+            return len(text)
+        token = match.group()
+        if token == quote:
+            return match.end()
+        pos = _skip_interpolation(text, match.end()) if token == '${' else match.end()
+
+
+def _skip_interpolation(text, pos):
+    """pos('${' 다음)부터 짝이 맞는 '}' 다음 위치"""
+    depth = 0
+    length = len(text)
+    while pos < length:
+        match = _TOKEN.match(text, pos)
+        kind, value = match.lastgroup, match.group()
+        if kind == 'block_comment':
+            pos = _skip_block_comment(text, match.end())
+        elif kind == 'string':
+            pos = _skip_string(text, match.end(), value.lstrip('r'), value.startswith('r'))
+        else:
+            pos = match.end()
+            if value == '{':
+                depth += 1
+            elif value == '}':
+                if depth == 0:
+                    return pos
+                depth -= 1
+    return length
+
+
+def tokenize(text):
+    """소스 전체를 한 번 훑어 토큰 목록 생성 (공백 제외, 주석은 comment 토큰)"""
+    tokens = []
+    append = tokens.append
+    match_token = _TOKEN.match
+    pos, length = 0, len(text)
+    while pos < length:
+        match = match_token(text, pos)
+        kind = match.lastgroup
+        end = match.end()
+        if kind == 'ws':
+            pos = end
+            continue
+        if kind == 'line_comment':
+            append(Token('comment', match.group(), pos, end))
+        elif kind == 'block_comment':
+            end = _skip_block_comment(text, end)
+            append(Token('comment', text[pos:pos + 3], pos, end))
+        elif kind == 'string':
+            value = match.group()
+            end = _skip_string(text, end, value.lstrip('r'), value.startswith('r'))
+            append(Token('str', None, pos, end))
+        else:
+            append(Token(kind, match.group(), pos, end))
+        pos = end
+    return tokens
+
+
+def match_brackets(tokens):
+    """여는 괄호 토큰 위치 → 닫는 괄호 토큰 위치 (짝이 없으면 토큰 끝)"""
+    pairs = [None] * len(tokens)
+    stack = []
+    for i, token in enumerate(tokens):
+        if token.kind != 'op':
+            continue
+        value = token.value
+        if value in _OPENERS:
+            stack.append(i)
+        elif value in _CLOSERS:
+            # 짝이 틀린 괄호(잘린 코드 등)는 같은 종류의 여는 괄호까지 닫음
+            while stack:
+                opener = stack.pop()
+                pairs[opener] = i
+                if tokens[opener].value == _CLOSERS[value]:
+                    break
+    for opener in stack:
+        pairs[opener] = len(tokens) - 1
+    return pairs
+
+
+def _code_indexes(tokens, lo, hi, pairs):
+    """[lo, hi) 중 주석을 뺀 토큰 위치 (괄호 묶음은 여는 괄호 하나로 대표, 어노테이션 제외)"""
+    indexes = []
+    i = lo
+    while i < hi:
+        token = tokens[i]
+        if token.kind == 'comment':
+            i += 1
+            continue
+        if token.value == '@':
+            # @override, @Deprecated('...'), @pkg.Annotation(...)
+            i += 2
+            while i + 1 < hi and tokens[i].value == '.' and tokens[i + 1].kind == 'id':
+                i += 2
+            if i < hi and tokens[i].value == '(':
+                i = pairs[i] + 1
+            continue
+        indexes.append(i)
+        i = pairs[i] + 1 if token.value in _OPENERS else i + 1
+    return indexes
+
+
+def _declaration(tokens, indexes, class_name):
+    """선언 머리 토큰(위치 목록)이 함수/메서드면 (이름, 종류), 아니면 None"""
+    angle = 0
+    for n, i in enumerate(indexes):
+        token = tokens[i]
+        value = token.value
+        if value == '<':
+            angle += 1
+        elif value == '>':
+            angle = max(0, angle - 1)
+        elif angle:
+            continue
+        elif value == 'operator':
+            # operator ==(...), operator [](...), operator []=(...)
+            symbol = []
+            for j in indexes[n + 1:]:
+                if tokens[j].value == '(':
+                    break
+                symbol.append(tokens[j].value + (']' if tokens[j].value == '[' else ''))
+            return f"operator {''.join(symbol)}", 'operator'
+        elif value == '=':
+            return None  # 필드/변수 초기화 (클로저 값 포함)
+        elif value == 'get' and n + 1 < len(indexes) and tokens[indexes[n + 1]].kind == 'id' \
+                and (n + 2 == len(indexes) or tokens[indexes[n + 2]].value != '('):
+            return tokens[indexes[n + 1]].value, 'getter'
+        elif value == '(':
+            name_at = n - 1
+            if name_at >= 0 and tokens[indexes[name_at]].value == '>':
+                # 타입 매개변수: name<T>(...)
+                depth = 0
+                while name_at >= 0:
+                    inner = tokens[indexes[name_at]].value
+                    depth += 1 if inner == '>' else -1 if inner == '<' else 0
+                    name_at -= 1
+                    if depth == 0:
+                        break
+            if name_at < 0 or tokens[indexes[name_at]].kind != 'id':
+                return None
+            name = tokens[indexes[name_at]].value
+            if name == 'Function':
+                continue  # 함수 타입 (void Function(int) name(...))
+            previous = tokens[indexes[name_at - 1]].value if name_at > 0 else None
+            if previous == '.' and name_at >= 2:
+                return f"{tokens[indexes[name_at - 2]].value}.{name}", 'constructor'
+            if previous == 'set':
+                return name, 'setter'
+            if name == class_name or any(tokens[j].value == 'factory' for j in indexes[:name_at]):
+                return name, 'constructor'
+            return name, 'method' if class_name is not None else 'function'
+    return None
+
+
+def _type_name(tokens, indexes):
+    """클래스/믹스인/확장/enum 선언 머리 → (키워드, 이름) (선언이 아니면 None)"""
+    for n, i in enumerate(indexes):
+        if tokens[i].value in _TYPE_KEYWORDS:
+            following = tokens[indexes[n + 1]] if n + 1 < len(indexes) else None
+            name = following.value if following is not None and following.kind == 'id' \
+                and following.value != 'on' else None
+            return tokens[i].value, name
+    return None
+
+
+def scan_structure(text):
+    """소스 전체를 한 번 훑어 구조 표시('{', '}', ';', '=>') 목록 생성 → [(값, 시작, 끝)]
+
+    주석과 문자열은 건너뛰므로 그 안의 중괄호는 세지 않습니다. 보간이 없는 문자열과 한 줄 주석은
+    정규식 엔진 안에서 통째로 넘어가고, 보간 문자열/블록 주석만 Python에서 끝을 찾습니다.
+    소괄호/대괄호는 표시하지 않습니다 (중괄호 짝은 소괄호와 상관없이 맞으므로,
+    매개변수 목록 안의 '{'는 _scan_members가 선언 머리의 열린 괄호로 판별).
+    """
+    marks = []
+    append = marks.append
+    finditer = _STRUCTURE.finditer
+    pos = 0
+    length = len(text)
+    while pos < length:
+        for match in finditer(text, pos):
+            value = match.group()
+            first = value[0]
+            if first in '{};=':
+                append((value, match.start(), match.end()))
+            elif first == '/':
+                if value == '/*':
+                    pos = _skip_block_comment(text, match.end())
+                    break
+            else:
+                start = match.start()
+                raw = start > 0 and text[start - 1] == 'r' and \
+                    (start < 2 or not (text[start - 2].isalnum() or text[start - 2] in '_$'))
+                quote = value[:3] if value[:3] in ("'''", '"""') else first
+                if raw or len(value) == len(quote):
+                    # raw 문자열(이스케이프 없음) 또는 보간 ${...}이 있는 문자열
+                    pos = _skip_string(text, start + len(quote), quote, raw)
+                    break
+        else:
+            return marks
+    return marks
+
+
+def _match_marks(marks):
+    """'{' 표시 위치 → 짝이 맞는 '}' 표시 위치 (짝이 없으면 마지막 표시)"""
+    pairs = [None] * len(marks)
+    stack = []
+    for i, (value, _, _) in enumerate(marks):
+        if value == '{':
+            stack.append(i)
+        elif value == '}' and stack:
+            pairs[stack.pop()] = i
+    for opener in stack:
+        pairs[opener] = len(marks) - 1
+    return pairs
+
+
+def _header(text, lo, hi):
+    """선언 머리 text[lo:hi] → (토큰, 괄호 짝, 첫 코드 토큰 위치) (코드가 없으면 None)"""
+    tokens = tokenize(text[lo:hi])
+    first = next((n for n, token in enumerate(tokens) if token.kind != 'comment'), None)
+    if first is None:
+        return None
+    return tokens, match_brackets(tokens), first
+
+
+def _inside_brackets(tokens):
+    """머리가 닫히지 않은 ( 또는 [ 로 끝나는지 (표시가 매개변수 목록/인자 안에 있음)"""
+    depth = 0
+    for token in tokens:
+        if token.kind == 'op':
+            value = token.value
+            if value == '(' or value == '[':
+                depth += 1
+            elif value == ')' or value == ']':
+                depth -= 1
+    return depth > 0
+
+
+def _declaration_start(header_text, tokens, first):
+    """머리 안에서 선언 시작 오프셋 (바로 위의 /// 문서 주석 포함, 빈 줄로 떨어진 주석은 제외)"""
+    start = tokens[first].start
+    i = first - 1
+    while i >= 0 and tokens[i].value.startswith(('///', '/**')):
+        if header_text.count('\n', tokens[i].end, start) > 1:
+            break
+        start = tokens[i].start
+        i -= 1
+    return start
+
+
+def _scan_members(text, marks, pairs, lo, hi, body_start, class_name, members):
+    """marks[lo:hi] 범위(최상위 또는 클래스 본문)에서 선언을 찾아 members에 추가
+
+    body_start: 범위의 첫 선언이 시작할 수 있는 문자 위치
+    """
+    segment = body_start  # 현재 선언 머리의 시작 문자 위치
+    i = lo
+    while i < hi:
+        value, mark_start, mark_end = marks[i]
+        if value == ';' or value == '}':
+            segment = mark_end
+            i += 1
+            continue
+
+        # '{' 또는 '=>': 앞부분(선언 머리)만 토큰으로 나눠 무엇의 본문인지 판별
+        header = _header(text, segment, mark_start)
+        if header is None or _inside_brackets(header[0]):
+            # 이름 있는 매개변수 {...}, 인자로 넘긴 클로저: 머리가 계속 이어짐
+            i = pairs[i] + 1 if value == '{' else i + 1
+            continue
+        tokens, token_pairs, first = header
+        indexes = _code_indexes(tokens, first, len(tokens), token_pairs)
+        type_decl = _type_name(tokens, indexes) if value == '{' else None
+        if type_decl is not None:
+            # enum 본문은 값 목록 다음 ';' 이후가 멤버
+            body_end = pairs[i]
+            _scan_members(text, marks, pairs, i + 1, body_end, mark_end, type_decl[1], members)
+            segment = marks[body_end][2]
+            i = body_end + 1
+            continue
+        declaration = _declaration(tokens, indexes, class_name)
+        if declaration is None:
+            # 필드 초기화 클로저/컬렉션 리터럴: 선언은 ';'까지 이어짐
+            i = pairs[i] + 1 if value == '{' else i + 1
+            continue
+
+        if value == '{':
+            end_index = pairs[i]
+        else:
+            end_index = i + 1
+            while end_index < hi and marks[end_index][0] != ';':
+                if marks[end_index][0] == '{':
+                    end_index = pairs[end_index]
+                end_index += 1
+            end_index = min(end_index, len(marks) - 1)
+        name, kind = declaration
+        header_text = text[segment:mark_start]
+        start = segment + _declaration_start(header_text, tokens, first)
+        end = marks[end_index][2]
+        members.append({
+            'name': name,
+            'kind': kind,
+            'class': class_name,
+            'signature': ' '.join(header_text[tokens[first].start:].split()),
+            'arrow': value == '=>',
+            'start': start,
+            'end': end,
+            'code': text[start:end],
+        })
+        segment = end
+        i = end_index + 1
+
+
+def extract_members(text):
+    """소스 → 선언 목록 (파일 순서)
+
+    각 항목: name, kind(method/function/getter/setter/constructor/operator), class(최상위면 None),
+    signature(본문 앞까지), arrow(화살표 본문 여부), start/end(문자 위치), code
+    """
+    marks = scan_structure(text)
+    pairs = _match_marks(marks)
+    members = []
+    _scan_members(text, marks, pairs, 0, len(marks), 0, None, members)
+    return members
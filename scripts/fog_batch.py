@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Firestore 조회 합치기 (singleflight + micro-batch, asyncio 서버용)
+
+뷰포트가 열리면 같은 사용자의 타일 요청 수십 개가 한꺼번에 들어옵니다.
+타일마다 doc_ref.get()을 하면 Firestore 왕복이 타일 수만큼 생기고,
+재시도/여러 클라이언트로 같은 타일이 동시에 요청되면 같은 문서를 여러 번 읽습니다.
+
+- SingleFlight: 같은 키의 조회가 진행 중이면 새로 조회하지 않고 그 결과를 함께 기다림
+- FirestoreLookupBatcher: batch window(기본 2ms) 동안 들어온 서로 다른 타일 조회를 모아
+  get_all 한 번으로 처리 (한 번에 최대 GET_ALL_CHUNK_SIZE 문서, 넘치면 바로 보냄)
+
+설정 (환경변수):
+    FOG_BATCH_WINDOW_MS    조회를 모으는 시간 (ms, 기본 2, 0이면 같은 이벤트 루프 차례에 들어온 것만)
+
+사용 예:
+    flights = SingleFlight()
+    batcher = FirestoreLookupBatcher(firestore_async.client())
+    level = await flights.do(('tile', user_id, tile_id),
+                             lambda: batcher.fog_level(user_id, tile_id))
+"""
+
+import asyncio
+import os
+from fog_viewport import GET_ALL_CHUNK_SIZE
+
+DEFAULT_BATCH_WINDOW_MS = 2.0
+
+DEFAULT_FOG_LEVEL = 3
+
+
+def batch_window_from_env():
+    """FOG_BATCH_WINDOW_MS 환경변수 → 초"""
+    try:
+        window_ms = float(os.environ.get('FOG_BATCH_WINDOW_MS', DEFAULT_BATCH_WINDOW_MS))
+    except ValueError:
+        window_ms = DEFAULT_BATCH_WINDOW_MS
+    return max(0.0, window_ms) / 1000.0
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 비동기 조회를 하나로 합침
+
+    조회는 별도 태스크로 실행하므로, 먼저 요청한 쪽이 취소(연결 끊김)되어도
+    함께 기다리던 요청은 결과를 받습니다.
+    """
+
+    def __init__(self):
+        self._calls = {}   # 키 → 진행 중인 Task
+        self.executed = 0  # 실제로 실행한 조회 수
+        self.merged = 0    # 진행 중인 조회에 합쳐진 요청 수
+
+    async def do(self, key, func):
+        """func()(코루틴 함수)를 키당 하나만 실행하고 결과 반환"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executed += 1
+        else:
+            self.merged += 1
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class FirestoreLookupBatcher:
+    """짧은 시간 동안 들어온 타일 문서 조회를 get_all 한 번으로 묶음 (비동기 클라이언트)"""
+
+    def __init__(self, async_db, window=None, max_batch=GET_ALL_CHUNK_SIZE):
+        self.async_db = async_db
+        self.window = batch_window_from_env() if window is None else window
+        self.max_batch = max_batch
+        self._pending = {}   # (user_id, tile_id) → Future
+        self._timer = None
+        self._tasks = set()  # 진행 중인 get_all 태스크 (GC 방지)
+        self.batches = 0     # get_all 호출 수
+        self.documents = 0   # get_all로 읽은 문서 수
+
+    def _doc_ref(self, user_id, tile_id):
+        return (self.async_db.collection('visits_tiles').document(user_id)
+                .collection('visited').document(tile_id))
+
+    async def fog_level(self, user_id, tile_id):
+        """타일 fog level (방문 기록이 없으면 3)"""
+        key = (user_id, tile_id)
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        """모인 조회를 get_all 태스크로 보냄"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        task = asyncio.ensure_future(self._resolve(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, pending):
+        self.batches += 1
+        self.documents += len(pending)
+        try:
+            found = {}
+            refs = [self._doc_ref(user_id, tile_id) for user_id, tile_id in pending]
+            async for doc in self.async_db.get_all(refs):
+                # get_all 응답 순서는 요청 순서와 다를 수 있으므로 문서 경로로 매칭
+                if doc.exists:
+                    user_id = doc.reference.parent.parent.id
+                    found[(user_id, doc.id)] = (doc.to_dict() or {}).get('fogLevel', DEFAULT_FOG_LEVEL)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(found.get(key, DEFAULT_FOG_LEVEL))
+
+    def stats(self):
+        return {"batches": self.batches, "documents": self.documents, "pending": len(self._pending)}
@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+"""
+Fog 타일 서버 부하 테스트 / 벤치마크
+
+시드로 고정된 가상 사용자(방문 타일 집합)를 만들고, 실제 앱처럼 지도를 이동(pan)/
+확대·축소(zoom)하는 뷰포트 경로를 타일 서버에 재생합니다. 같은 시드면 언제 실행해도
+같은 요청 순서가 나오므로 버전 간 결과를 JSON으로 비교할 수 있습니다.
+
+- 서버: firestore / adc (HTTPServer), async (asyncio), tile (개발용 합성 타일) 또는 --url
+- 데이터: 프로세스 내 Firestore 대역(fog_fake_firestore.py), Firestore 에뮬레이터,
+          또는 로컬 저장소(fog_store.py: memory / sqlite)
+- 결과: 처리량, 지연 p50/p95/p99, 타일당 바이트, 요청당 CPU 시간
+
+사용법:
+    python fog_bench.py run --server async --users 50 --seed 1 --output bench_async.json
+    python fog_bench.py run --server firestore --latency-ms 5 --concurrency 8
+    python fog_bench.py run --server async --accept image/webp   # WebP 협상 (타일당 바이트 비교)
+    python fog_bench.py run --server async --backend sqlite      # 임시 SQLite 파일 (인덱스 없음)
+    python fog_bench.py run --server async --group-size 20       # 20명 그룹 합성 타일 (fog_group.py)
+    FIRESTORE_EMULATOR_HOST=localhost:8081 python fog_bench.py run --server async --backend emulator
+    python fog_bench.py run --url http://localhost:8080          # 이미 실행 중인 서버
+    python fog_bench.py run --server async --render mask --metatile 8 --warm-pass
+    python fog_bench.py render --server async --metatile 8       # 같은 요청을 flat / mask로 재생해 비율 출력
+    python fog_bench.py compare bench_old.json bench_new.json
+"""
+
+import argparse
+import asyncio
+import http.client
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import HTTPServer
+from urllib.parse import urlparse
+from fog_fake_firestore import AsyncFakeFirestore, FakeFirestore
+from fog_group import GroupComposer, GroupDirectory
+from fog_index import VisitIndexRegistry, tile_key
+from fog_metrics import REQUEST_LOG
+from fog_prefetch import TilePrefetcher
+from fog_store import FirestoreFogStore, create_store
+from fog_tiles import RENDER_MODES
+from fog_viewport import VIEWPORT_FORMATS
+
+SERVERS = ('firestore', 'adc', 'async', 'tile')
+BACKENDS = ('fake', 'emulator', 'memory', 'sqlite')
+
+# 가상 사용자 기본 위치 (서울 시청) 와 방문 기록 줌
+HOME_LAT, HOME_LON = 37.5665, 126.9780
+VISIT_ZOOM = 15
+
+# 휴대폰 화면 크기의 뷰포트 (타일 수)
+VIEWPORT_WIDTH, VIEWPORT_HEIGHT = 5, 8
+MIN_TRACE_ZOOM, MAX_TRACE_ZOOM = 12, 17
+
+EMULATOR_PROJECT_ID = 'demo-fog-bench'
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """경위도 → 타일 좌표 (Web Mercator)"""
+    n = 1 << zoom
+    lat_rad = math.radians(lat)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def tile_center(zoom, x, y):
+    """타일 중심 (위도, 경도)"""
+    n = 1 << zoom
+    lon = (x + 0.5) / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+def synthetic_user(rng, user_id, walk_steps):
+    """무작위 산책 경로로 방문 문서 생성 → (tile_id → 문서, 방문 지점 목록)
+
+    방문 지점이 있는 타일은 fogLevel 1, 그 주변 8개 타일은 fogLevel 2 (앱 FogService와 같은 구분)
+    """
+    lat = HOME_LAT + rng.uniform(-0.05, 0.05)
+    lon = HOME_LON + rng.uniform(-0.05, 0.05)
+    visited_at = datetime(2025, 10, 1, tzinfo=timezone.utc).timestamp()
+    docs = {}
+    points = []
+    for step in range(walk_steps):
+        heading = rng.uniform(0, 2 * math.pi)
+        meters = rng.uniform(50, 250)
+        lat += meters * math.cos(heading) / 111_320.0
+        lon += meters * math.sin(heading) / (111_320.0 * math.cos(math.radians(lat)))
+        points.append((lat, lon))
+
+        x, y = lonlat_to_tile(lon, lat, VISIT_ZOOM)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                level = 1 if dx == dy == 0 else 2
+                tile_id = tile_key(VISIT_ZOOM, x + dx, y + dy)
+                old = docs.get(tile_id)
+                if old is not None and old['fogLevel'] <= level:
+                    continue
+                center_lat, center_lon = tile_center(VISIT_ZOOM, x + dx, y + dy)
+                docs[tile_id] = {
+                    'fogLevel': level,
+                    'distance': haversine_km(lat, lon, center_lat, center_lon),
+                    'visitedAt': visited_at + step * 60,
+                    'location': {'latitude': lat, 'longitude': lon},
+                }
+    return docs, points
+
+
+def synthetic_users(count, seed, walk_steps=60):
+    """시드 고정 가상 사용자 {user_id: (문서, 방문 지점)}"""
+    rng = random.Random(seed)
+    return {f"bench-user-{i:04d}": synthetic_user(rng, f"bench-user-{i:04d}", walk_steps)
+            for i in range(count)}
+
+
+def viewport_trace(rng, points, steps):
+    """앱 사용 흐름을 흉내 낸 뷰포트 목록 [(zoom, x0, y0, x1, y1), ...]
+
+    70% 한 타일씩 이동, 20% 확대/축소, 10% 다른 방문 지점으로 점프
+    """
+    zoom = VISIT_ZOOM
+    lat, lon = points[0]
+    cx, cy = lonlat_to_tile(lon, lat, zoom)
+    trace = []
+    for _ in range(steps):
+        roll = rng.random()
+        if roll < 0.7:
+            cx += rng.choice((-1, 0, 1))
+            cy += rng.choice((-1, 0, 1))
+        elif roll < 0.9:
+            new_zoom = min(MAX_TRACE_ZOOM, max(MIN_TRACE_ZOOM, zoom + rng.choice((-1, 1))))
+            if new_zoom > zoom:
+                cx, cy = cx * 2, cy * 2
+            elif new_zoom < zoom:
+                cx, cy = cx // 2, cy // 2
+            zoom = new_zoom
+        else:
+            lat, lon = rng.choice(points)
+            cx, cy = lonlat_to_tile(lon, lat, zoom)
+        x0, y0 = cx - VIEWPORT_WIDTH // 2, cy - VIEWPORT_HEIGHT // 2
+        trace.append((zoom, x0, y0, x0 + VIEWPORT_WIDTH - 1, y0 + VIEWPORT_HEIGHT - 1))
+    return trace
+
+
+def trace_requests(user_id, trace, mode, viewport_format='bin', members=None):
+    """뷰포트 목록 → 요청 경로 목록 (tiles: 타일마다, viewport: 뷰포트 API 한 번)
+
+    members를 주면 그룹 합성 경로(/groups/_/...?users=...)로 요청합니다.
+    """
+    users = f"users={','.join(members)}" if members else None
+    paths = []
+    for zoom, x0, y0, x1, y1 in trace:
+        if mode == 'viewport':
+            prefix = f"/groups/_/viewport/{zoom}?{users}&" if users else f"/viewport/{user_id}/{zoom}?"
+            paths.append(f"{prefix}x0={x0}&y0={y0}&x1={x1}&y1={y1}&format={viewport_format}")
+            continue
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                if users:
+                    paths.append(f"/groups/_/tiles/{zoom}/{x}/{y}.png?{users}")
+                else:
+                    paths.append(f"/tiles/{user_id}/{zoom}/{x}/{y}.png")
+    return paths
+
+
+def build_workload(args):
+    """(사용자 데이터, 사용자별 요청 경로 목록) — 같은 시드면 항상 같은 결과"""
+    users = synthetic_users(args.users, args.seed, args.walk_steps)
+    rng = random.Random(args.seed + 1)
+    user_ids = list(users)
+    workload = []
+    for i, (user_id, (_, points)) in enumerate(users.items()):
+        trace = viewport_trace(rng, points, args.steps)
+        # --group-size N: 이 사용자부터 N명을 한 그룹으로 묶어 같은 경로를 그룹 타일로 요청
+        members = None
+        if args.group_size > 1:
+            members = [user_ids[(i + k) % len(user_ids)] for k in range(args.group_size)]
+        workload.append((user_id, trace_requests(user_id, trace, args.mode, args.viewport_format,
+                                                 members)))
+    return users, workload
+
+
+def visit_documents(users):
+    """가상 사용자 → {(visits_tiles, userId, visited, tileId): 문서}"""
+    return {('visits_tiles', user_id, 'visited', tile_id): doc
+            for user_id, (docs, _) in users.items()
+            for tile_id, doc in docs.items()}
+
+
+def _batch_options(args):
+    """--no-batch / --batch-window-ms → FirestoreFogStore 인자"""
+    window = args.batch_window_ms / 1000.0 if args.batch_window_ms is not None else None
+    return {"batch": not args.no_batch, "batch_window": window}
+
+
+def create_backend(args, users):
+    """저장소 생성 후 가상 사용자 적재 → (FogStore, 인덱스용 동기 db 또는 None, 정리 함수)"""
+    if args.backend == 'fake':
+        db = FakeFirestore(latency=args.latency_ms / 1000.0)
+        db.load(visit_documents(users))
+        return FirestoreFogStore(db, AsyncFakeFirestore(db), **_batch_options(args)), db, None
+
+    if args.backend in ('memory', 'sqlite'):
+        # 로컬 저장소는 조회가 프로세스 안에서 끝나므로 스냅샷 리스너 인덱스 없이 사용
+        workdir = tempfile.mkdtemp(prefix='fog_bench_') if args.backend == 'sqlite' else None
+        store = create_store('memory' if workdir is None else f"sqlite:{os.path.join(workdir, 'fog.db')}")
+        store.put_many([(user_id, tile_id, doc)
+                        for (_, user_id, _, tile_id), doc in visit_documents(users).items()])
+
+        def cleanup():
+            store.close()
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+        return store, None, cleanup
+
+    # Firestore 에뮬레이터 (FIRESTORE_EMULATOR_HOST 필요, 인증 없음)
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        raise SystemExit("❌ --backend emulator 는 FIRESTORE_EMULATOR_HOST 환경변수가 필요합니다")
+    import firebase_admin
+    from firebase_admin import firestore, firestore_async
+    from google.cloud.firestore import GeoPoint
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(options={'projectId': EMULATOR_PROJECT_ID})
+    db = firestore.client()
+    batch, pending = db.batch(), 0
+    for (_, user_id, _, tile_id), doc in visit_documents(users).items():
+        data = dict(doc, location=GeoPoint(**doc['location']))
+        ref = db.collection('visits_tiles').document(user_id).collection('visited').document(tile_id)
+        batch.set(ref, data)
+        pending += 1
+        if pending == 500:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return FirestoreFogStore(db, firestore_async.client(), **_batch_options(args)), db, None
+
+
+def _start_http_server(handler):
+    httpd = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        httpd.shutdown()
+        httpd.server_close()
+    return f"http://127.0.0.1:{httpd.server_address[1]}", stop
+
+
+def start_server(args, store, db):
+    """벤치마크 대상 서버를 프로세스 안에서 시작 → (base_url, stop 함수, 미리 읽기 또는 None)"""
+    visit_index = None if args.no_index or db is None else VisitIndexRegistry(db)
+
+    if args.server == 'tile':
+        from tile_server import TileHandler
+        return _start_http_server(TileHandler) + (None,)
+
+    mask_renderer = None
+    if args.render == 'mask':
+        from fog_mask import FogMaskRenderer
+
+    if args.server in ('firestore', 'adc'):
+        module = importlib.import_module(
+            'fog_server_with_firestore' if args.server == 'firestore' else 'fog_server_adc')
+        handler = module.FogTileHandler
+        # 동기 서버의 마스크 렌더러는 모듈 전역 (FOG_RENDER_MODE로 정해짐) → 측정 동안만 교체
+        server_module = importlib.import_module('fog_server_with_firestore')
+        previous_renderer = server_module.MASK_RENDERER
+        if args.render == 'mask':
+            server_module.MASK_RENDERER = FogMaskRenderer(server_module.TILE_CACHE, metatile=args.metatile)
+        elif args.render == 'flat':
+            server_module.MASK_RENDERER = None
+        handler.store = store
+        handler.visit_index = visit_index
+        handler.prefetcher = TilePrefetcher(module.prefetch_load) if args.prefetch else None
+        handler.groups = GroupDirectory(path='')
+        handler.composer = GroupComposer()
+        base_url, stop_http = _start_http_server(handler)
+
+        def stop():
+            stop_http()
+            server_module.MASK_RENDERER = previous_renderer
+            if handler.prefetcher is not None:
+                handler.prefetcher.close()
+            if visit_index is not None:
+                visit_index.close()
+        return base_url, stop, handler.prefetcher
+
+    from fog_server_async import TILE_CACHE, AsyncFogTileServer
+    if args.render == 'mask':
+        mask_renderer = FogMaskRenderer(TILE_CACHE, metatile=args.metatile)
+    loop = asyncio.new_event_loop()
+    server = AsyncFogTileServer(store, concurrency=args.server_concurrency,
+                                visit_index=visit_index, mask_renderer=mask_renderer)
+    if args.prefetch:
+        server.start_prefetcher()
+    httpd = loop.run_until_complete(
+        asyncio.start_server(server.handle_connection, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    port = httpd.sockets[0].getsockname()[1]
+
+    def stop():
+        async def close():
+            httpd.close()
+            # 클라이언트가 연결을 닫았으므로 연결 처리 태스크가 끝나기를 잠시 기다림
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=2.0)
+            await httpd.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        if server.prefetcher is not None:
+            server.prefetcher.close()
+        if visit_index is not None:
+            visit_index.close()
+    return f"http://127.0.0.1:{port}", stop, server.prefetcher
+
+
+class Worker(threading.Thread):
+    """keep-alive 연결 하나로 맡은 사용자들의 요청을 순서대로 재생"""
+
+    def __init__(self, base_url, jobs, use_etags, accept=None):
+        super().__init__(daemon=True)
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.jobs = jobs
+        self.use_etags = use_etags
+        self.accept = accept
+        self.samples = []  # (지연 초, 상태 코드, 본문 바이트, 타일 요청 여부)
+        self.cpu_seconds = 0.0
+
+    def run(self):
+        cpu_started = time.thread_time()
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        for _, paths in self.jobs:
+            etags = {}
+            for path in paths:
+                headers = {'Accept': self.accept} if self.accept else {}
+                if self.use_etags and path in etags:
+                    headers['If-None-Match'] = etags[path]
+                started = time.perf_counter()
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    status = response.status
+                    etag = response.getheader('ETag')
+                    if response.getheader('Connection', '').lower() == 'close' or response.will_close:
+                        conn.close()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    body, status, etag = b'', 0, None
+                self.samples.append((time.perf_counter() - started, status, len(body),
+                                     '/tiles/' in path))
+                if etag:
+                    etags[path] = etag
+        conn.close()
+        self.cpu_seconds = time.thread_time() - cpu_started
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank 백분위수"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_load(base_url, workload, concurrency, use_etags, in_process, accept=None):
+    """요청 재생 후 결과 요약 dict"""
+    jobs = [workload[i::concurrency] for i in range(concurrency)]
+    workers = [Worker(base_url, job, use_etags, accept) for job in jobs if job]
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    process_cpu = time.process_time() - cpu_started
+
+    samples = [sample for worker in workers for sample in worker.samples]
+    latencies = sorted(sample[0] for sample in samples)
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    tile_bodies = [size for _, status, size, is_tile in samples if is_tile and status == 200]
+    client_cpu = sum(worker.cpu_seconds for worker in workers)
+    count = len(samples)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "requests": count,
+        "elapsedSeconds": round(elapsed, 3),
+        "throughputRps": round(count / elapsed, 1) if elapsed else None,
+        "latencyMs": {
+            "mean": ms(sum(latencies) / count) if count else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]) if latencies else None,
+        },
+        "statuses": statuses,
+        "bytesPerTile": round(sum(tile_bodies) / len(tile_bodies), 1) if tile_bodies else None,
+        "bytesPerRequest": round(sum(sample[2] for sample in samples) / count, 1) if count else None,
+        "cpuMsPerRequest": {
+            # 서버를 같은 프로세스에서 실행하면 전체 CPU에서 클라이언트 스레드 CPU를 뺀 값이 서버 몫
+            "server": ms((process_cpu - client_cpu) / count) if in_process and count else None,
+            "client": ms(client_cpu / count) if count else None,
+        },
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def command_run(args):
+    if args.render == 'mask' and args.url is None and (
+            args.server == 'tile' or args.no_index or args.backend not in ('fake', 'emulator')):
+        raise SystemExit("❌ --render mask 는 방문 인덱스가 있는 서버가 필요합니다 (--backend fake/emulator, --no-index 없이)")
+    users, workload = build_workload(args)
+    total_requests = sum(len(paths) for _, paths in workload)
+    print(f"👥 가상 사용자 {len(users)}명, 방문 타일 {sum(len(d) for d, _ in users.values())}개, "
+          f"요청 {total_requests}개 (seed={args.seed}, mode={args.mode})")
+
+    in_process = args.url is None
+    stop = cleanup = db = prefetcher = None
+    if in_process:
+        # 요청 로그 출력이 측정에 섞이지 않도록 샘플링 끔 (오류 로그는 그대로)
+        REQUEST_LOG.sample_rate = 0.0
+        store, db, cleanup = create_backend(args, users) if args.server != 'tile' else (None, None, None)
+        base_url, stop, prefetcher = start_server(args, store, db)
+        print(f"🚀 {args.server} 서버 시작: {base_url} (backend={args.backend})")
+    else:
+        base_url = args.url.rstrip('/')
+        print(f"🎯 외부 서버 대상: {base_url}")
+
+    try:
+        if args.warmup:
+            # 인덱스 로딩/캐시 채우기 (결과에는 포함하지 않음)
+            run_load(base_url, [(user_id, paths[:args.warmup]) for user_id, paths in workload],
+                     args.concurrency, False, in_process, args.accept)
+        round_trips = getattr(db, 'round_trips', None)
+        summary = run_load(base_url, workload, args.concurrency, args.etags, in_process,
+                           args.accept)
+        if round_trips is not None:
+            # Firestore 대역 왕복 수 (get/get_all/stream 각 1회)
+            summary["firestoreRoundTrips"] = db.round_trips - round_trips
+        if args.warm_pass:
+            # 같은 요청을 한 번 더 (렌더링/인코딩 캐시가 찬 상태)
+            summary["warm"] = run_load(base_url, workload, args.concurrency, args.etags, in_process,
+                                       args.accept)
+        if prefetcher is not None:
+            stats = prefetcher.stats()
+            lookups = stats["hits"] + stats["misses"]
+            summary["prefetch"] = dict(stats, hitRate=round(stats["hits"] / lookups, 3) if lookups else None)
+    finally:
+        if stop is not None:
+            stop()
+        if cleanup is not None:
+            cleanup()
+
+    result = {
+        "server": args.server if in_process else args.url,
+        "backend": args.backend if in_process else None,
+        "config": {
+            "seed": args.seed,
+            "users": args.users,
+            "steps": args.steps,
+            "walkSteps": args.walk_steps,
+            "mode": args.mode,
+            "groupSize": args.group_size,
+            "viewportFormat": args.viewport_format if args.mode == 'viewport' else None,
+            "concurrency": args.concurrency,
+            "etags": args.etags,
+            "accept": args.accept,
+            "latencyMs": args.latency_ms,
+            "index": not args.no_index and args.backend in ('fake', 'emulator'),
+            "batchWindowMs": None if args.no_batch else args.batch_window_ms,
+            "prefetch": args.prefetch,
+            "warmup": args.warmup,
+            "render": args.render,
+            "metatile": args.metatile,
+        },
+        "environment": {
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        },
+        "results": summary,
+    }
+
+    latency = summary["latencyMs"]
+    print(f"📊 처리량 {summary['throughputRps']} req/s, 지연 p50={latency['p50']}ms "
+          f"p95={latency['p95']}ms p99={latency['p99']}ms")
+    print(f"   타일당 {summary['bytesPerTile']} bytes, 요청당 CPU {summary['cpuMsPerRequest']}, "
+          f"상태 {summary['statuses']}")
+    if "firestoreRoundTrips" in summary:
+        print(f"   Firestore 왕복 {summary['firestoreRoundTrips']}회")
+    if "warm" in summary:
+        warm = summary["warm"]
+        print(f"   재요청(캐시) 처리량 {warm['throughputRps']} req/s, 지연 p50={warm['latencyMs']['p50']}ms, "
+              f"요청당 CPU {warm['cpuMsPerRequest']}")
+    if "prefetch" in summary:
+        prefetch = summary["prefetch"]
+        print(f"   미리 읽기 적중률 {prefetch['hitRate']} (적중 {prefetch['hits']}, 미스 {prefetch['misses']}, "
+              f"버림 {prefetch['dropped']})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 결과 저장: {args.output}")
+    return result
+
+
+def command_render(args):
+    """같은 작업량을 --render flat / mask 서버에 재생해 마스크 모드의 요청당 비용 비율 출력
+
+    각 모드마다 새 서버(빈 마스크 캐시)에서 처음 재생(cold: 뷰포트 이동으로 겹치는 타일이 섞인 첫 요청)과
+    같은 요청의 재생(warm: 캐시 적중)을 HTTP 요청/응답까지 포함해 잽니다.
+    """
+    if args.mode != 'tiles':
+        raise SystemExit("❌ render 비교는 --mode tiles 에서만 의미가 있습니다")
+    results = {}
+    for render in RENDER_MODES:
+        print(f"\n🎨 --render {render}")
+        results[render] = command_run(argparse.Namespace(
+            **dict(vars(args), render=render, warm_pass=True, output=None)))["results"]
+
+    print(f"\n{'mask / flat':20} {'cold':>10} {'warm':>10}")
+    rows = (("서버 CPU/요청", lambda r: r["cpuMsPerRequest"]["server"]),
+            ("지연 p50", lambda r: r["latencyMs"]["p50"]),
+            ("지연 p95", lambda r: r["latencyMs"]["p95"]),
+            ("처리량 (역수)", lambda r: 1.0 / r["throughputRps"] if r["throughputRps"] else None))
+    ratios = {}
+    for label, metric in rows:
+        cells = []
+        for phase in ('cold', 'warm'):
+            flat = metric(results['flat'] if phase == 'cold' else results['flat']['warm'])
+            mask = metric(results['mask'] if phase == 'cold' else results['mask']['warm'])
+            ratio = round(mask / flat, 2) if flat and mask is not None else None
+            ratios.setdefault(phase, {})[label] = ratio
+            cells.append(f"{ratio}x" if ratio is not None else '-')
+        print(f"{label:20} {cells[0]:>10} {cells[1]:>10}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"results": results, "ratios": ratios}, f, ensure_ascii=False, indent=2)
+        print(f"💾 결과 저장: {args.output}")
+    return ratios
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def command_compare(args):
+    """두 결과 JSON의 수치 비교 (변화율 %)"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = _flatten(json.load(f)["results"])
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = _flatten(json.load(f)["results"])
+
+    print(f"{'metric':32} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for name in sorted(set(baseline) | set(candidate)):
+        old, new = baseline.get(name), candidate.get(name)
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else '-'
+        print(f"{name:32} {old if old is not None else '-':>12} "
+              f"{new if new is not None else '-':>12} {change:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fog 타일 서버 벤치마크")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="가상 사용자 경로 재생")
+    _add_run_arguments(run)
+    run.set_defaults(func=command_run)
+
+    render = sub.add_parser('render', help="같은 경로를 flat / mask 렌더링으로 재생해 비율 비교")
+    _add_run_arguments(render)
+    render.set_defaults(func=command_render)
+
+    compare = sub.add_parser('compare', help="결과 JSON 두 개 비교")
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.set_defaults(func=command_compare)
+    return parser.parse_args(argv)
+
+
+def _add_run_arguments(run):
+    run.add_argument('--server', choices=SERVERS, default='async')
+    run.add_argument('--url', default=None, help="이미 실행 중인 서버 주소 (지정 시 --server 무시)")
+    run.add_argument('--backend', choices=BACKENDS, default='fake',
+                     help="fake: 프로세스 내 Firestore 대역, emulator: FIRESTORE_EMULATOR_HOST, "
+                          "memory/sqlite: 로컬 저장소 (fog_store.py)")
+    run.add_argument('--users', type=int, default=20)
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--steps', type=int, default=30, help="사용자당 뷰포트 이동 횟수")
+    run.add_argument('--walk-steps', type=int, default=60, help="사용자당 방문 지점 수")
+    run.add_argument('--mode', choices=['tiles', 'viewport'], default='tiles')
+    run.add_argument('--viewport-format', choices=VIEWPORT_FORMATS, default='bin',
+                     help="viewport 모드 응답 형식 (rle: run-length varint)")
+    run.add_argument('--group-size', type=int, default=1,
+                     help="N > 1이면 사용자 N명씩 묶어 그룹 합성 타일/뷰포트로 요청 (fog_group.py)")
+    run.add_argument('--concurrency', type=int, default=8, help="동시 클라이언트 연결 수")
+    run.add_argument('--server-concurrency', type=int, default=64, help="async 서버 동시 처리 수")
+    run.add_argument('--etags', action='store_true', help="클라이언트 캐시처럼 If-None-Match 전송")
+    run.add_argument('--accept', default=None,
+                     help="타일 요청 Accept 헤더 (예: image/webp → WebP 응답 크기 측정)")
+    run.add_argument('--latency-ms', type=float, default=0.0, help="Firestore 대역 왕복 지연")
+    run.add_argument('--no-index', action='store_true', help="방문 타일 메모리 인덱스 없이 실행")
+    run.add_argument('--batch-window-ms', type=float, default=None,
+                     help="async 서버의 Firestore 타일 조회 묶음 시간 (기본: FOG_BATCH_WINDOW_MS 또는 2)")
+    run.add_argument('--prefetch', action='store_true',
+                     help="응답한 타일 주변 미리 읽기 사용 (fog_prefetch.py)")
+    run.add_argument('--no-batch', action='store_true', help="타일 조회를 get_all로 묶지 않음")
+    run.add_argument('--warmup', type=int, default=0, help="사용자당 미리 보낼 요청 수 (결과 제외)")
+    run.add_argument('--render', choices=RENDER_MODES, default='flat',
+                     help="타일 렌더링 방식 (mask: 방문 위치 픽셀 마스크, 인덱스 필요)")
+    run.add_argument('--metatile', type=int, default=None,
+                     help="mask 렌더링의 메타타일 크기 (기본: FOG_METATILE 또는 1)")
+    run.add_argument('--warm-pass', action='store_true',
+                     help="같은 요청을 한 번 더 재생해 캐시가 찬 상태도 측정 (결과의 warm)")
+    run.add_argument('--output', default=None, help="결과 JSON 파일")
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+방문 타일 압축 저장소 + 메모리 맵 스냅샷
+
+사용자별·줌별 방문 타일을 정렬된 Morton(Z-order) 키 배열과 타일당 2비트 fog level로
+보관합니다. 타일당 수 바이트(줌 16 이하 4바이트 키 + 2비트)만 사용하므로
+DocumentSnapshot/dict 보다 훨씬 작고, 그대로 파일에 써 두었다가 서버 재시작 시
+mmap으로 열어 복사 없이 바로 조회할 수 있습니다.
+마스크 렌더링용 방문 위치도 같은 방식(PointMap: 정렬된 키 + float64 좌표 배열)으로 보관합니다.
+
+스냅샷 파일 형식 (little-endian):
+    헤더      '<8sIQ'   magic, 섹션 수, 섹션 테이블 오프셋
+    데이터    섹션마다 키 배열(8바이트 정렬) + 2비트 level 배열(8바이트 정렬)
+    테이블    섹션마다 '<HBBIQQ' (userId 길이, zoom, 키 폭, 타일 수, 키 오프셋, level 오프셋) + userId
+
+사용법:
+    python fog_bitmap.py export fog_snapshot.bin      # Firestore 전체 방문 기록 → 스냅샷
+    python fog_bitmap.py info fog_snapshot.bin        # 스냅샷 내용 요약
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+SNAPSHOT_MAGIC = b'FOGSNAP1'
+HEADER = struct.Struct('<8sIQ')
+SECTION = struct.Struct('<HBBIQQ')
+
+# overlay(최근 변경분)가 이 크기를 넘으면 정렬 배열로 다시 압축
+COMPACT_THRESHOLD = 4096
+
+
+# 바이트 → 비트 사이에 0을 끼운 16비트 값 (morton_encode를 비트 대신 바이트 단위로)
+_SPREAD_BYTE = tuple(sum(((b >> bit) & 1) << (2 * bit) for bit in range(8)) for b in range(256))
+
+
+def morton_encode(x, y):
+    """(x, y) → Morton(Z-order) 키 (같은 조상 타일은 연속된 키 범위가 됨)"""
+    key = 0
+    shift = 0
+    while x or y:
+        key |= (_SPREAD_BYTE[x & 0xFF] | _SPREAD_BYTE[y & 0xFF] << 1) << shift
+        x >>= 8
+        y >>= 8
+        shift += 16
+    return key
+
+
+def morton_decode(key):
+    """Morton 키 → (x, y)"""
+    x = y = 0
+    bit = 0
+    while key:
+        x |= (key & 1) << bit
+        y |= ((key >> 1) & 1) << bit
+        key >>= 2
+        bit += 1
+    return x, y
+
+
+def key_typecode(zoom):
+    """줌 16 이하는 4바이트 키, 그 이상은 8바이트 키"""
+    return 'I' if zoom <= 16 else 'Q'
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+class TileLevelMap:
+    """(x, y) → fog level 맵
+
+    기본 데이터는 정렬된 Morton 키 배열 + 2비트 level 바이트열(파일 mmap 뷰일 수 있음)이고,
+    이후 변경은 작은 overlay dict에 쌓였다가 COMPACT_THRESHOLD를 넘으면 다시 압축됩니다.
+    dict처럼 get / [] 대입 / pop / len / items 를 지원합니다.
+    """
+
+    def __init__(self, zoom, keys=None, levels=b'', count=0):
+        self.zoom = zoom
+        self._keys = keys if keys is not None else array(key_typecode(zoom))
+        self._levels = levels
+        self._overlay = {}  # Morton 키 → level (None이면 삭제)
+        self._count = count
+
+    @classmethod
+    def from_packed(cls, zoom, key_bytes, level_bytes, count):
+        """packed() 결과로 다시 만든 맵 (다른 프로세스로 보낼 때)"""
+        keys = array(key_typecode(zoom))
+        keys.frombytes(key_bytes)
+        if sys.byteorder != 'little':
+            keys.byteswap()
+        return cls(zoom, keys, level_bytes, count)
+
+    def _base_get(self, key):
+        keys = self._keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return (self._levels[i >> 2] >> ((i & 3) * 2)) & 0b11
+        return None
+
+    def _lookup(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        return self._base_get(key)
+
+    def get(self, xy, default=None):
+        level = self._lookup(morton_encode(*xy))
+        return default if level is None else level
+
+    def __setitem__(self, xy, level):
+        key = morton_encode(*xy)
+        if self._lookup(key) is None:
+            self._count += 1
+        self._overlay[key] = level & 0b11
+        self._maybe_compact()
+
+    def pop(self, xy, default=None):
+        key = morton_encode(*xy)
+        old = self._lookup(key)
+        if old is None:
+            return default
+        self._overlay[key] = None
+        self._count -= 1
+        self._maybe_compact()
+        return old
+
+    def __len__(self):
+        return self._count
+
+    def sorted_items(self):
+        """(Morton 키, level)를 키 순서대로 반환 (기본 배열 + overlay 병합)"""
+        overlay = self._overlay
+        pending = sorted(overlay.items())
+        j = 0
+        for i, key in enumerate(self._keys):
+            while j < len(pending) and pending[j][0] <= key:
+                if pending[j][1] is not None:
+                    yield pending[j]
+                j += 1
+            if key in overlay:
+                continue
+            yield key, (self._levels[i >> 2] >> ((i & 3) * 2)) & 0b11
+        for key, level in pending[j:]:
+            if level is not None:
+                yield key, level
+
+    def items(self):
+        """((x, y), level) 반환"""
+        for key, level in self.sorted_items():
+            yield morton_decode(key), level
+
+    def parts(self):
+        """(기본 키 배열, 2비트 level 바이트열, overlay 사본) — 벡터 연산용 (overlay 값 None = 삭제)"""
+        return self._keys, self._levels, dict(self._overlay)
+
+    def base(self):
+        """(기본 키 배열, 2비트 level 바이트열) — 복사 없음, compact() 때 새 객체로 바뀜"""
+        return self._keys, self._levels
+
+    def compact(self):
+        """overlay를 정렬 배열에 병합 (mmap 뷰였다면 이 시점에 메모리로 복사됨)"""
+        if not self._overlay:
+            return
+        keys = array(key_typecode(self.zoom))
+        levels = bytearray((self._count + 3) // 4)
+        for i, (key, level) in enumerate(self.sorted_items()):
+            keys.append(key)
+            levels[i >> 2] |= level << ((i & 3) * 2)
+        self._keys = keys
+        self._levels = bytes(levels)
+        self._overlay = {}
+
+    def _maybe_compact(self):
+        if len(self._overlay) > COMPACT_THRESHOLD:
+            self.compact()
+
+    def packed(self):
+        """스냅샷 저장용 (키 바이트, level 바이트, 타일 수)"""
+        self.compact()
+        keys = self._keys
+        if not isinstance(keys, array):
+            keys = array(key_typecode(self.zoom), keys)
+        if sys.byteorder != 'little':
+            keys = array(keys.typecode, keys)
+            keys.byteswap()
+        return keys.tobytes(), bytes(self._levels), self._count
+
+    def nbytes(self):
+        """대략적인 데이터 크기 (키 + level 바이트, overlay 제외)"""
+        return len(self._keys) * self._keys.itemsize + len(self._levels)
+
+
+def point_key(zoom, x, y):
+    """방문 위치 키: 줌(상위 8비트) + Morton 키 (줌 28 이하)"""
+    return zoom << 56 | morton_encode(x, y)
+
+
+class PointMap:
+    """타일 → 방문 위치 (위도, 경도) 맵
+
+    TileLevelMap과 같은 구조로, 정렬된 위치 키(point_key) 배열 + 위도/경도를 이어 붙인
+    array('d')에 보관하고 이후 변경은 overlay dict에 쌓았다가 COMPACT_THRESHOLD를 넘으면 압축합니다.
+    위치 하나에 24바이트(키 8 + 좌표 16)만 쓰고, coords()는 NumPy가 복사 없이 읽을 수 있는 배열입니다.
+    keys가 None이면 키 없는 읽기 전용 위치 목록입니다 (from_coords, 발행된 파일의 mmap 뷰 등).
+    """
+
+    def __init__(self, keys=None, coords=None):
+        self._keys = keys
+        self._coords = coords if coords is not None else array('d')
+        self._overlay = {}  # 위치 키 → (위도, 경도) (None이면 삭제)
+        self._count = len(self._coords) // 2
+
+    @classmethod
+    def from_coords(cls, coords):
+        """위도/경도를 이어 붙인 배열(array('d')/memoryview)로 만든 읽기 전용 맵"""
+        return cls(None, coords)
+
+    def _base_index(self, key):
+        keys = self._keys
+        if keys is None:
+            return None
+        i = bisect_left(keys, key)
+        return i if i < len(keys) and keys[i] == key else None
+
+    def _exists(self, key):
+        if key in self._overlay:
+            return self._overlay[key] is not None
+        return self._base_index(key) is not None
+
+    def set(self, zoom, x, y, location):
+        key = point_key(zoom, x, y)
+        if not self._exists(key):
+            self._count += 1
+        self._overlay[key] = (float(location[0]), float(location[1]))
+        self._maybe_compact()
+
+    def discard(self, zoom, x, y):
+        key = point_key(zoom, x, y)
+        if self._exists(key):
+            self._overlay[key] = None
+            self._count -= 1
+            self._maybe_compact()
+
+    def __len__(self):
+        return self._count
+
+    def sorted_items(self):
+        """(위치 키, (위도, 경도))를 키 순서대로 반환 (키 없는 맵은 순서대로 번호를 키로 씀)"""
+        coords = self._coords
+        keys = self._keys if self._keys is not None else range(len(coords) // 2)
+        overlay = self._overlay
+        pending = sorted(overlay.items())
+        j = 0
+        for i, key in enumerate(keys):
+            while j < len(pending) and pending[j][0] <= key:
+                if pending[j][1] is not None:
+                    yield pending[j]
+                j += 1
+            if key in overlay:
+                continue
+            yield key, (coords[2 * i], coords[2 * i + 1])
+        for key, location in pending[j:]:
+            if location is not None:
+                yield key, location
+
+    def values(self):
+        for _, location in self.sorted_items():
+            yield location
+
+    def coords(self):
+        """위도, 경도를 이어 붙인 배열 (overlay가 없으면 기본 배열 그대로, 있으면 병합한 사본)"""
+        if not self._overlay:
+            return self._coords
+        return array('d', [value for _, location in self.sorted_items() for value in location])
+
+    def compact(self):
+        if not self._overlay:
+            return
+        keys = array('Q')
+        coords = array('d')
+        for key, (lat, lon) in self.sorted_items():
+            keys.append(key)
+            coords.append(lat)
+            coords.append(lon)
+        self._keys, self._coords, self._overlay = keys, coords, {}
+
+    def _maybe_compact(self):
+        if len(self._overlay) > COMPACT_THRESHOLD:
+            self.compact()
+
+    def nbytes(self):
+        keys = 0 if self._keys is None else len(self._keys) * self._keys.itemsize
+        return keys + len(self._coords) * 8
+
+
+def write_snapshot(path, sections):
+    """스냅샷 파일 쓰기 (임시 파일에 쓴 뒤 교체)
+
+    sections: (user_id, zoom, TileLevelMap 또는 (키 바이트, level 바이트, 타일 수)) 목록
+    """
+    tmp_path = f"{path}.tmp"
+    table = []
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        offset = _align8(HEADER.size)
+        f.write(b'\0' * (offset - HEADER.size))
+
+        for user_id, zoom, data in sections:
+            if isinstance(data, TileLevelMap):
+                data = data.packed()
+            key_bytes, level_bytes, count = data
+            if count == 0:
+                continue
+            key_width = len(key_bytes) // count
+
+            keys_offset = offset
+            f.write(key_bytes)
+            offset += len(key_bytes)
+            f.write(b'\0' * (_align8(offset) - offset))
+            offset = _align8(offset)
+
+            levels_offset = offset
+            f.write(level_bytes)
+            offset += len(level_bytes)
+            f.write(b'\0' * (_align8(offset) - offset))
+            offset = _align8(offset)
+
+            table.append((user_id.encode('utf-8'), zoom, key_width, count,
+                          keys_offset, levels_offset))
+
+        table_offset = offset
+        for user_bytes, zoom, key_width, count, keys_offset, levels_offset in table:
+            f.write(SECTION.pack(len(user_bytes), zoom, key_width, count,
+                                 keys_offset, levels_offset))
+            f.write(user_bytes)
+
+        f.seek(0)
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, len(table), table_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(table)
+
+
+class BitmapSnapshot:
+    """mmap으로 연 스냅샷 파일 (타일 데이터는 복사하지 않고 파일 뷰로 조회)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.sections = {}  # user_id → {zoom: (키 폭, 타일 수, 키 오프셋, level 오프셋)}
+
+        magic, section_count, table_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"스냅샷 파일 형식이 아닙니다: {path}")
+        pos = table_offset
+        for _ in range(section_count):
+            user_len, zoom, key_width, count, keys_offset, levels_offset = \
+                SECTION.unpack_from(self._mmap, pos)
+            pos += SECTION.size
+            user_id = bytes(self._mmap[pos:pos + user_len]).decode('utf-8')
+            pos += user_len
+            self.sections.setdefault(user_id, {})[zoom] = (
+                key_width, count, keys_offset, levels_offset)
+
+    def users(self):
+        return list(self.sections)
+
+    def level_maps(self, user_id):
+        """사용자의 줌별 TileLevelMap (파일 mmap 뷰 기반, 없으면 빈 dict)"""
+        maps = {}
+        for zoom, (key_width, count, keys_offset, levels_offset) in \
+                self.sections.get(user_id, {}).items():
+            maps[zoom] = TileLevelMap(
+                zoom,
+                keys=self._keys_view(key_width, count, keys_offset),
+                levels=self._view[levels_offset:levels_offset + (count + 3) // 4],
+                count=count,
+            )
+        return maps
+
+    def packed_sections(self, user_id):
+        """다른 스냅샷으로 그대로 옮겨 쓸 수 있는 (zoom, (키 바이트, level 바이트, 타일 수)) 목록"""
+        result = []
+        for zoom, (key_width, count, keys_offset, levels_offset) in \
+                self.sections.get(user_id, {}).items():
+            key_bytes = bytes(self._view[keys_offset:keys_offset + key_width * count])
+            level_bytes = bytes(self._view[levels_offset:levels_offset + (count + 3) // 4])
+            result.append((zoom, (key_bytes, level_bytes, count)))
+        return result
+
+    def _keys_view(self, key_width, count, offset):
+        raw = self._view[offset:offset + key_width * count]
+        typecode = 'I' if key_width == 4 else 'Q'
+        if sys.byteorder == 'little':
+            return raw.cast(typecode)
+        keys = array(typecode, bytes(raw))
+        keys.byteswap()
+        return keys
+
+    def close(self):
+        """mmap 해제 (아직 사용 중인 뷰가 있으면 GC에 맡김)"""
+        try:
+            self._view.release()
+            self._mmap.close()
+            self._file.close()
+        except BufferError:
+            pass
+
+
+def export_from_firestore(db, path):
+    """Firestore의 모든 visits_tiles/*/visited 문서를 스냅샷 파일로 저장"""
+    from fog_index import parse_tile_key
+
+    maps = {}
+    for doc in db.collection_group('visited').stream():
+        user_ref = doc.reference.parent.parent
+        if user_ref is None or user_ref.parent.id != 'visits_tiles':
+            continue
+        coords = parse_tile_key(doc.id)
+        level = (doc.to_dict() or {}).get('fogLevel', 3)
+        if coords is None or level not in (1, 2):
+            continue
+        zoom, x, y = coords
+        user_maps = maps.setdefault(user_ref.id, {})
+        level_map = user_maps.get(zoom)
+        if level_map is None:
+            level_map = user_maps[zoom] = TileLevelMap(zoom)
+        level_map[(x, y)] = level
+
+    sections = [(user_id, zoom, level_map)
+                for user_id, user_maps in maps.items()
+                for zoom, level_map in user_maps.items()]
+    return write_snapshot(path, sections)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'info'):
+        print("Usage: python fog_bitmap.py export|info <snapshot_path>")
+        sys.exit(1)
+    command, path = sys.argv[1], sys.argv[2]
+
+    if command == 'export':
+        from firebase_admin import firestore
+        from fog_server_with_firestore import initialize_firebase
+        if not initialize_firebase():
+            sys.exit(1)
+        count = export_from_firestore(firestore.client(), path)
+        print(f"✅ 스냅샷 저장 완료: {path} ({count}개 섹션)")
+        return
+
+    snapshot = BitmapSnapshot(path)
+    total = 0
+    for user_id, zooms in snapshot.sections.items():
+        for zoom, (key_width, count, _, _) in sorted(zooms.items()):
+            total += count
+            print(f"  - {user_id} z={zoom}: {count}개 타일 ({key_width}바이트 키)")
+    print(f"📊 사용자 {len(snapshot.sections)}명, 타일 {total}개, 파일 {os.path.getsize(path)} bytes")
+    snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
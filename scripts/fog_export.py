@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+"""
+사용자 Fog 타일 피라미드 일괄 내보내기 (MBTiles / PMTiles)
+
+오래 접속하지 않은 사용자의 fog 타일은 서버에서 매번 계산할 필요 없이 정적 파일로
+CDN/오브젝트 스토리지에서 바로 서비스할 수 있습니다. 이 도구는 사용자의 방문 타일을
+읽어 줌 범위 전체의 fog 타일을 프로세스 풀로 렌더링하고, 같은 내용의 타일(대부분
+검은색 또는 완전 공개)은 한 번만 저장한 아카이브 하나로 씁니다.
+
+- 렌더링 대상: 방문 타일의 조상/자손 타일 (mask 모드는 reveal 반경만큼 주변 타일 포함).
+  나머지 타일은 모두 미방문(level 3, 검은색)이므로 렌더링하지 않음
+- PMTiles v3: 검은 타일 구간을 run-length 엔트리로 채워 줌 범위의 전 세계 타일을 모두
+  주소화 (디렉터리 몇 KB로 수십억 타일) — HTTP Range 요청만으로 서비스 가능
+- MBTiles: 렌더링 대상 타일만 저장 (중복 제거 map/images 스키마),
+  없는 타일은 미방문(level 3)으로 취급 (메타데이터 fog:missingLevel)
+- 아카이브 메타데이터의 fog:version(방문 기록 + 설정 해시)이 같으면 다시 만들지 않음
+
+사용법:
+    python fog_export.py USER_ID -o fog_USER_ID.pmtiles
+    python fog_export.py --all -o fog_archives/ --format pmtiles --jobs 8
+    python fog_export.py --all --source sqlite:fog_tiles.db -o fog_archives/ --format mbtiles
+    python fog_export.py --all --source snapshot:fog_snapshot.bin -o fog_archives/
+    python fog_export.py USER_ID -o fog.pmtiles --render mask --image webp --maxzoom 17
+    python fog_export.py info fog_USER_ID.pmtiles       # 아카이브 요약
+
+소스 (--source):
+    firestore (기본)       visits_tiles/{userId}/visited 문서 (서비스 계정 필요)
+    sqlite:PATH            fog_store.py import로 만든 SQLite 저장소
+    snapshot:PATH          fog_bitmap.py export 스냅샷 (위치 정보가 없어 flat 렌더링만 가능)
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fog_bitmap import PointMap, TileLevelMap
+from fog_group import morton_decode_array
+from fog_index import UserVisitIndex
+from fog_mask import (EARTH_CIRCUMFERENCE_M, FogMaskRenderer, metatile_size_from_env,
+                      reveal_radius_from_env)
+from fog_tiles import (DEFAULT_FOG_LEVEL, RENDER_MODES, RenderedTileCache, TileEncoder,
+                       normalize_fog_level, png_compress_from_env, render_fog_level,
+                       render_mode_from_env)
+
+ARCHIVE_FORMATS = ('pmtiles', 'mbtiles')
+
+# 줌 확대 시 자손 타일이 4배씩 늘어나므로 사용자당 렌더링 타일 수 상한
+DEFAULT_MAX_TILES = 2_000_000
+
+# 작업 하나(프로세스 풀 태스크)에서 렌더링할 최대 타일 수
+MAX_CHUNK_TILES = 16384
+
+PMTILES_HEADER = struct.Struct('<7sB11QBBBBBBiiiiBii')
+PMTILES_ROOT_LIMIT = 16384 - PMTILES_HEADER.size
+PMTILES_TILE_TYPES = {'png': 2, 'webp': 4}
+PMTILES_GZIP = 2
+PMTILES_NO_COMPRESSION = 1
+# 엔트리 하나가 덮을 수 있는 최대 연속 타일 수 (run_length는 uint32)
+PMTILES_MAX_RUN = (1 << 32) - 1
+
+
+# ---------------------------------------------------------------------------
+# 소스: 사용자 방문 기록 → UserVisitIndex
+# ---------------------------------------------------------------------------
+
+def _firestore_indexes(db, user_ids):
+    if user_ids is not None:
+        for user_id in user_ids:
+            visited = db.collection('visits_tiles').document(user_id).collection('visited')
+            docs = [(doc.id, doc.to_dict() or {}) for doc in visited.stream()]
+            yield UserVisitIndex.from_documents(user_id, docs)
+        return
+
+    users = {}
+    for doc in db.collection_group('visited').stream():
+        user_ref = doc.reference.parent.parent
+        if user_ref is None or user_ref.parent.id != 'visits_tiles':
+            continue
+        users.setdefault(user_ref.id, []).append((doc.id, doc.to_dict() or {}))
+    for user_id in sorted(users):
+        yield UserVisitIndex.from_documents(user_id, users.pop(user_id))
+
+
+def _sqlite_indexes(path, user_ids):
+    from fog_store import SqliteFogStore
+    store = SqliteFogStore(path)
+    try:
+        for user_id in (store.user_ids() if user_ids is None else user_ids):
+            yield UserVisitIndex.from_documents(user_id, store.user_documents(user_id))
+    finally:
+        store.close()
+
+
+def _snapshot_indexes(path, user_ids):
+    from fog_bitmap import BitmapSnapshot
+    snapshot = BitmapSnapshot(path)
+    for user_id in (sorted(snapshot.users()) if user_ids is None else user_ids):
+        index = UserVisitIndex(user_id)
+        index.load_level_maps(snapshot.level_maps(user_id))
+        yield index
+
+
+def source_indexes(source, user_ids=None):
+    """--source 설정에 따라 사용자별 UserVisitIndex를 차례로 생성 (user_ids=None이면 전체 사용자)"""
+    kind, _, path = source.partition(':')
+    if kind == 'sqlite' and path:
+        return _sqlite_indexes(path, user_ids)
+    if kind == 'snapshot' and path:
+        return _snapshot_indexes(path, user_ids)
+    if kind == 'firestore':
+        from firebase_admin import firestore
+        from fog_server_with_firestore import initialize_firebase
+        if not initialize_firebase():
+            raise RuntimeError("Firebase 초기화 실패")
+        return _firestore_indexes(firestore.client(), user_ids)
+    raise ValueError(f"알 수 없는 소스: {source} (firestore | sqlite:PATH | snapshot:PATH)")
+
+
+# ---------------------------------------------------------------------------
+# 내보낼 타일 목록
+# ---------------------------------------------------------------------------
+
+def hilbert_tile_ids(zoom, xs, ys):
+    """(z, x, y) 배열 → PMTiles 타일 ID (줌별 Hilbert 곡선 순서, 벡터 연산)"""
+    acc = np.full(len(xs), ((1 << (2 * zoom)) - 1) // 3, dtype=np.int64)
+    x = np.asarray(xs, dtype=np.int64).copy()
+    y = np.asarray(ys, dtype=np.int64).copy()
+    for a in range(zoom - 1, -1, -1):
+        s = 1 << a
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        acc += ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64)) << (2 * a)
+        # 사분면 회전 (ry == 0일 때만, rx == 1이면 뒤집은 뒤 교환)
+        flip = ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+    return acc
+
+
+def zoom_first_tile_id(zoom):
+    """줌의 첫 PMTiles 타일 ID (그 앞 줌들의 타일 수 합)"""
+    return ((1 << (2 * zoom)) - 1) // 3
+
+
+def _tile_latitude(zoom, ys):
+    n = 1 << zoom
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(ys, dtype=np.float64) / n))))
+
+
+def base_tiles(index):
+    """방문 기록 줌별 (x 배열, y 배열)"""
+    tiles = []
+    for zoom, level_map in sorted(index.level_maps().items()):
+        key_bytes, _, count = level_map.packed()
+        if not count:
+            continue
+        dtype = '<u4' if len(key_bytes) == 4 * count else '<u8'
+        xs, ys = morton_decode_array(np.frombuffer(key_bytes, dtype=dtype).astype(np.uint64))
+        tiles.append((zoom, xs.astype(np.int64), ys.astype(np.int64)))
+    return tiles
+
+
+def export_coords(bases, minzoom, maxzoom, radius_m=None, max_tiles=DEFAULT_MAX_TILES):
+    """줌별로 렌더링할 타일 {zoom: (x 배열, y 배열)}
+
+    방문 타일보다 낮은 줌은 조상 타일, 높은 줌은 자손 타일이고, radius_m이 있으면
+    (mask 모드) 방문 지점의 reveal 반경이 걸칠 수 있는 주변 타일까지 포함합니다.
+    """
+    coords = {}
+    total = 0
+    for zoom in range(minzoom, maxzoom + 1):
+        n = 1 << zoom
+        keys = []
+        for base_zoom, xs, ys in bases:
+            if zoom <= base_zoom:
+                shift = base_zoom - zoom
+                keys.append(np.unique((xs >> shift) * n + (ys >> shift)))
+                continue
+            shift = zoom - base_zoom
+            total_children = len(xs) << (2 * shift)
+            if total + total_children > max_tiles:
+                raise ValueError(f"z{zoom} 자손 타일이 너무 많습니다 ({total + total_children:,}개 > "
+                                 f"--max-tiles {max_tiles:,}) — --maxzoom을 낮추세요")
+            offsets = np.arange(1 << shift, dtype=np.int64)
+            child_x = ((xs << shift)[:, None, None] + offsets[None, :, None]).repeat(1 << shift, 2)
+            child_y = ((ys << shift)[:, None, None] + offsets[None, None, :]).repeat(1 << shift, 1)
+            keys.append((child_x * n + child_y).ravel())
+        if not keys:
+            continue
+        tile_keys = np.unique(np.concatenate(keys))
+
+        if radius_m:
+            ys = tile_keys % n
+            max_lat = float(np.max(np.abs(_tile_latitude(zoom, np.concatenate([ys, ys + 1])))))
+            tile_m = EARTH_CIRCUMFERENCE_M * math.cos(math.radians(max_lat)) / n
+            margin = min(int(math.ceil(radius_m / max(tile_m, 1e-6))), n)
+            if margin:
+                if len(tile_keys) * (2 * margin + 1) ** 2 + total > max_tiles * 4:
+                    raise ValueError(f"z{zoom} reveal 반경 주변 타일이 너무 많습니다 — --maxzoom을 낮추세요")
+                span = np.arange(-margin, margin + 1, dtype=np.int64)
+                tx = (tile_keys // n)[:, None, None] + span[None, :, None]
+                ty = (tile_keys % n)[:, None, None] + span[None, None, :]
+                tx, ty = np.broadcast_arrays(tx, ty)
+                inside = (tx >= 0) & (tx < n) & (ty >= 0) & (ty < n)
+                tile_keys = np.unique(tx[inside] * n + ty[inside])
+
+        total += len(tile_keys)
+        if total > max_tiles:
+            raise ValueError(f"렌더링할 타일이 너무 많습니다 ({total:,}개 > --max-tiles {max_tiles:,})")
+        coords[zoom] = (tile_keys // n, tile_keys % n)
+    return coords
+
+
+# ---------------------------------------------------------------------------
+# 렌더링 (프로세스 풀 워커)
+# ---------------------------------------------------------------------------
+
+# 워커 프로세스별 상태: 마지막 사용자 인덱스, 렌더러, 이미 메인으로 보낸 타일 해시
+_WORKER = {'user': None, 'index': None, 'settings': None, 'flat': None, 'mask': None,
+           'sent': set()}
+
+
+def _worker_index(payload):
+    user_key, sections, points = payload
+    if _WORKER['user'] != user_key:
+        index = UserVisitIndex(user_key[0])
+        index.load_level_maps({zoom: TileLevelMap.from_packed(zoom, *packed)
+                               for zoom, packed in sections})
+        index.points = PointMap.from_coords(points)
+        _WORKER['user'], _WORKER['index'] = user_key, index
+    return _WORKER['index']
+
+
+def _worker_renderers(settings):
+    if _WORKER['settings'] != settings:
+        render, image, png_compress, radius_m, metatile = settings
+        encoder = TileEncoder(png_compress=png_compress, webp=image == 'webp')
+        flat = RenderedTileCache(render_fog_level, encoder)
+        mask = FogMaskRenderer(flat, radius_m=radius_m, metatile=metatile) if render == 'mask' else None
+        _WORKER.update(settings=settings, flat=flat, mask=mask)
+    return _WORKER['flat'], _WORKER['mask']
+
+
+def tile_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def render_chunk(task):
+    """타일 묶음 렌더링 → (타일별 해시 목록, 이 워커가 처음 만든 {해시: 타일 바이트})"""
+    payload, settings, zoom, xs, ys = task
+    index = _worker_index(payload)
+    flat, mask = _worker_renderers(settings)
+    fmt = settings[1]
+    sent = _WORKER['sent']
+    digests = []
+    blobs = {}
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        level = normalize_fog_level(index.fog_level(zoom, x, y))
+        if mask is None:
+            data = flat.get(level, fmt)
+        else:
+            data = mask.tile_png(index, zoom, x, y, level, fmt)
+        digest = tile_digest(data)
+        if digest not in sent:
+            sent.add(digest)
+            blobs[digest] = data
+        digests.append(digest)
+    return digests, blobs
+
+
+class BlobSpool:
+    """중복 제거된 타일 바이트를 임시 파일에 모아 둠 (해시 → (오프셋, 길이))"""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix='fog_export_')
+        self._entries = {}
+        self._size = 0
+
+    def put(self, digest, data):
+        if digest in self._entries:
+            return
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._entries[digest] = (self._size, len(data))
+        self._size += len(data)
+
+    def get(self, digest):
+        offset, length = self._entries[digest]
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def length(self, digest):
+        return self._entries[digest][1]
+
+    def __contains__(self, digest):
+        return digest in self._entries
+
+    def close(self):
+        self._file.close()
+
+
+# ---------------------------------------------------------------------------
+# 아카이브 쓰기
+# ---------------------------------------------------------------------------
+
+def _tile_bounds(coords):
+    """렌더링 타일 영역의 (서, 남, 동, 북) 경위도 (타일이 없으면 전 세계)"""
+    if not coords:
+        return -180.0, -85.05112878, 180.0, 85.05112878
+    zoom = max(coords)
+    xs, ys = coords[zoom]
+    n = 1 << zoom
+    west = int(xs.min()) / n * 360.0 - 180.0
+    east = (int(xs.max()) + 1) / n * 360.0 - 180.0
+    north, south = _tile_latitude(zoom, [int(ys.min()), int(ys.max()) + 1]).tolist()
+    return west, south, east, north
+
+
+def write_mbtiles(path, tiles, spool, metadata):
+    """MBTiles (중복 제거 스키마: map + images + tiles 뷰) 쓰기 — 임시 파일에 쓴 뒤 교체
+
+    tiles: (zoom, x 배열, y 배열, 해시 목록) 목록 — tile_row는 TMS(아래쪽 0) 기준
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript("""
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+            CREATE TABLE images (tile_data BLOB, tile_id TEXT);
+            CREATE VIEW tiles AS
+                SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                       map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+        """)
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)',
+                         [(name, str(value)) for name, value in metadata.items()])
+        written = set()
+        for zoom, xs, ys, digests in tiles:
+            flip = (1 << zoom) - 1
+            new = [digest for digest in dict.fromkeys(digests) if digest not in written]
+            conn.executemany('INSERT INTO images VALUES (?, ?)',
+                             [(spool.get(digest), digest.hex()) for digest in new])
+            written.update(new)
+            conn.executemany('INSERT INTO map VALUES (?, ?, ?, ?)',
+                             zip([zoom] * len(digests), xs.tolist(),
+                                 (flip - ys).tolist(), [digest.hex() for digest in digests]))
+        conn.executescript("""
+            CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row);
+            CREATE UNIQUE INDEX images_id ON images (tile_id);
+            CREATE UNIQUE INDEX name ON metadata (name);
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return len(written)
+
+
+def _varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buf, pos):
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def serialize_directory(entries):
+    """PMTiles 디렉터리 (tile_id, offset, length, run_length) 목록 → gzip 바이트"""
+    out = bytearray()
+    _varint(len(entries), out)
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        _varint(tile_id - last_id, out)
+        last_id = tile_id
+    for _, _, _, run_length in entries:
+        _varint(run_length, out)
+    for _, _, length, _ in entries:
+        _varint(length, out)
+    next_offset = None
+    for _, offset, length, _ in entries:
+        # 바로 앞 엔트리에 이어지는 오프셋은 0, 아니면 offset + 1
+        _varint(0 if offset == next_offset else offset + 1, out)
+        next_offset = offset + length
+    return gzip.compress(bytes(out), mtime=0)
+
+
+def deserialize_directory(data):
+    buf = gzip.decompress(data)
+    count, pos = _read_varint(buf, 0)
+    ids, runs, lengths, offsets = [], [], [], []
+    tile_id = 0
+    for _ in range(count):
+        delta, pos = _read_varint(buf, pos)
+        tile_id += delta
+        ids.append(tile_id)
+    for values in (runs, lengths):
+        for _ in range(count):
+            value, pos = _read_varint(buf, pos)
+            values.append(value)
+    for i in range(count):
+        value, pos = _read_varint(buf, pos)
+        offsets.append(offsets[i - 1] + lengths[i - 1] if value == 0 and i > 0 else value - 1)
+    return list(zip(ids, offsets, lengths, runs))
+
+
+def _optimize_directories(entries):
+    """루트 디렉터리가 헤더 포함 16KB를 넘으면 리프 디렉터리로 나눔 → (루트, 리프들, 리프 수)"""
+    root = serialize_directory(entries)
+    if len(root) <= PMTILES_ROOT_LIMIT:
+        return root, b'', 0
+    leaf_size = 4096
+    while True:
+        root_entries = []
+        leaves = bytearray()
+        for start in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[start:start + leaf_size])
+            root_entries.append((entries[start][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+        root = serialize_directory(root_entries)
+        if len(root) <= PMTILES_ROOT_LIMIT:
+            return root, bytes(leaves), len(root_entries)
+        leaf_size *= 2
+
+
+def _pmtiles_entries(tiles, fill_digest, minzoom, maxzoom):
+    """타일 ID 순 (tile_id, 해시, run_length) 목록 — 렌더링하지 않은 구간은 fill_digest로 채움
+
+    타일 수만큼의 Python 루프 대신 NumPy로 빈 구간을 끼워 넣고, 같은 내용이 이어지는
+    구간을 run-length 엔트리 하나로 합칩니다.
+    """
+    digests = [fill_digest]
+    codes = {fill_digest: 0}
+    ids = [np.zeros(0, dtype=np.int64)]
+    tile_codes = [np.zeros(0, dtype=np.int64)]
+    for zoom, xs, ys, tile_digests in tiles:
+        ids.append(hilbert_tile_ids(zoom, xs, ys))
+        tile_codes.append(np.fromiter((codes.setdefault(d, len(codes)) for d in tile_digests),
+                                      dtype=np.int64, count=len(tile_digests)))
+        digests.extend(list(codes)[len(digests):])
+    ids = np.concatenate(ids)
+    tile_codes = np.concatenate(tile_codes)
+
+    # 렌더링 타일 앞의 빈 구간 (이전 타일 다음 ID부터) + 마지막 타일 뒤 구간
+    first, end = zoom_first_tile_id(minzoom), zoom_first_tile_id(maxzoom + 1)
+    previous_end = np.concatenate([[first], ids + 1])
+    gap_starts = previous_end[:-1]
+    gap_runs = ids - gap_starts
+    starts = np.concatenate([gap_starts, ids, previous_end[-1:]])
+    runs = np.concatenate([gap_runs, np.ones(len(ids), dtype=np.int64), [end - previous_end[-1]]])
+    entry_codes = np.concatenate([np.zeros(len(ids), dtype=np.int64), tile_codes, [0]])
+    order = np.argsort(starts, kind='stable')
+    starts, runs, entry_codes = starts[order], runs[order], entry_codes[order]
+    keep = runs > 0
+    starts, runs, entry_codes = starts[keep], runs[keep], entry_codes[keep]
+    if not len(starts):
+        return []
+
+    # 같은 내용이 연속되는 엔트리 합치기 (ID가 빈틈없이 이어지므로 내용만 비교)
+    boundary = np.ones(len(starts), dtype=bool)
+    boundary[1:] = entry_codes[1:] != entry_codes[:-1]
+    group_starts = np.flatnonzero(boundary)
+    merged_runs = np.add.reduceat(runs, group_starts)
+
+    entries = []
+    for tile_id, code, run in zip(starts[group_starts].tolist(), entry_codes[group_starts].tolist(),
+                                  merged_runs.tolist()):
+        digest = digests[code]
+        while run > PMTILES_MAX_RUN:
+            entries.append((tile_id, digest, PMTILES_MAX_RUN))
+            tile_id += PMTILES_MAX_RUN
+            run -= PMTILES_MAX_RUN
+        entries.append((tile_id, digest, run))
+    return entries
+
+
+def write_pmtiles(path, tiles, spool, metadata, fill_digest, image, bounds, minzoom, maxzoom):
+    """PMTiles v3 쓰기 (헤더 | 루트 디렉터리 | 메타데이터 | 리프 디렉터리 | 타일 데이터)
+
+    tiles는 줌별 타일 ID 순서여야 하며, 타일 데이터는 첫 등장 순서로 한 번씩만 기록합니다.
+    """
+    entries = _pmtiles_entries(tiles, fill_digest, minzoom, maxzoom)
+    offsets = {}
+    order = []
+    data_length = 0
+    directory = []
+    for tile_id, digest, run in entries:
+        if digest not in offsets:
+            offsets[digest] = data_length
+            order.append(digest)
+            data_length += spool.length(digest)
+        directory.append((tile_id, offsets[digest], spool.length(digest), run))
+
+    root, leaves, _ = _optimize_directories(directory)
+    meta = gzip.compress(json.dumps(metadata, ensure_ascii=False).encode('utf-8'), mtime=0)
+    root_offset = PMTILES_HEADER.size
+    meta_offset = root_offset + len(root)
+    leaf_offset = meta_offset + len(meta)
+    data_offset = leaf_offset + len(leaves)
+
+    west, south, east, north = bounds
+    center_zoom = max(minzoom, maxzoom - 2)
+    header = PMTILES_HEADER.pack(
+        b'PMTiles', 3,
+        root_offset, len(root), meta_offset, len(meta), leaf_offset, len(leaves),
+        data_offset, data_length,
+        sum(run for _, _, run in entries), len(entries), len(order),
+        1, PMTILES_GZIP, PMTILES_NO_COMPRESSION, PMTILES_TILE_TYPES[image], minzoom, maxzoom,
+        round(west * 1e7), round(south * 1e7), round(east * 1e7), round(north * 1e7),
+        center_zoom, round((west + east) / 2 * 1e7), round((south + north) / 2 * 1e7))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(root)
+        f.write(meta)
+        f.write(leaves)
+        for digest in order:
+            f.write(spool.get(digest))
+    os.replace(tmp_path, path)
+    return len(order)
+
+
+def read_pmtiles_header(f):
+    values = PMTILES_HEADER.unpack(f.read(PMTILES_HEADER.size))
+    if values[0] != b'PMTiles' or values[1] != 3:
+        raise ValueError("PMTiles v3 파일이 아닙니다")
+    names = ('root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+             'leaf_offset', 'leaf_length', 'data_offset', 'data_length',
+             'addressed_tiles', 'tile_entries', 'tile_contents', 'clustered',
+             'internal_compression', 'tile_compression', 'tile_type', 'min_zoom', 'max_zoom')
+    return dict(zip(names, values[2:]))
+
+
+def archive_metadata(path):
+    """기존 아카이브의 메타데이터 dict (없거나 읽을 수 없으면 None)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        if path.endswith('.mbtiles'):
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                return dict(conn.execute('SELECT name, value FROM metadata'))
+            finally:
+                conn.close()
+        with open(path, 'rb') as f:
+            header = read_pmtiles_header(f)
+            f.seek(header['metadata_offset'])
+            return json.loads(gzip.decompress(f.read(header['metadata_length'])))
+    except (OSError, ValueError, sqlite3.Error):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# 내보내기
+# ---------------------------------------------------------------------------
+
+class FogExporter:
+    """사용자별 fog 피라미드 → 아카이브 (프로세스 풀과 타일 스풀은 전체 실행 동안 공유)"""
+
+    def __init__(self, archive='pmtiles', render='flat', image='png', minzoom=0, maxzoom=None,
+                 jobs=None, max_tiles=DEFAULT_MAX_TILES, force=False):
+        self.archive = archive
+        self.render = render
+        self.image = image
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.max_tiles = max_tiles
+        self.force = force
+        self.radius_m = reveal_radius_from_env() if render == 'mask' else None
+        self.settings = (render, image, png_compress_from_env(), self.radius_m,
+                         max(metatile_size_from_env(), 8) if render == 'mask' else 1)
+        self.spool = BlobSpool()
+        self._pool = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+
+        # 렌더링하지 않은 타일 (미방문) 내용
+        encoder = TileEncoder(png_compress=self.settings[2], webp=image == 'webp')
+        if image not in encoder.formats:
+            raise ValueError(f"{image} 인코딩을 사용할 수 없습니다 (Pillow WebP 지원 확인)")
+        fill = RenderedTileCache(render_fog_level, encoder).get(DEFAULT_FOG_LEVEL, image)
+        self.fill_digest = tile_digest(fill)
+        self.spool.put(self.fill_digest, fill)
+
+    def version(self, sections, points, maxzoom):
+        """방문 기록 + 내보내기 설정 해시 (같으면 아카이브를 다시 만들 필요 없음)"""
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update(repr((self.archive, self.settings, self.minzoom, maxzoom)).encode())
+        for zoom, (key_bytes, level_bytes, count) in sections:
+            digest.update(struct.pack('<BI', zoom, count))
+            digest.update(key_bytes)
+            digest.update(level_bytes)
+        digest.update(np.asarray(points, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def export(self, index, path):
+        """사용자 한 명 내보내기 → 요약 dict (아카이브가 최신이면 None)"""
+        started = time.perf_counter()
+        sections = [(zoom, level_map.packed())
+                    for zoom, level_map in sorted(index.level_maps().items())]
+        points = array('d', index.visit_points() if self.render == 'mask' else ())
+        bases = base_tiles(index)
+        maxzoom = self.maxzoom
+        if maxzoom is None:
+            maxzoom = max([zoom for zoom, _, _ in bases], default=self.minzoom)
+        maxzoom = max(maxzoom, self.minzoom)
+        version = self.version(sections, points, maxzoom)
+        existing = archive_metadata(path)
+        if not self.force and existing and existing.get('fog:version') == version:
+            return None
+
+        coords = export_coords(bases, self.minzoom, maxzoom, self.radius_m, self.max_tiles)
+        tiles = self._render(index.user_id, version, sections, points, coords)
+        bounds = _tile_bounds(coords)
+        metadata = {
+            'name': f"fog {index.user_id}",
+            'format': self.image,
+            'type': 'overlay',
+            'version': '1',
+            'description': 'Fog of War 타일 (fog_export.py)',
+            'minzoom': self.minzoom,
+            'maxzoom': maxzoom,
+            'bounds': ','.join(f"{v:.6f}" for v in bounds),
+            'fog:userId': index.user_id,
+            'fog:version': version,
+            'fog:render': self.render,
+            'fog:missingLevel': DEFAULT_FOG_LEVEL,
+            'fog:exportedAt': int(time.time()),
+        }
+        tmp_path = f"{path}.tmp"
+        try:
+            if self.archive == 'mbtiles':
+                unique = write_mbtiles(path, tiles, self.spool, metadata)
+            else:
+                unique = write_pmtiles(path, tiles, self.spool, metadata, self.fill_digest,
+                                       self.image, bounds, self.minzoom, maxzoom)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {
+            'userId': index.user_id,
+            'rendered': sum(len(digests) for _, _, _, digests in tiles),
+            'unique': unique,
+            'bytes': os.path.getsize(path),
+            'minzoom': self.minzoom,
+            'maxzoom': maxzoom,
+            'seconds': time.perf_counter() - started,
+        }
+
+    def _render(self, user_id, version, sections, points, coords):
+        """줌별 타일을 타일 ID 순으로 나눠 렌더링 → (zoom, x 배열, y 배열, 해시 목록) 목록"""
+        payload = ((user_id, version), sections, points)
+        total = sum(len(xs) for xs, _ in coords.values())
+        chunk = min(MAX_CHUNK_TILES, max(256, total // (self.jobs * 4) + 1))
+        tasks = []
+        for zoom, (xs, ys) in sorted(coords.items()):
+            order = np.argsort(hilbert_tile_ids(zoom, xs, ys), kind='stable')
+            xs, ys = xs[order], ys[order]
+            for start in range(0, len(xs), chunk):
+                tasks.append((payload, self.settings, zoom,
+                              xs[start:start + chunk], ys[start:start + chunk]))
+
+        results = self._pool.map(render_chunk, tasks) if self._pool else map(render_chunk, tasks)
+        tiles = []
+        for (_, _, zoom, xs, ys), (digests, blobs) in zip(tasks, results):
+            for digest, data in blobs.items():
+                self.spool.put(digest, data)
+            tiles.append((zoom, xs, ys, digests))
+        return tiles
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+        self.spool.close()
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def show_info(path):
+    metadata = archive_metadata(path)
+    if metadata is None:
+        print(f"❌ 아카이브를 읽을 수 없습니다: {path}")
+        sys.exit(1)
+    print(f"📦 {path} ({_format_size(os.path.getsize(path))})")
+    for name in ('fog:userId', 'format', 'minzoom', 'maxzoom', 'bounds', 'fog:render',
+                 'fog:version', 'fog:exportedAt'):
+        print(f"   {name}: {metadata.get(name)}")
+    if path.endswith('.mbtiles'):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        tiles, = conn.execute('SELECT COUNT(*) FROM map').fetchone()
+        images, = conn.execute('SELECT COUNT(*) FROM images').fetchone()
+        conn.close()
+        print(f"   타일 {tiles:,}개 → 고유 이미지 {images:,}개")
+        return
+    with open(path, 'rb') as f:
+        header = read_pmtiles_header(f)
+    print(f"   주소 타일 {header['addressed_tiles']:,}개, 엔트리 {header['tile_entries']:,}개 "
+          f"→ 고유 타일 {header['tile_contents']:,}개 (리프 디렉터리 {header['leaf_length']:,} bytes)")
+
+
+def output_path(output, user_id, archive, many):
+    """여러 사용자면 output 디렉터리 아래 {userId}.{형식}, 한 명이면 output 파일 그대로"""
+    if many or os.path.isdir(output) or output.endswith(os.sep):
+        os.makedirs(output, exist_ok=True)
+        return os.path.join(output, f"{user_id}.{archive}")
+    return output
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == 'info':
+        show_info(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser(description='사용자 fog 타일 피라미드 → MBTiles/PMTiles 아카이브')
+    parser.add_argument('users', nargs='*', help='내보낼 사용자 ID')
+    parser.add_argument('--all', action='store_true', help='소스의 모든 사용자')
+    parser.add_argument('--source', default='firestore',
+                        help='방문 기록 소스: firestore | sqlite:PATH | snapshot:PATH (기본: firestore)')
+    parser.add_argument('-o', '--output', required=True,
+                        help='아카이브 파일 (여러 사용자면 디렉터리, {userId}.{형식})')
+    parser.add_argument('--format', choices=ARCHIVE_FORMATS,
+                        help='아카이브 형식 (기본: 출력 확장자, 없으면 pmtiles)')
+    parser.add_argument('--minzoom', type=int, default=0)
+    parser.add_argument('--maxzoom', type=int, help='기본: 사용자 방문 기록의 최대 줌')
+    parser.add_argument('--render', choices=RENDER_MODES, default=render_mode_from_env(),
+                        help='flat: fog level 단색, mask: 방문 지점 픽셀 마스크 (기본: FOG_RENDER_MODE)')
+    parser.add_argument('--image', choices=('png', 'webp'), default='png')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='렌더링 프로세스 수')
+    parser.add_argument('--max-tiles', type=int, default=DEFAULT_MAX_TILES,
+                        help=f'사용자당 렌더링 타일 수 상한 (기본: {DEFAULT_MAX_TILES:,})')
+    parser.add_argument('--force', action='store_true', help='방문 기록이 그대로여도 다시 만듦')
+    args = parser.parse_args()
+
+    if bool(args.users) == args.all:
+        parser.error('사용자 ID 또는 --all 중 하나를 지정하세요')
+    if not 0 <= args.minzoom <= (args.maxzoom if args.maxzoom is not None else 24) <= 24:
+        parser.error('줌 범위는 0 <= --minzoom <= --maxzoom <= 24')
+    if args.render == 'mask' and args.source.startswith('snapshot:'):
+        parser.error('스냅샷 파일에는 방문 위치가 없어 mask 렌더링을 할 수 없습니다 (--render flat)')
+    archive = args.format or next((fmt for fmt in ARCHIVE_FORMATS
+                                   if args.output.endswith(f".{fmt}")), 'pmtiles')
+
+    try:
+        indexes = source_indexes(args.source, None if args.all else args.users)
+        exporter = FogExporter(archive=archive, render=args.render, image=args.image,
+                               minzoom=args.minzoom, maxzoom=args.maxzoom, jobs=args.jobs,
+                               max_tiles=args.max_tiles, force=args.force)
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    many = args.all or len(args.users) > 1
+    started = time.perf_counter()
+    exported = skipped = failed = 0
+    print(f"🗺️  fog 아카이브 내보내기: {archive}, {args.render}/{args.image}, "
+          f"z{args.minzoom}-{args.maxzoom if args.maxzoom is not None else 'auto'}, {exporter.jobs}개 프로세스")
+    try:
+        for index in indexes:
+            path = output_path(args.output, index.user_id, archive, many)
+            try:
+                summary = exporter.export(index, path)
+            except ValueError as e:
+                failed += 1
+                print(f"❌ {index.user_id}: {e}")
+                continue
+            if summary is None:
+                skipped += 1
+                print(f"⏭️  {index.user_id}: 변경 없음 ({path})")
+                continue
+            exported += 1
+            print(f"✅ {index.user_id}: z{summary['minzoom']}-{summary['maxzoom']} "
+                  f"{summary['rendered']:,}개 렌더링 → 고유 타일 {summary['unique']:,}개, "
+                  f"{_format_size(summary['bytes'])} ({summary['seconds']:.2f}s) → {path}")
+    finally:
+        exporter.close()
+    print(f"📊 내보냄 {exported}명, 변경 없음 {skipped}명, 실패 {failed}명 "
+          f"({time.perf_counter() - started:.1f}s)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+메모리 Firestore 대역 (벤치마크/로컬 실행용)
+
+타일 서버가 사용하는 Firestore API 일부만 흉내 냅니다.
+- collection().document().collection().document() 경로 참조 (parent로 상위 참조)
+- DocumentReference.get() / set() / delete(), db.get_all(refs), db.batch() (set/commit)
+- CollectionReference.stream() / on_snapshot(callback), db.collection_group(name).stream()
+- CollectionReference.where(field, op, value) / select(fields) 쿼리 (비교 연산자만)
+- firestore_async 스타일의 비동기 클라이언트 (AsyncFakeFirestore)
+
+latency(초)를 주면 Firestore 왕복마다 그만큼 지연시켜 네트워크 대기를 흉내 냅니다.
+
+사용 예:
+    db = FakeFirestore(latency=0.005)
+    db.collection('visits_tiles').document('u1').collection('visited').document('15_1_2').set({...})
+    async_db = AsyncFakeFirestore(db)
+"""
+
+import asyncio
+import copy
+import operator
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class _ChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeDocumentChange:
+    """on_snapshot 콜백의 변경분 (type.name: ADDED / MODIFIED / REMOVED)"""
+
+    def __init__(self, type_name, document):
+        self.type = _ChangeType(type_name)
+        self.document = document
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeWatch:
+    """on_snapshot 반환값 (unsubscribe 후 is_active=False)"""
+
+    def __init__(self, store, path, callback):
+        self._store = store
+        self._path = path
+        self._callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._store.remove_listener(self._path, self)
+
+
+class FakeDocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._store, self.path[:-1])
+
+    def collection(self, name):
+        return FakeCollectionReference(self._store, self.path + (name,))
+
+    def get(self):
+        self._store.round_trip()
+        return self._store.snapshot(self)
+
+    def set(self, data, merge=False):
+        self._store.round_trip()
+        self._store.write(self, data, merge)
+
+    def delete(self):
+        self._store.round_trip()
+        self._store.write(self, None)
+
+
+class FakeCollectionReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        """상위 문서 참조 (최상위 컬렉션이면 None)"""
+        return FakeDocumentReference(self._store, self.path[:-1]) if len(self.path) > 1 else None
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self._store, self.path + (doc_id,))
+
+    def stream(self):
+        self._store.round_trip()
+        return iter(self._store.collection_snapshots(self.path))
+
+    def where(self, field, op, value):
+        return FakeQuery(self._store, self.path).where(field, op, value)
+
+    def select(self, fields):
+        return FakeQuery(self._store, self.path).select(fields)
+
+    def on_snapshot(self, callback):
+        """리스너 등록: 현재 문서 전체로 즉시 한 번 호출, 이후 변경분마다 호출"""
+        watch = FakeWatch(self._store, self.path, callback)
+        self._store.add_listener(self.path, watch)
+        callback(self._store.collection_snapshots(self.path), [], datetime.now(timezone.utc))
+        return watch
+
+
+_OPERATORS = {'==': operator.eq, '<': operator.lt, '<=': operator.le,
+              '>': operator.gt, '>=': operator.ge, '!=': operator.ne}
+
+
+class FakeQuery:
+    """where()/select() 체인 (필드가 없는 문서는 where 조건에서 제외, 실제 Firestore와 같음)"""
+
+    def __init__(self, store, path, filters=(), fields=None):
+        self._store = store
+        self.path = path
+        self._filters = tuple(filters)
+        self._fields = fields
+
+    def where(self, field, op, value):
+        return FakeQuery(self._store, self.path, self._filters + ((field, _OPERATORS[op], value),),
+                         self._fields)
+
+    def select(self, fields):
+        return FakeQuery(self._store, self.path, self._filters, list(fields))
+
+    def stream(self):
+        self._store.round_trip()
+        results = []
+        for doc in self._store.collection_snapshots(self.path):
+            data = doc._data
+            if all(field in data and compare(data[field], value)
+                   for field, compare, value in self._filters):
+                if self._fields is not None:
+                    doc = FakeDocumentSnapshot(doc.reference,
+                                               {f: data[f] for f in self._fields if f in data})
+                results.append(doc)
+        return iter(results)
+
+
+class _FakeCollectionGroup:
+    def __init__(self, store, name):
+        self._store = store
+        self.name = name
+
+    def stream(self):
+        self._store.round_trip()
+        return iter(self._store.group_snapshots(self.name))
+
+
+class FakeWriteBatch:
+    """WriteBatch 대역: commit()에서 모은 쓰기를 왕복 1회로 반영"""
+
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        if not writes:
+            return
+        self._store.round_trip()
+        for ref, data, merge in writes:
+            self._store.write(ref, data, merge)
+
+
+class FakeFirestore:
+    """동기 Firestore 클라이언트 대역 (스레드 안전)"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._docs = {}       # 문서 경로 튜플 → dict
+        self._listeners = {}  # 컬렉션 경로 튜플 → [FakeWatch]
+        self._lock = threading.RLock()
+
+    def round_trip(self):
+        """Firestore 왕복 1회 (latency만큼 대기)"""
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def collection_group(self, name):
+        return _FakeCollectionGroup(self, name)
+
+    def get_all(self, refs):
+        self.round_trip()
+        return [self.snapshot(ref) for ref in refs]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def snapshot(self, ref):
+        with self._lock:
+            return FakeDocumentSnapshot(ref, copy.deepcopy(self._docs.get(ref.path)))
+
+    def collection_snapshots(self, path):
+        with self._lock:
+            return [FakeDocumentSnapshot(FakeDocumentReference(self, doc_path), copy.deepcopy(data))
+                    for doc_path, data in self._docs.items()
+                    if len(doc_path) == len(path) + 1 and doc_path[:-1] == path]
+
+    def group_snapshots(self, name):
+        with self._lock:
+            return [FakeDocumentSnapshot(FakeDocumentReference(self, doc_path), copy.deepcopy(data))
+                    for doc_path, data in self._docs.items()
+                    if len(doc_path) >= 2 and doc_path[-2] == name]
+
+    def write(self, ref, data, merge=False):
+        """문서 저장/삭제 후 해당 컬렉션 리스너에 변경분 전달"""
+        with self._lock:
+            old = self._docs.get(ref.path)
+            if data is None:
+                if old is None:
+                    return
+                del self._docs[ref.path]
+                change_type = 'REMOVED'
+            else:
+                if merge and old is not None:
+                    data = {**old, **data}
+                self._docs[ref.path] = copy.deepcopy(data)
+                change_type = 'ADDED' if old is None else 'MODIFIED'
+            watches = list(self._listeners.get(ref.path[:-1], ()))
+            snapshot = FakeDocumentSnapshot(ref, copy.deepcopy(data))
+
+        for watch in watches:
+            docs = self.collection_snapshots(ref.path[:-1])
+            watch._callback(docs, [FakeDocumentChange(change_type, snapshot)],
+                            datetime.now(timezone.utc))
+
+    def load(self, collections):
+        """{문서 경로 튜플: dict} 일괄 적재 (리스너 알림/지연 없음)"""
+        with self._lock:
+            for path, data in collections.items():
+                self._docs[tuple(path)] = copy.deepcopy(data)
+
+    def add_listener(self, path, watch):
+        with self._lock:
+            self._listeners.setdefault(path, []).append(watch)
+
+    def remove_listener(self, path, watch):
+        with self._lock:
+            watches = self._listeners.get(path, [])
+            if watch in watches:
+                watches.remove(watch)
+
+    def __len__(self):
+        return len(self._docs)
+
+
+class _AsyncDocumentReference:
+    def __init__(self, ref):
+        self._ref = ref
+        self.id = ref.id
+        self.path = ref.path
+
+    def collection(self, name):
+        return _AsyncCollectionReference(self._ref.collection(name))
+
+    async def get(self):
+        store = self._ref._store
+        store.round_trips += 1
+        if store.latency:
+            await asyncio.sleep(store.latency)
+        return store.snapshot(self._ref)
+
+
+class _AsyncCollectionReference:
+    def __init__(self, ref):
+        self._ref = ref
+        self.id = ref.id
+
+    def document(self, doc_id):
+        return _AsyncDocumentReference(self._ref.document(doc_id))
+
+
+class AsyncFakeFirestore:
+    """firestore_async 클라이언트 대역 (같은 FakeFirestore 데이터를 공유)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return _AsyncCollectionReference(self.store.collection(name))
+
+    async def get_all(self, refs):
+        self.store.round_trips += 1
+        if self.store.latency:
+            await asyncio.sleep(self.store.latency)
+        for ref in refs:
+            yield self.store.snapshot(ref._ref)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+그룹(여러 사용자) 합성 fog 타일
+
+/tiles/{userId}/... 는 사용자 한 명만 지원하므로, 그룹/공동 탐험 지도를 그리려면 멤버마다
+타일을 따로 받아 클라이언트에서 합성해야 했습니다. 여기서는 멤버들의 방문 타일을 한 번에
+합친 합성 인덱스(GroupIndex)를 만들어 두고, 타일/뷰포트 조회를 사용자 한 명과 같은 비용으로
+처리합니다.
+
+- 합성 규칙: 타일마다 멤버 중 가장 밝은 값 (fog level 최솟값, 아무도 방문하지 않았으면 3)
+- 합집합: 멤버별 압축 맵(fog_bitmap.TileLevelMap)의 Morton 키/2비트 level 배열을 NumPy로
+  이어 붙여 정렬한 뒤 키마다 최솟값 하나만 남김 (타일별 파이썬 루프 없음)
+- 상위 줌 집계: 합집합 키 배열로 만든 FogPyramid가 조회 때 조상의 키 구간에서 계산.
+  집계는 합집합 기준이라, 멤버들이 나눠서 모두 밝힌 상위 타일은 level 1이 됩니다.
+- 캐시: 멤버 목록 → GroupIndex (LRU). 멤버 중 누구의 방문 버전이라도 바뀌면 다시 만들고,
+  합성 버전(version_tag)은 멤버 버전들의 해시라 타일/뷰포트 ETag가 그대로 동작합니다.
+
+URL 형식:
+    /groups/{groupId}/tiles/{zoom}/{x}/{y}.png
+    /groups/{groupId}/viewport/{zoom}?x0=&y0=&x1=&y1=&format=json|bin|rle
+    /groups/_/tiles/15/26910/12667.png?users=user1,user2,user3   (그룹 ID 없이 멤버 직접 지정)
+
+그룹 멤버 (GroupDirectory):
+- FOG_GROUPS_FILE: {"groupId": ["user1", "user2", ...]} 형식의 JSON 파일
+- Firestore: fog_groups/{groupId} 문서의 members 배열 (FOG_GROUP_TTL초 동안 캐시)
+
+설정 (환경변수):
+    FOG_GROUPS_FILE         그룹 정의 JSON 파일 경로
+    FOG_GROUP_MAX_MEMBERS   그룹 최대 멤버 수 (기본 50)
+    FOG_GROUP_TTL           Firestore 그룹 문서 캐시 시간 (초, 기본 60)
+    FOG_GROUP_CACHE         합성 인덱스를 유지할 그룹 수 (기본 256)
+
+사용 예:
+    composer = GroupComposer()
+    indexes = member_indexes(registry, members)
+    group = composer.composite(members, indexes)
+    fog_level = group.fog_level(zoom, x, y)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from urllib.parse import parse_qs
+import numpy as np
+from fog_bitmap import TileLevelMap, key_typecode
+from fog_index import UserVisitIndex
+from fog_pyramid import FogPyramid
+
+GROUP_TILE_PATTERN = re.compile(r'/groups/([^/]+)/tiles/(\d+)/(\d+)/(\d+)\.png$')
+GROUP_VIEWPORT_PATTERN = re.compile(r'/groups/([^/]+)/viewport/(\d+)$')
+
+# 그룹 ID 대신 ?users=a,b,c 로 멤버를 직접 지정
+AD_HOC_GROUP = '_'
+
+GROUP_COLLECTION = 'fog_groups'
+
+DEFAULT_MAX_MEMBERS = 50
+DEFAULT_GROUP_TTL = 60.0
+DEFAULT_MAX_COMPOSITES = 256
+
+# 2비트 level 4개 → 바이트 (하위 비트부터, fog_bitmap과 같은 배치)
+_LEVEL_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+
+def _env_number(name, default, cast=float):
+    try:
+        return max(0, cast(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class GroupNotFound(LookupError):
+    """정의되지 않은 그룹 ID (404)"""
+
+
+def parse_members(value, max_members=DEFAULT_MAX_MEMBERS):
+    """'user1,user2' → 정렬/중복 제거한 멤버 튜플 (비었거나 한도를 넘으면 ValueError)"""
+    members = tuple(sorted({member.strip() for member in value.split(',') if member.strip()}))
+    if not members:
+        raise ValueError("멤버가 없습니다 (users=user1,user2,...)")
+    if max_members and len(members) > max_members:
+        raise ValueError(f"그룹 멤버는 최대 {max_members}명입니다: {len(members)}명")
+    return members
+
+
+def group_label(group_id, query=''):
+    """로그/동시 요청 한도/디버그 타일에 쓰는 그룹 이름 ('group:{groupId}' 또는 'users:{멤버 목록}')"""
+    if group_id == AD_HOC_GROUP:
+        return 'users:' + ','.join(parse_qs(query).get('users', []))
+    return f'group:{group_id}'
+
+
+class GroupDirectory:
+    """그룹 ID → 멤버 목록 (JSON 파일 → Firestore fog_groups 문서 순서로 찾음)"""
+
+    def __init__(self, db=None, path=None, ttl=None, max_members=None):
+        self.db = db
+        self.path = os.environ.get('FOG_GROUPS_FILE') if path is None else path
+        self.ttl = _env_number('FOG_GROUP_TTL', DEFAULT_GROUP_TTL) if ttl is None else ttl
+        self.max_members = (_env_number('FOG_GROUP_MAX_MEMBERS', DEFAULT_MAX_MEMBERS, int)
+                            if max_members is None else max_members)
+        self.static = self._load_file(self.path) if self.path else {}
+        self._cache = {}  # 그룹 ID → (조회 시각, 멤버 튜플 또는 None)
+        self._lock = threading.Lock()
+
+    def _load_file(self, path):
+        with open(path, encoding='utf-8') as f:
+            groups = json.load(f)
+        return {group_id: parse_members(','.join(members), self.max_members)
+                for group_id, members in groups.items()}
+
+    def cached(self, group_id, query=''):
+        """저장소 조회 없이 알 수 있는 멤버 (Firestore 조회가 필요하면 None)"""
+        if group_id == AD_HOC_GROUP:
+            users = parse_qs(query).get('users')
+            if not users:
+                raise ValueError("그룹 ID '_'에는 users=user1,user2,... 가 필요합니다")
+            return parse_members(','.join(users), self.max_members)
+        members = self.static.get(group_id)
+        if members is not None:
+            return members
+        if self.db is None:
+            raise GroupNotFound(group_id)
+        with self._lock:
+            entry = self._cache.get(group_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        if entry[1] is None:
+            raise GroupNotFound(group_id)
+        return entry[1]
+
+    def members(self, group_id, query=''):
+        """그룹 멤버 튜플 (없는 그룹 → GroupNotFound, 잘못된 멤버 목록 → ValueError)"""
+        members = self.cached(group_id, query)
+        if members is not None:
+            return members
+        doc = self.db.collection(GROUP_COLLECTION).document(group_id).get()
+        data = doc.to_dict() if doc.exists else None
+        members = None
+        if data and data.get('members'):
+            members = parse_members(','.join(str(m) for m in data['members']), self.max_members)
+        with self._lock:
+            self._cache[group_id] = (time.monotonic(), members)
+        if members is None:
+            raise GroupNotFound(group_id)
+        return members
+
+
+def member_indexes(visit_index, members, timeout=None):
+    """멤버 인덱스를 한꺼번에 구독 시작한 뒤 모두 로딩될 때까지 대기 (하나라도 못 쓰면 None)
+
+    한 명씩 ready_index()로 기다리면 로딩 대기가 멤버 수만큼 이어지므로
+    먼저 모두 index_for()로 로딩을 시작하고 한 기한 안에서 기다립니다.
+    """
+    indexes = [visit_index.index_for(member) for member in members]
+    if any(index is None for index in indexes):
+        return None
+    deadline = time.monotonic() + (visit_index.load_timeout if timeout is None else timeout)
+    for index in indexes:
+        if not index.ready.wait(max(0.0, deadline - time.monotonic())):
+            return None
+    return indexes
+
+
+def _member_arrays(keys, levels, overlay):
+    """TileLevelMap.parts() → (Morton 키 uint64 배열, level uint8 배열) (overlay 반영, 정렬 안 됨)"""
+    keys = np.asarray(keys).astype(np.uint64)
+    packed = np.frombuffer(levels, dtype=np.uint8)
+    unpacked = ((packed[:, None] >> _LEVEL_SHIFTS) & 0b11).ravel()[:len(keys)]
+    if not overlay:
+        return keys, unpacked
+    changed = np.fromiter(overlay.keys(), dtype=np.uint64, count=len(overlay))
+    keep = ~np.isin(keys, changed)
+    added = [(key, level) for key, level in overlay.items() if level is not None]
+    added_keys = np.array([key for key, _ in added], dtype=np.uint64)
+    added_levels = np.array([level for _, level in added], dtype=np.uint8)
+    return (np.concatenate([keys[keep], added_keys]),
+            np.concatenate([unpacked[keep], added_levels]))
+
+
+def union_levels(member_arrays):
+    """멤버별 (키, level) 배열 → 키 순서로 정렬된 합집합 (키마다 최소 level)"""
+    keys = np.concatenate([keys for keys, _ in member_arrays])
+    levels = np.concatenate([levels for _, levels in member_arrays])
+    order = np.lexsort((levels, keys))
+    keys, levels = keys[order], levels[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first], levels[first]
+
+
+def _to_array(typecode, values):
+    result = array(typecode)
+    result.frombytes(np.ascontiguousarray(values, dtype=np.dtype(typecode)).tobytes())
+    return result
+
+
+def level_map_from_arrays(zoom, keys, levels):
+    """정렬된 키/level 배열 → TileLevelMap (2비트 패킹도 NumPy로)"""
+    count = len(keys)
+    padded = np.zeros((count + 3) // 4 * 4, dtype=np.uint8)
+    padded[:count] = levels
+    packed = np.bitwise_or.reduce(padded.reshape(-1, 4) << _LEVEL_SHIFTS, axis=1)
+    return TileLevelMap(zoom, _to_array(key_typecode(zoom), keys), packed.astype(np.uint8).tobytes(), count)
+
+
+def morton_decode_array(keys):
+    """Morton 키 배열 → (x 배열, y 배열) (fog_bitmap.morton_decode의 벡터 버전)"""
+    xs = np.zeros(len(keys), dtype=np.uint64)
+    ys = np.zeros(len(keys), dtype=np.uint64)
+    one = np.uint64(1)
+    for bit in range(32):
+        xs |= ((keys >> np.uint64(2 * bit)) & one) << np.uint64(bit)
+        ys |= ((keys >> np.uint64(2 * bit + 1)) & one) << np.uint64(bit)
+    return xs, ys
+
+
+def union_pyramid(base_zoom, keys, levels, min_zoom=0):
+    """합집합 키/level 배열 → FogPyramid (조상 집계는 피라미드가 정렬된 키 배열에서 조회 때 계산)"""
+    return FogPyramid(base_zoom, min_zoom, level_map_from_arrays(base_zoom, keys, levels))
+
+
+class GroupIndex:
+    """멤버 인덱스들을 합성한 읽기 전용 인덱스 (UserVisitIndex와 같은 조회 인터페이스)"""
+
+    # 여러 기록 줌 중 가장 밝은 값 (사용자 인덱스와 같은 규칙)
+    fog_state = UserVisitIndex.fog_state
+
+    def __init__(self, members, member_tags, pyramids, member_indexes=()):
+        self.members = members
+        self.member_tags = member_tags
+        self.pyramids = pyramids
+        digest = hashlib.sha1('\0'.join(members + member_tags).encode('utf-8')).hexdigest()
+        # 마스크 렌더러 캐시 키 (멤버 목록마다 구분)
+        self.user_id = 'group:' + hashlib.sha1('\0'.join(members).encode('utf-8')).hexdigest()[:16]
+        self.version_tag = 'g' + digest[:16]
+        self._member_indexes = tuple(member_indexes)
+
+    @classmethod
+    def build(cls, members, indexes):
+        """멤버 인덱스 → 합성 인덱스 (줌별 NumPy 합집합)"""
+        tags = []
+        by_zoom = {}
+        for index in indexes:
+            tag, parts = index.level_parts()
+            tags.append(tag)
+            for zoom, part in parts.items():
+                by_zoom.setdefault(zoom, []).append(_member_arrays(*part))
+        pyramids = {}
+        for zoom, arrays in by_zoom.items():
+            keys, levels = union_levels(arrays)
+            if len(keys):
+                pyramids[zoom] = union_pyramid(zoom, keys, levels)
+        return cls(tuple(members), tuple(tags), pyramids, indexes)
+
+    def fog_level(self, zoom, x, y):
+        return self.fog_state(zoom, x, y)[0]
+
+    def visit_points(self):
+        """멤버 전체의 방문 위치 위도, 경도를 이어 붙인 배열 (마스크 렌더링용)"""
+        points = array('d')
+        for index in self._member_indexes:
+            points.extend(index.visit_points())
+        return points
+
+    def level_maps(self):
+        return {zoom: pyramid.levels for zoom, pyramid in self.pyramids.items()}
+
+    def __len__(self):
+        return sum(len(pyramid) for pyramid in self.pyramids.values())
+
+
+class GroupComposer:
+    """멤버 목록 → 합성 인덱스 캐시 (멤버 방문 버전이 모두 같으면 재사용, 최근 사용 기준 LRU)"""
+
+    def __init__(self, max_groups=None):
+        self.max_groups = (_env_number('FOG_GROUP_CACHE', DEFAULT_MAX_COMPOSITES, int)
+                           if max_groups is None else max_groups)
+        self._cache = OrderedDict()  # 멤버 튜플 → GroupIndex
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+
+    def cached(self, members, indexes):
+        """멤버 버전이 그대로인 캐시된 합성 인덱스 (없거나 낡았으면 None)"""
+        tags = tuple(index.version_tag for index in indexes)
+        with self._lock:
+            group = self._cache.get(members)
+            if group is None or group.member_tags != tags:
+                return None
+            self._cache.move_to_end(members)
+            self.hits += 1
+            return group
+
+    def composite(self, members, indexes):
+        """합성 인덱스 (캐시가 낡았으면 다시 합성)"""
+        group = self.cached(members, indexes)
+        if group is not None:
+            return group
+        started = time.perf_counter()
+        group = GroupIndex.build(members, indexes)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.builds += 1
+            self.build_seconds += elapsed
+            self._cache[members] = group
+            self._cache.move_to_end(members)
+            while len(self._cache) > self.max_groups:
+                self._cache.popitem(last=False)
+        return group
+
+    def stats(self):
+        with self._lock:
+            return {
+                "groups": len(self._cache),
+                "hits": self.hits,
+                "builds": self.builds,
+                "buildSeconds": round(self.build_seconds, 3),
+            }
+
+
+def min_levels(member_levels):
+    """멤버별 뷰포트 level 목록 → 타일별 최솟값 (인덱스 없이 저장소에서 읽었을 때)"""
+    return np.minimum.reduce(np.asarray(member_levels, dtype=np.uint8), axis=0).tolist()
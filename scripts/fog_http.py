@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+타일 응답 캐시 헤더 / ETag 조건부 요청 처리
+
+ETag 형식: "f{fogLevel}" 또는 "f{fogLevel}-{방문 버전}"
+- WebP 응답은 접두어 w를 사용합니다 ("w{fogLevel}-{방문 버전}").
+  같은 URL이 Accept에 따라 다른 바이트를 주므로 형식이 다르면 ETag도 달라야 합니다.
+- 타일 PNG는 fog level에만 의존하므로 level이 같으면 내용도 같습니다.
+- 방문 버전(UserVisitIndex.version_tag)이 클라이언트가 가진 ETag와 같으면
+  방문 기록이 바뀌지 않았다는 뜻이므로 fog level 조회 없이 바로 304를 응답합니다.
+
+캐시 헤더 설정 (환경변수):
+    FOG_TILE_MAX_AGE   Cache-Control max-age (초, 기본 0 → 매번 재검증)
+    FOG_TILE_SWR       stale-while-revalidate (초, 기본 60)
+"""
+
+import os
+
+DEFAULT_MAX_AGE = 0
+DEFAULT_STALE_WHILE_REVALIDATE = 60
+
+# 타일 출력 형식 → ETag 접두어
+ETAG_PREFIXES = {
+    'png': 'f',
+    'webp': 'w',
+}
+
+
+def _env_seconds(name, default):
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def cache_control_from_env(visibility='private'):
+    """환경변수 설정으로 Cache-Control 헤더 값 생성"""
+    max_age = _env_seconds('FOG_TILE_MAX_AGE', DEFAULT_MAX_AGE)
+    swr = _env_seconds('FOG_TILE_SWR', DEFAULT_STALE_WHILE_REVALIDATE)
+    return cache_control(max_age, swr, visibility)
+
+
+def cache_control(max_age, stale_while_revalidate, visibility='private'):
+    """Cache-Control 헤더 값 생성"""
+    value = f"{visibility}, max-age={max_age}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={stale_while_revalidate}"
+    return value
+
+
+def make_etag(fog_level, version=None, fmt='png'):
+    """fog level(+ 방문 버전)과 출력 형식으로 ETag 생성"""
+    prefix = ETAG_PREFIXES[fmt]
+    if version is None:
+        return f'"{prefix}{fog_level}"'
+    return f'"{prefix}{fog_level}-{version}"'
+
+
+def parse_etags(header, fmt='png'):
+    """If-None-Match 헤더 → 해당 형식의 (fog level 문자열, 방문 버전 또는 None) 목록"""
+    tags = []
+    if not header:
+        return tags
+    prefix = ETAG_PREFIXES[fmt]
+    for raw in header.split(','):
+        tag = raw.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if not tag.startswith(prefix):
+            continue
+        level, _, version = tag[1:].partition('-')
+        tags.append((level, version or None))
+    return tags
+
+
+def version_matches(header, version, fmt='png'):
+    """클라이언트 ETag 중 현재 방문 버전과 같은 것이 있으면 그 fog level 문자열 반환"""
+    if version is None:
+        return None
+    for level, tag_version in parse_etags(header, fmt):
+        if tag_version == version:
+            return level
+    return None
+
+
+def level_matches(header, fog_level, fmt='png'):
+    """클라이언트 ETag 중 fog level이 같은 것이 있는지 (방문 버전이 달라도 내용은 같음)"""
+    fog_level = str(fog_level)
+    return any(level == fog_level for level, _ in parse_etags(header, fmt))
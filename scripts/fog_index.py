@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+사용자별 방문 타일 메모리 인덱스
+
+사용자가 처음 타일을 요청하면 visits_tiles/{userId}/visited 서브컬렉션 전체를
+on_snapshot 리스너로 구독합니다. 첫 스냅샷으로 전체를 로드하고, 이후에는
+추가/수정/삭제 변경분만 반영하므로 타일 조회는 Firestore 왕복 없이 dict 조회로 끝납니다.
+방문 기록이 없는 줌 레벨의 타일은 줌 피라미드(fog_pyramid.py) 집계로 fog level을 구합니다.
+
+snapshot_path를 주면 시작 시 압축 스냅샷 파일(fog_bitmap.py)을 mmap으로 열어
+리스너의 첫 스냅샷이 오기 전에도 바로 응답하고, 종료 시 현재 상태를 다시 저장합니다.
+
+사용 예:
+    registry = VisitIndexRegistry(firestore.client())
+    fog_level = registry.fog_level(user_id, zoom, x, y)  # 로딩 실패 시 None
+"""
+
+import threading
+import time
+import itertools
+import os
+import uuid
+from collections import OrderedDict
+from fog_bitmap import BitmapSnapshot, PointMap, write_snapshot
+from fog_pyramid import FogPyramid
+
+DEFAULT_FOG_LEVEL = 3
+
+# 인덱스가 새로 만들어질 때마다(재시작/eviction 후 재구독) 버전이 겹치지 않도록 붙이는 값
+PROCESS_TOKEN = uuid.uuid4().hex[:6]
+_INDEX_SERIAL = itertools.count(1)
+
+
+def tile_key(zoom, x, y):
+    """타일 ID 생성 (FogOfWarManager와 동일한 방식)"""
+    return f"{zoom}_{x}_{y}"
+
+
+def parse_tile_key(tile_id):
+    """'z_x_y' 형식의 타일 ID를 (z, x, y)로 변환 (형식이 다르면 None)"""
+    parts = tile_id.split('_')
+    if len(parts) != 3:
+        return None
+    try:
+        return tuple(int(p) for p in parts)
+    except ValueError:
+        return None
+
+
+def visit_location(data):
+    """방문 문서의 location(GeoPoint)을 (위도, 경도)로 변환 (없으면 None)"""
+    location = data.get('location')
+    if location is None:
+        return None
+    if isinstance(location, dict):
+        lat, lon = location.get('latitude'), location.get('longitude')
+    else:
+        lat = getattr(location, 'latitude', None)
+        lon = getattr(location, 'longitude', None)
+    if lat is None or lon is None:
+        return None
+    return float(lat), float(lon)
+
+
+class UserVisitIndex:
+    """한 사용자의 방문 타일 → fogLevel 인덱스 (스냅샷 리스너가 갱신)
+
+    방문 기록 줌마다 FogPyramid 하나를 두고, 타일 자체는 피라미드의 압축 맵
+    (fog_bitmap.TileLevelMap)에 보관합니다.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.pyramids = {}  # 방문 기록 줌 → FogPyramid
+        self.points = PointMap()  # 방문 타일 → 방문 위치 (위도, 경도), 마스크 렌더링용
+        self.version = 0
+        self.serial = next(_INDEX_SERIAL)
+        self.ready = threading.Event()
+        self.synced = False  # 리스너의 첫 스냅샷을 받았는지 (False면 스냅샷 파일 데이터)
+        self.watch = None
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_documents(cls, user_id, docs):
+        """(타일 ID, 방문 문서 dict) 목록으로 만든 인덱스 (리스너 없이, 내보내기 등 도구용)"""
+        index = cls(user_id)
+        for tile_id, data in docs:
+            cls._update_pyramid(index.pyramids, tile_id, data.get('fogLevel', DEFAULT_FOG_LEVEL))
+            cls._update_point(index.points, tile_id, data)
+        index.synced = True
+        index.version += 1
+        index.ready.set()
+        return index
+
+    def load_level_maps(self, level_maps):
+        """스냅샷 파일의 줌별 TileLevelMap으로 미리 채움 (리스너 첫 스냅샷 전까지 사용)"""
+        with self._lock:
+            if self.synced:
+                return
+            self.pyramids = {zoom: FogPyramid(zoom, levels=level_map)
+                             for zoom, level_map in level_maps.items()}
+            self.version += 1
+        self.ready.set()
+
+    def on_snapshot(self, docs, changes, read_time):
+        """Firestore 스냅샷 콜백: 첫 호출은 전체 문서로 재구성, 이후는 변경분만 반영"""
+        with self._lock:
+            if not self.synced:
+                # 스냅샷 파일 이후 삭제된 문서도 반영되도록 전체 문서로 새로 만든 뒤 교체
+                pyramids = {}
+                points = PointMap()
+                for doc in docs:
+                    data = doc.to_dict() or {}
+                    self._update_pyramid(pyramids, doc.id, data.get('fogLevel', DEFAULT_FOG_LEVEL))
+                    self._update_point(points, doc.id, data)
+                self.pyramids = pyramids
+                self.points = points
+                self.synced = True
+                self.version += 1
+            else:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == 'REMOVED':
+                        self._update_pyramid(self.pyramids, doc.id, None)
+                        self._update_point(self.points, doc.id, None)
+                    else:
+                        data = doc.to_dict() or {}
+                        level = data.get('fogLevel', DEFAULT_FOG_LEVEL)
+                        self._update_pyramid(self.pyramids, doc.id, level)
+                        self._update_point(self.points, doc.id, data)
+                if changes:
+                    self.version += 1
+        self.ready.set()
+
+    @staticmethod
+    def _update_pyramid(pyramids, tile_id, level):
+        """방문 타일 변경을 해당 줌의 피라미드 집계에 반영 (level=None이면 삭제)"""
+        coords = parse_tile_key(tile_id)
+        if coords is None:
+            return
+        zoom, x, y = coords
+        pyramid = pyramids.get(zoom)
+        if pyramid is None:
+            if level is None:
+                return
+            pyramid = pyramids[zoom] = FogPyramid(zoom)
+        if level is None:
+            pyramid.remove(x, y)
+        else:
+            pyramid.set(x, y, level)
+
+    @staticmethod
+    def _update_point(points, tile_id, data):
+        """방문 위치 변경 반영 (data=None이거나 location이 없으면 삭제)"""
+        coords = parse_tile_key(tile_id)
+        if coords is None:
+            return
+        zoom, x, y = coords
+        if not (0 <= zoom <= 28 and 0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+            return  # 위치 키(fog_bitmap.point_key)로 표현할 수 없는 타일 ID
+        location = visit_location(data) if data is not None else None
+        if location is None:
+            points.discard(zoom, x, y)
+        else:
+            points.set(zoom, x, y, location)
+
+    def visit_points(self):
+        """방문 위치 위도, 경도를 이어 붙인 float64 배열 (스냅샷 파일에는 위치가 없으므로 리스너 동기화 후부터)"""
+        return self.points.coords()
+
+    def fog_level(self, zoom, x, y):
+        """인덱스에서 fog level 조회 (방문 기록 없는 줌은 피라미드 집계, 그래도 없으면 3)"""
+        self.last_used = time.monotonic()
+        return self.fog_state(zoom, x, y)[0]
+
+    def fog_state(self, zoom, x, y):
+        """피라미드 집계로 구한 (fog level, 방문 커버리지) — 여러 기록 줌 중 가장 밝은 값"""
+        pyramid = self.pyramids.get(zoom)
+        if pyramid is not None and len(self.pyramids) == 1:
+            return pyramid.state(zoom, x, y)
+
+        best_level, best_coverage = DEFAULT_FOG_LEVEL, 0.0
+        for pyramid in list(self.pyramids.values()):
+            level, coverage = pyramid.state(zoom, x, y)
+            best_level = min(best_level, level)
+            best_coverage = max(best_coverage, coverage)
+        return best_level, best_coverage
+
+    @property
+    def version_tag(self):
+        """방문 기록이 바뀔 때마다 달라지는 버전 문자열 (ETag 용)"""
+        return f"{PROCESS_TOKEN}{self.serial:x}.{self.version}"
+
+    def level_maps(self):
+        """줌별 TileLevelMap (스냅샷 저장용)"""
+        return {zoom: pyramid.levels for zoom, pyramid in self.pyramids.items()}
+
+    def level_parts(self):
+        """(버전, 줌별 TileLevelMap.parts()) — 그룹 합성용 (리스너 갱신 도중 값을 읽지 않도록 잠금)"""
+        with self._lock:
+            return self.version_tag, {zoom: pyramid.levels.parts()
+                                      for zoom, pyramid in self.pyramids.items()}
+
+    @property
+    def is_live(self):
+        """리스너가 살아 있는지 (에러로 종료되면 재구독 필요)"""
+        return self.watch is None or self.watch.is_active
+
+    def close(self):
+        if self.watch is not None:
+            try:
+                self.watch.unsubscribe()
+            except Exception:
+                pass
+            self.watch = None
+
+    def __len__(self):
+        return sum(len(pyramid) for pyramid in list(self.pyramids.values()))
+
+
+class VisitIndexRegistry:
+    """사용자별 UserVisitIndex를 관리 (최근 사용 기준 max_users명 유지)"""
+
+    def __init__(self, db, max_users=1000, load_timeout=10.0, snapshot_path=None):
+        self.db = db
+        self.max_users = max_users
+        self.load_timeout = load_timeout
+        self.snapshot_path = snapshot_path
+        self.snapshot = None
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self.snapshot = BitmapSnapshot(snapshot_path)
+                print(f"✅ 방문 타일 스냅샷 로드: {snapshot_path} (사용자 {len(self.snapshot.sections)}명)")
+            except (OSError, ValueError) as e:
+                print(f"❌ 방문 타일 스냅샷 로드 실패: {e}")
+
+    def index_for(self, user_id):
+        """사용자 인덱스 반환 (처음이면 구독 시작, 아직 로딩 중일 수 있음)
+
+        리스너 등록에 실패하면 None을 반환하므로 호출 측은 직접 조회로 대체합니다.
+        """
+        evicted = []
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.is_live:
+                self._indexes.move_to_end(user_id)
+                return index
+            if index is not None:
+                evicted.append(index)
+
+            index = UserVisitIndex(user_id)
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                _, old = self._indexes.popitem(last=False)
+                evicted.append(old)
+
+        for old in evicted:
+            old.close()
+        if self.snapshot is not None and user_id in self.snapshot.sections:
+            index.load_level_maps(self.snapshot.level_maps(user_id))
+        if index.watch is None and not self._subscribe(index):
+            return None
+        return index
+
+    def _subscribe(self, index):
+        """visited 서브컬렉션 스냅샷 리스너 등록"""
+        collection = (self.db.collection('visits_tiles').document(index.user_id)
+                      .collection('visited'))
+        try:
+            index.watch = collection.on_snapshot(index.on_snapshot)
+            return True
+        except Exception as e:
+            print(f"❌ 방문 타일 리스너 등록 실패: userId={index.user_id}, {e}")
+            with self._lock:
+                if self._indexes.get(index.user_id) is index:
+                    del self._indexes[index.user_id]
+            return False
+
+    def ready_index(self, user_id, timeout=None):
+        """첫 로딩까지 기다린 사용자 인덱스 (timeout 안에 끝나지 않으면 None)"""
+        index = self.index_for(user_id)
+        if index is None:
+            return None
+        if not index.ready.wait(self.load_timeout if timeout is None else timeout):
+            return None
+        return index
+
+    def fog_level(self, user_id, zoom, x, y, timeout=None):
+        """인덱스에서 fog level 조회 (인덱스를 쓸 수 없으면 None)"""
+        index = self.ready_index(user_id, timeout)
+        if index is None:
+            return None
+        return index.fog_level(zoom, x, y)
+
+    def stats(self):
+        """인덱스 상태 요약 (/health 용)"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "users": len(indexes),
+            "tiles": sum(len(index) for index in indexes),
+        }
+
+    def save_snapshot(self, path=None):
+        """메모리 인덱스(+ 메모리에 없는 사용자는 기존 스냅샷)를 스냅샷 파일로 저장"""
+        path = path or self.snapshot_path
+        if not path:
+            return 0
+        with self._lock:
+            indexes = list(self._indexes.values())
+
+        sections = []
+        saved_users = set()
+        for index in indexes:
+            if not index.ready.is_set():
+                continue
+            with index._lock:
+                for zoom, level_map in index.level_maps().items():
+                    sections.append((index.user_id, zoom, level_map.packed()))
+            saved_users.add(index.user_id)
+        if self.snapshot is not None:
+            for user_id in self.snapshot.users():
+                if user_id not in saved_users:
+                    for zoom, packed in self.snapshot.packed_sections(user_id):
+                        sections.append((user_id, zoom, packed))
+
+        count = write_snapshot(path, sections)
+        print(f"💾 방문 타일 스냅샷 저장: {path} ({count}개 섹션)")
+        return count
+
+    def close(self):
+        """모든 리스너 해제 (snapshot_path가 있으면 먼저 스냅샷 저장)"""
+        if self.snapshot_path:
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                print(f"❌ 방문 타일 스냅샷 저장 실패: {e}")
+        with self._lock:
+            indexes = list(self._indexes.values())
+            self._indexes.clear()
+        for index in indexes:
+            index.close()
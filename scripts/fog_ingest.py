@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+GPS 궤적 일괄 반영 (POST /visits/{userId})
+
+앱이 방문 타일을 계산해 visits_tiles/{userId}/visited/{tileId} 문서를 하나씩 쓰는 대신,
+GPS 점 묶음을 서버에 보내면 서버가 방문 타일과 fog level을 계산해 저장소에 일괄로 씁니다.
+
+요청 본문 (JSON):
+    {"points": [[위도, 경도], [위도, 경도, 시각(epoch 초)], ...]}   # 최대 MAX_INGEST_POINTS개
+
+계산 (NumPy 벡터 연산):
+1. 각 점이 들어 있는 타일 주변 후보 타일 중심까지의 haversine 거리를 (점 × 후보) 행렬로 한 번에 계산
+2. 점이 들어 있는 타일과 중심이 reveal 반경(FOG_REVEAL_RADIUS_M, 기본 1000m) 안인 타일 → fogLevel 1
+   fogLevel 1 타일의 주변 8개 타일 → fogLevel 2
+3. 기존 방문 기록과 합침: fog level은 낮아지기만 하고(1 < 2 < 3), level이 낮아지는 타일과
+   다시 방문한 level 1 타일(visitedAt 갱신)만 씀
+4. 저장소 put_many로 기록 (Firestore는 500개씩 batch commit)
+
+캐시 일관성: 미방문 Bloom 필터는 put_many가 쓰기 전에 갱신하고, 메모리 인덱스/마스크 캐시는
+Firestore 스냅샷 리스너가 변경을 받아 방문 버전이 바뀌면서 갱신됩니다.
+
+FOG_INGEST_TOKEN을 설정하면 Authorization: Bearer <토큰> 헤더가 맞는 요청만 받고,
+설정하지 않으면 로컬(loopback) 요청만 받습니다 (fog_profile 관리자 엔드포인트와 같은 규칙).
+"""
+
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime, timezone
+import numpy as np
+from fog_index import tile_key
+from fog_profile import bearer_authorized
+from fog_mask import EARTH_CIRCUMFERENCE_M, lonlat_to_world, reveal_radius_from_env
+
+INGEST_PATTERN = re.compile(r'/visits/([^/]+)$')
+
+# 방문 문서를 쓰는 줌 (앱 FogOfWarManager와 같은 줌)
+VISIT_ZOOM = 15
+
+# 요청 하나에 받을 최대 GPS 점 수 / 본문 크기
+MAX_INGEST_POINTS = 10000
+MAX_INGEST_BODY = 2 * 1024 * 1024
+
+EARTH_RADIUS_M = 6371000.0
+
+MAX_LATITUDE = 85.05112878
+
+_NEIGHBOR_OFFSETS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                              if (dx, dy) != (0, 0)], dtype=np.int64)
+
+
+def ingest_token_from_env():
+    return os.environ.get('FOG_INGEST_TOKEN') or None
+
+
+def authorized(authorization, client_host, token=None):
+    """FOG_INGEST_TOKEN이 있으면 Bearer 토큰 비교, 없으면 로컬 요청만 허용"""
+    token = ingest_token_from_env() if token is None else token
+    return bearer_authorized(authorization, client_host, token)
+
+
+def ingest_banner():
+    """시작 로그: 쓰기 엔드포인트 인증 방식"""
+    if ingest_token_from_env() is None:
+        return ("⚠️ FOG_INGEST_TOKEN이 없어 POST /visits는 로컬 요청만 받습니다 "
+                "(외부 앱에서 쓰려면 토큰을 설정하세요)")
+    return "🔐 POST /visits: Authorization: Bearer $FOG_INGEST_TOKEN 필요"
+
+
+def parse_points(body):
+    """요청 본문 → (N, 3) 배열 [위도, 경도, 시각] (시각이 없으면 현재 시각), 잘못되면 ValueError"""
+    if len(body) > MAX_INGEST_BODY:
+        raise ValueError(f"본문이 너무 큽니다 (최대 {MAX_INGEST_BODY} bytes)")
+    try:
+        points = json.loads(body)["points"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('{"points": [[위도, 경도, 시각?], ...]} 형식의 JSON이 필요합니다')
+    if not isinstance(points, list) or not points:
+        raise ValueError("points가 비어 있습니다")
+    if len(points) > MAX_INGEST_POINTS:
+        raise ValueError(f"한 번에 최대 {MAX_INGEST_POINTS}개 점까지 보낼 수 있습니다")
+
+    now = time.time()
+    rows = []
+    for point in points:
+        if not isinstance(point, (list, tuple)) or len(point) not in (2, 3):
+            raise ValueError(f"점은 [위도, 경도] 또는 [위도, 경도, 시각]이어야 합니다: {point!r}")
+        rows.append((point[0], point[1], point[2] if len(point) == 3 else now))
+    try:
+        array = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("좌표와 시각은 숫자여야 합니다")
+    if not np.isfinite(array).all():
+        raise ValueError("좌표에 NaN/무한대가 있습니다")
+    if (np.abs(array[:, 0]) > MAX_LATITUDE).any() or (np.abs(array[:, 1]) > 180.0).any():
+        raise ValueError("위도는 ±85.05, 경도는 ±180 범위여야 합니다")
+    return array
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """두 위치 사이 거리 (미터, 배열 브로드캐스트)"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def tile_centers(zoom, tx, ty):
+    """타일 좌표 배열 → 중심 (위도, 경도) 배열"""
+    n = float(1 << zoom)
+    lon = (tx + 0.5) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * (ty + 0.5) / n))))
+    return lat, lon
+
+
+def _candidates(index, reach, px, py, lat, lon, zoom, radius_m):
+    """점 index 묶음의 후보 창(±reach 타일) → 평평한 (키, 거리, 점 번호, level 1 여부) 배열"""
+    n = 1 << zoom
+    offsets = np.arange(-reach, reach + 1, dtype=np.int64)
+    dx, dy = (grid.ravel() for grid in np.meshgrid(offsets, offsets))
+    cx = px[index, None] + dx[None, :]
+    cy = py[index, None] + dy[None, :]
+    valid = (cx >= 0) & (cx < n) & (cy >= 0) & (cy < n)
+
+    center_lat, center_lon = tile_centers(zoom, cx, cy)
+    distance = haversine_m(lat[index, None], lon[index, None], center_lat, center_lon)
+    own_tile = (dx == 0) & (dy == 0)
+    level1 = (distance <= radius_m) | own_tile[None, :]
+    point = np.broadcast_to(index[:, None], cx.shape)
+    return (cx * n + cy)[valid], distance[valid], point[valid], level1[valid]
+
+
+def compute_visits(points, zoom=VISIT_ZOOM, radius_m=None):
+    """GPS 점 배열 [위도, 경도, 시각] → {tile_id: 방문 문서} (fogLevel 1/2, distance, visitedAt, location)
+
+    타일마다 가장 가까운 점 기준으로 distance(km)/location/visitedAt을 정합니다.
+    """
+    radius_m = reveal_radius_from_env() if radius_m is None else radius_m
+    lat, lon, stamps = points[:, 0], points[:, 1], points[:, 2]
+    n = 1 << zoom
+
+    wx, wy = lonlat_to_world(lon, lat)
+    px = np.clip((wx * n).astype(np.int64), 0, n - 1)
+    py = np.clip((wy * n).astype(np.int64), 0, n - 1)
+
+    # 후보 창: 반경 안 타일(level 1) + 그 주변 한 칸(level 2)이 모두 들어가는 크기
+    # 타일 폭은 위도마다 달라서 점마다 창 크기를 정하고, 같은 크기끼리 묶어 계산
+    tile_width_m = EARTH_CIRCUMFERENCE_M * np.cos(np.radians(lat)) / n
+    reaches = np.ceil(radius_m / tile_width_m).astype(np.int64) + 1
+    parts = [_candidates(np.flatnonzero(reaches == reach), int(reach), px, py, lat, lon, zoom, radius_m)
+             for reach in np.unique(reaches)]
+    keys, distance, flat_point, level1 = (np.concatenate(column) for column in zip(*parts))
+
+    level1_keys = np.unique(keys[level1])
+    ring = ((level1_keys // n)[:, None] + _NEIGHBOR_OFFSETS[None, :, 0]) * n + \
+           ((level1_keys % n)[:, None] + _NEIGHBOR_OFFSETS[None, :, 1])
+    ring_x, ring_y = ring // n, ring % n
+    ring = ring[(ring_x >= 0) & (ring_x < n) & (ring_y >= 0) & (ring_y < n)]
+    level2_keys = np.setdiff1d(np.unique(ring), level1_keys)
+
+    # 타일별 가장 가까운 점: (키, 거리) 순 정렬 후 키마다 첫 원소
+    order = np.lexsort((distance, keys))
+    sorted_keys = keys[order]
+    first = np.ones(len(sorted_keys), dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    nearest_keys = sorted_keys[first]
+    nearest_distance = distance[order][first]
+    nearest_point = flat_point[order][first]
+
+    wanted = np.concatenate([level1_keys, level2_keys])
+    levels = np.concatenate([np.ones(len(level1_keys), dtype=np.int64),
+                             np.full(len(level2_keys), 2, dtype=np.int64)])
+    slots = np.searchsorted(nearest_keys, wanted)
+
+    visits = {}
+    for key, level, slot in zip(wanted.tolist(), levels.tolist(), slots.tolist()):
+        point = int(nearest_point[slot])
+        visits[tile_key(zoom, key // n, key % n)] = {
+            'fogLevel': level,
+            'distance': round(float(nearest_distance[slot]) / 1000.0, 4),
+            'visitedAt': datetime.fromtimestamp(float(stamps[point]), timezone.utc),
+            'location': {'latitude': float(lat[point]), 'longitude': float(lon[point])},
+        }
+    return visits
+
+
+def existing_levels(store, user_id, tile_ids, visit_index=None):
+    """기존 fog level {tile_id: level} (메모리 인덱스가 준비됐으면 인덱스, 아니면 저장소 조회)"""
+    index = visit_index.ready_index(user_id) if visit_index is not None else None
+    if index is not None:
+        return {tile_id: index.fog_level(*_coords(tile_id)) for tile_id in tile_ids}
+    return store.fog_levels(user_id, tile_ids)
+
+
+def _coords(tile_id):
+    zoom, x, y = tile_id.split('_')
+    return int(zoom), int(x), int(y)
+
+
+def ingest_visits(store, user_id, points, visit_index=None, zoom=VISIT_ZOOM, radius_m=None):
+    """GPS 점 배열을 방문 기록에 합쳐 저장 → 요약 dict"""
+    visits = compute_visits(points, zoom, radius_m)
+    current = existing_levels(store, user_id, list(visits), visit_index)
+
+    docs = []
+    for tile_id, data in visits.items():
+        old = current.get(tile_id, 3)
+        level = data['fogLevel']
+        if level < old or level == 1:
+            # 재방문한 level 1 타일은 visitedAt/distance/location만 갱신
+            docs.append((user_id, tile_id, dict(data, fogLevel=min(level, old))))
+    if docs:
+        store.put_many(docs)
+
+    level1 = sum(1 for data in visits.values() if data['fogLevel'] == 1)
+    return {
+        "userId": user_id,
+        "points": len(points),
+        "tiles": len(visits),
+        "level1": level1,
+        "level2": len(visits) - level1,
+        "written": len(docs),
+    }
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+픽셀 단위 Fog 마스크 렌더링 (NumPy 벡터 연산)
+
+타일 전체를 fogLevel 하나의 단색으로 칠하면 탐색 경계가 타일 모양(계단)으로 보입니다.
+마스크 모드에서는 방문 문서의 위치(location)를 중심으로 reveal 반경 안의 픽셀만
+투명하게 뚫고, 나머지는 타일의 fog level에 따른 배경(회색/검은색)으로 칠합니다.
+
+- 거리 계산은 픽셀 루프나 ImageDraw 호출 없이 NumPy 브로드캐스트로 한 번에 처리
+- 근처에 방문 지점이 없거나 타일 전체가 반경 안이면 기존 단색 타일(캐시)을 그대로 사용
+- 마스크 타일은 배경색 하나 + 알파 단계뿐이므로 16단계 알파 팔레트 이미지(4비트 PNG)로 생성
+- 렌더링한 마스크 타일은 (사용자, 방문 버전, z, x, y, 형식) 키로 LRU 캐시
+- 메타타일: N x N 타일 블록을 한 번에 렌더링해 자르고, 이웃 타일은 캐시에 미리 넣음
+
+설정 (환경변수):
+    FOG_RENDER_MODE=mask      마스크 모드 사용 (기본: flat)
+    FOG_REVEAL_RADIUS_M       reveal 반경 (미터, 기본 1000 — 앱 FogService Level 1 반경)
+    FOG_METATILE              메타타일 한 변의 타일 수 (기본 1 = 타일 단위, 예: 8)
+    FOG_MASK_CACHE_TILES      렌더링한 마스크 타일 캐시 크기 (타일 수, 기본 32768)
+
+벤치마크:
+    python fog_bench.py render --metatile 8    # 서버 요청 단위 flat 대비 mask 비용 비율 (HTTP 포함)
+    python fog_mask.py bench [타일 수]          # 렌더링 함수만 (캐시 없는 첫 렌더링 비용)
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from fog_tiles import FOG_LEVEL_COLORS, TILE_SIZE, RenderedTileCache, render_fog_level
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+DEFAULT_REVEAL_RADIUS_M = 1000.0
+
+# 반경 경계를 부드럽게 처리하는 폭 (픽셀)
+EDGE_FEATHER_PX = 1.5
+
+# 경계 알파 단계 수 (16 → 4비트 팔레트 PNG, 1.5px 경계에서는 256단계와 구분 불가)
+MASK_ALPHA_STEPS = 16
+
+# 메타타일 기본 크기 (1 = 타일 단위 렌더링)
+DEFAULT_METATILE = 1
+
+# 렌더링한 마스크 타일 LRU 크기 (타일 수, 4비트 팔레트 PNG 평균 약 250바이트 → 기본 약 8MB)
+DEFAULT_MASK_CACHE_TILES = 32768
+
+
+def reveal_radius_from_env():
+    """FOG_REVEAL_RADIUS_M 환경변수 (미터)"""
+    try:
+        return float(os.environ.get('FOG_REVEAL_RADIUS_M', DEFAULT_REVEAL_RADIUS_M))
+    except ValueError:
+        return DEFAULT_REVEAL_RADIUS_M
+
+
+def lonlat_to_world(lon, lat):
+    """경위도 → Web Mercator 정규화 좌표 (0~1, 배열 가능)"""
+    lat_rad = np.radians(np.clip(lat, -85.05112878, 85.05112878))
+    wx = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    wy = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0
+    return wx, wy
+
+
+def points_to_world(points):
+    """위도, 경도를 이어 붙인 배열 (또는 (위도, 경도) 목록) → (N, 3) 배열:
+    정규화 좌표 x, y와 1미터의 정규화 길이 (중복 제거)
+
+    Web Mercator 축척은 위도마다 다르므로 reveal 반경은 각 방문 지점의 위도로 환산합니다.
+    """
+    if len(points) == 0:
+        return np.empty((0, 3), dtype=np.float64)
+    latlon = np.unique(np.asarray(points, dtype=np.float64).reshape(-1, 2), axis=0)
+    wx, wy = lonlat_to_world(latlon[:, 1], latlon[:, 0])
+    per_meter = 1.0 / (EARTH_CIRCUMFERENCE_M * np.cos(np.radians(latlon[:, 0])))
+    return np.column_stack([wx, wy, per_meter])
+
+
+def _block_points(world_points, zoom, x0, y0, size_px, radius_m):
+    """블록(좌상단 타일 x0, y0) 픽셀 좌표로 옮긴 방문 지점 중 반경이 블록에 닿는 것만
+
+    반환값: (px, py, 지점별 반경 픽셀 수) float32 배열
+    """
+    scale = TILE_SIZE * (1 << zoom)
+    px = world_points[:, 0] * scale - x0 * TILE_SIZE
+    py = world_points[:, 1] * scale - y0 * TILE_SIZE
+    radius_px = world_points[:, 2] * (radius_m * scale)
+    near = ((px > -radius_px) & (px < size_px + radius_px) &
+            (py > -radius_px) & (py < size_px + radius_px))
+    return (px[near].astype(np.float32), py[near].astype(np.float32),
+            radius_px[near].astype(np.float32))
+
+
+def edge_field(px, py, radius_px, size_px):
+    """size_px x size_px 블록의 픽셀별 가장 가까운 reveal 원 경계까지의 거리 (픽셀)
+
+    음수면 어떤 원의 안쪽, 양수면 모든 원의 바깥쪽입니다. 방문 지점마다 반경이 닿는
+    사각 창(window)만 잘라 최솟값을 갱신합니다 (어느 창에도 속하지 않으면 inf).
+    """
+    centers = np.arange(size_px, dtype=np.float32) + 0.5
+    field = np.full((size_px, size_px), np.inf, dtype=np.float32)  # 행 = y, 열 = x
+    for cx, cy, radius in zip(px, py, radius_px):
+        reach = radius + EDGE_FEATHER_PX
+        x0, x1 = max(int(cx - reach), 0), min(int(cx + reach) + 1, size_px)
+        y0, y1 = max(int(cy - reach), 0), min(int(cy + reach) + 1, size_px)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        dx2 = (centers[x0:x1] - cx) ** 2
+        dy2 = (centers[y0:y1] - cy) ** 2
+        window = field[y0:y1, x0:x1]
+        np.minimum(window, np.sqrt(dy2[:, None] + dx2[None, :]) - radius, out=window)
+    return field
+
+
+def _tile_from_field(field, background_level):
+    """타일 한 장의 경계 거리 → PIL 팔레트 이미지, 또는 단색이면 그 fog level (int)
+
+    원 안은 투명, 경계는 EDGE_FEATHER_PX 폭으로 부드럽게 처리합니다.
+    색은 배경색 하나이므로 MASK_ALPHA_STEPS 단계 알파 팔레트로 표현합니다.
+    """
+    if field.min() >= EDGE_FEATHER_PX / 2:
+        return background_level
+    if field.max() <= -EDGE_FEATHER_PX / 2:
+        return 1
+    coverage = np.clip(field / EDGE_FEATHER_PX + 0.5, 0.0, 1.0)
+    r, g, b, a = FOG_LEVEL_COLORS[background_level]
+    steps = MASK_ALPHA_STEPS - 1
+    indices = np.ascontiguousarray(np.rint(coverage * steps).astype(np.uint8))
+    img = Image.frombuffer('P', (TILE_SIZE, TILE_SIZE), indices, 'raw', 'P', 0, 1)
+    img.putpalette((r, g, b) * MASK_ALPHA_STEPS, rawmode='RGB')
+    img.info['transparency'] = bytes(round(i * a / steps) for i in range(MASK_ALPHA_STEPS))
+    return img
+
+
+def render_mask(world_points, zoom, x, y, background_level, radius_m):
+    """마스크 타일 렌더링
+
+    반환값: PIL 이미지, 또는 단색 타일로 충분하면 그 fog level (int)
+    """
+    px, py, radius_px = _block_points(world_points, zoom, x, y, TILE_SIZE, radius_m)
+    if len(px) == 0:
+        return background_level
+
+    # 타일의 네 모서리가 모두 한 원 안이면 타일 전체가 투명
+    far_x = np.maximum(np.abs(px), np.abs(px - TILE_SIZE))
+    far_y = np.maximum(np.abs(py), np.abs(py - TILE_SIZE))
+    if np.any(far_x * far_x + far_y * far_y <= radius_px * radius_px):
+        return 1
+
+    field = edge_field(px, py, radius_px, TILE_SIZE)
+    return _tile_from_field(field, background_level)
+
+
+def render_metatile(world_points, zoom, x0, y0, size, backgrounds, radius_m):
+    """size x size 타일 블록(메타타일)을 한 번에 렌더링해 타일별로 자름
+
+    backgrounds: {(x, y): 배경 fog level}
+    반환값: {(x, y): PIL 이미지 또는 단색 fog level (int)}
+    """
+    size_px = size * TILE_SIZE
+    px, py, radius_px = _block_points(world_points, zoom, x0, y0, size_px, radius_m)
+    if len(px) == 0:
+        return dict(backgrounds)
+
+    field = edge_field(px, py, radius_px, size_px)
+    tiles = {}
+    for (x, y), background in backgrounds.items():
+        left, top = (x - x0) * TILE_SIZE, (y - y0) * TILE_SIZE
+        tiles[(x, y)] = _tile_from_field(field[top:top + TILE_SIZE, left:left + TILE_SIZE],
+                                         background)
+    return tiles
+
+
+def metatile_size_from_env():
+    """FOG_METATILE 환경변수 (메타타일 한 변의 타일 수, 1이면 타일 단위 렌더링)"""
+    try:
+        return max(1, int(os.environ.get('FOG_METATILE', DEFAULT_METATILE)))
+    except ValueError:
+        return DEFAULT_METATILE
+
+
+def mask_cache_tiles_from_env():
+    """FOG_MASK_CACHE_TILES 환경변수 (렌더링한 마스크 타일 LRU 크기)"""
+    try:
+        return max(1, int(os.environ.get('FOG_MASK_CACHE_TILES', DEFAULT_MASK_CACHE_TILES)))
+    except ValueError:
+        return DEFAULT_MASK_CACHE_TILES
+
+
+def _background_level(fog_level):
+    """방문 지점 밖은 탐색 지역이면 회색, 아니면 검은색
+
+    근처에 방문 지점이 없는 타일도 같은 배경으로 칠합니다 (level 1 타일이라도 반경 밖 부분은 회색).
+    """
+    return 2 if fog_level in (1, 2) else 3
+
+
+class FogMaskRenderer:
+    """사용자 방문 지점으로 마스크 타일 PNG를 만들고 LRU 캐시에 보관
+
+    metatile > 1이면 요청 타일이 속한 metatile x metatile 블록을 한 번에 렌더링하고
+    이웃 타일까지 캐시에 넣어, 같은 화면의 다음 타일 요청은 캐시에서 응답합니다.
+    shared(fog_prefork.SharedTileCache)를 설정하면 로컬 LRU 다음으로 워커 공유 캐시를 확인합니다.
+    """
+
+    shared = None
+
+    def __init__(self, flat_cache, radius_m=None, cache_size=None, metatile=None, points_cache_size=256):
+        self.flat_cache = flat_cache
+        self.radius_m = reveal_radius_from_env() if radius_m is None else radius_m
+        self.metatile = metatile_size_from_env() if metatile is None else max(1, metatile)
+        self.cache_size = mask_cache_tiles_from_env() if cache_size is None else cache_size
+        self.points_cache_size = points_cache_size
+        self._tiles = OrderedDict()
+        self._points = OrderedDict()  # user_id → (version_tag, (N, 3) 배열), LRU
+        self._rendering = {}  # 렌더링 중인 블록 → Lock (같은 블록 중복 렌더링 방지)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def world_points(self, index):
+        """인덱스의 방문 지점 배열 (방문 버전이 바뀔 때만 다시 계산)"""
+        version = index.version_tag
+        with self._lock:
+            cached = self._points.get(index.user_id)
+            if cached is not None and cached[0] == version:
+                self._points.move_to_end(index.user_id)
+                return cached[1]
+        points = points_to_world(index.visit_points())
+        with self._lock:
+            self._points[index.user_id] = (version, points)
+            self._points.move_to_end(index.user_id)
+            while len(self._points) > self.points_cache_size:
+                self._points.popitem(last=False)
+        return points
+
+    def cached_png(self, index, zoom, x, y, fmt='png'):
+        """이미 렌더링한 마스크 타일 바이트 (없으면 None, 렌더링하지 않음)"""
+        return self._cached((index.user_id, index.version_tag, zoom, x, y, fmt))
+
+    def tile_png(self, index, zoom, x, y, fog_level, fmt='png'):
+        """마스크 타일 바이트 (근처 방문 지점이 없으면 단색 타일 캐시 사용)
+
+        fmt: 출력 형식 ('png' 또는 'webp', flat_cache.encoder.negotiate 결과)
+        """
+        key = (index.user_id, index.version_tag, zoom, x, y, fmt)
+        data = self._cached(key)
+        if data is not None:
+            return data
+        self.misses += 1
+        if self.metatile > 1:
+            return self._metatile_png(index, zoom, x, y, fmt, key)
+
+        world = self.world_points(index)
+        if len(world) == 0:
+            # 위치가 아직 없음 (스냅샷 파일 데이터): 피라미드 fog level 단색 타일
+            return self.flat_cache.get(fog_level, fmt)
+        result = render_mask(world, zoom, x, y, _background_level(fog_level), self.radius_m)
+        if isinstance(result, int):
+            data = self.flat_cache.get(result, fmt)
+        else:
+            data = self.flat_cache.encoder.encode(result, fmt)
+        self._store({key: data})
+        return data
+
+    def _metatile_png(self, index, zoom, x, y, fmt, key):
+        """요청 타일이 속한 블록 전체를 렌더링해 캐시에 넣고 요청 타일 반환 (같은 형식으로)"""
+        size = min(self.metatile, 1 << zoom)
+        x0, y0 = x - x % size, y - y % size
+        block_key = key[:3] + (x0, y0, fmt)
+        with self._lock:
+            block_lock = self._rendering.setdefault(block_key, threading.Lock())
+        try:
+            with block_lock:
+                # 다른 요청이 같은 블록을 방금 렌더링했으면 캐시에 있음
+                with self._lock:
+                    data = self._tiles.get(key)
+                if data is not None:
+                    return data
+
+                levels = {(bx, by): index.fog_level(zoom, bx, by)
+                          for by in range(y0, y0 + size) for bx in range(x0, x0 + size)}
+                world = self.world_points(index)
+                if len(world) == 0:
+                    results = levels
+                else:
+                    backgrounds = {tile: _background_level(level) for tile, level in levels.items()}
+                    results = render_metatile(world, zoom, x0, y0, size, backgrounds, self.radius_m)
+                encoded = {}
+                for (bx, by), result in results.items():
+                    if isinstance(result, int):
+                        data = self.flat_cache.get(result, fmt)
+                    else:
+                        data = self.flat_cache.encoder.encode(result, fmt)
+                    encoded[key[:3] + (bx, by, fmt)] = data
+                self._store(encoded)
+                return encoded[key]
+        finally:
+            with self._lock:
+                self._rendering.pop(block_key, None)
+
+    def _cached(self, key):
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return data
+        if self.shared is not None:
+            # 다른 워커가 렌더링한 타일 (방문 버전이 내용 해시라 워커 간 키가 같음)
+            data = self.shared.get(key)
+            if data is not None:
+                self._store({key: data}, share=False)
+                self.hits += 1
+        return data
+
+    def _store(self, tiles, share=True):
+        if share and self.shared is not None:
+            for key, data in tiles.items():
+                self.shared.put(key, data)
+        with self._lock:
+            self._tiles.update(tiles)
+            for key in tiles:
+                self._tiles.move_to_end(key)
+            while len(self._tiles) > self.cache_size:
+                self._tiles.popitem(last=False)
+
+
+def _benchmark(tile_count, metatile=8):
+    """렌더링 함수만 비교: 단색 타일 캐시(RenderedTileCache.get) 대비 FogMaskRenderer.tile_png
+
+    기본 reveal 반경(DEFAULT_REVEAL_RADIUS_M)으로 타일 단위/메타타일 렌더러를 각각 처음(cold)과
+    두 번째(캐시 적중) 요청 처리량으로 잽니다. HTTP 처리와 조회 비용이 빠져 있어 비율은 실제 서버보다
+    훨씬 크게 나옵니다 (서버 요청 단위 비율은 fog_bench.py render).
+    """
+    from fog_index import UserVisitIndex, tile_key
+    rng = np.random.default_rng(42)
+    zoom = 15
+    # 서울 시청 주변 방문 지점 200개 → 방문 문서 (지점이 들어 있는 타일, level 1)
+    lat0, lon0 = 37.5665, 126.9780
+    docs = []
+    for lat, lon in zip(lat0 + rng.normal(0, 0.01, 200), lon0 + rng.normal(0, 0.01, 200)):
+        wx, wy = lonlat_to_world(lon, lat)
+        docs.append((tile_key(zoom, int(wx * (1 << zoom)), int(wy * (1 << zoom))),
+                     {'fogLevel': 1, 'location': {'latitude': lat, 'longitude': lon}}))
+    index = UserVisitIndex.from_documents('bench', docs)
+    wx, wy = lonlat_to_world(lon0, lat0)
+    cx, cy = int(wx * (1 << zoom)), int(wy * (1 << zoom))
+    tiles = [(cx + int(dx), cy + int(dy))
+             for dx, dy in rng.integers(-3, 4, size=(tile_count, 2))]
+    levels = {tile: index.fog_level(zoom, *tile) for tile in set(tiles)}
+
+    flat_cache = RenderedTileCache(render_fog_level)
+    flat_cache.warm((1, 2, 3))
+    start = time.perf_counter()
+    for tile in tiles:
+        flat_cache.get(levels[tile])
+    flat_elapsed = time.perf_counter() - start
+
+    print(f"📊 타일 요청 {tile_count}개 (서로 다른 타일 {len(levels)}개, 방문 지점 {len(docs)}개, "
+          f"반경 {DEFAULT_REVEAL_RADIUS_M:.0f}m)")
+    print(f"  - 단색 타일 캐시 (TILE_CACHE.get): {tile_count / flat_elapsed:10.1f} tiles/s "
+          f"({flat_elapsed / tile_count * 1e6:.2f}µs/tile)")
+    for size in (1, metatile):
+        renderer = FogMaskRenderer(flat_cache, radius_m=DEFAULT_REVEAL_RADIUS_M,
+                                   cache_size=len(levels) * 4, metatile=size)
+        for label in ('처음', '캐시'):
+            start = time.perf_counter()
+            for x, y in tiles:
+                renderer.tile_png(index, zoom, x, y, levels[(x, y)])
+            elapsed = time.perf_counter() - start
+            print(f"  - 마스크 {size}x{size} ({label}):          {tile_count / elapsed:10.1f} tiles/s "
+                  f"({elapsed / tile_count * 1e6:.2f}µs/tile)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+                   int(sys.argv[3]) if len(sys.argv) > 3 else 8)
+    else:
+        print("Usage: python fog_mask.py bench [타일 수] [메타타일 크기]")
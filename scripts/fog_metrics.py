@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Prometheus /metrics 노출 + 샘플링 구조화 로그
+
+타일 요청마다 print로 콘솔에 쓰는 대신 메트릭을 메모리에 집계하고,
+/metrics 요청 시 Prometheus 텍스트 형식(0.0.4)으로 내보냅니다 (외부 패키지 없음).
+
+- fog_http_requests_total{route, status}           요청 수
+- fog_http_request_duration_seconds{route}         요청 전체 지연 히스토그램
+- fog_stage_duration_seconds{stage}                단계별 지연 (route, firestore, render, encode, write)
+- fog_http_in_flight_requests                      처리 중인 요청 수
+- fog_tile_cache_{hits,misses}_total{cache}        타일 캐시 적중/미스 (적중률은 PromQL에서 계산)
+- fog_store_lookups_total{result}                  비동기 저장소 조회 (executed / merged)
+- fog_firestore_batch{es,_documents}_total         타일 조회를 묶은 get_all 호출 수 / 문서 수
+- fog_negative_cache_lookups_total{result}         미방문 Bloom 필터 확인 (unvisited / unknown)
+- fog_shed_requests_total{reason}                  과부하로 거절한 요청 (user / global / backend)
+- fog_store_guard_total{result}                    저장소 조회 기한 초과/오류, stale 응답 (fog_shed.py)
+- fog_group_lookups_total{result}                  그룹 합성 인덱스 캐시 재사용 / 새로 합성 (fog_group.py)
+
+요청 로그는 FOG_LOG_SAMPLE 비율(기본 0.01)만 JSON 한 줄로 남기고,
+5xx 응답과 오류는 항상 남깁니다.
+
+/debug/profile?seconds=N 은 관리자 전용 샘플링 프로파일러입니다 (fog_profile.py).
+
+사용 예:
+    with stage_timer('firestore'):
+        doc = doc_ref.get()
+    body = REGISTRY.render()
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+from fog_profile import (
+    PROFILE_PATH, THREAD_STAGES, admin_authorized, request_finished, request_started,
+    run_profile_request,
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGES = ('route', 'firestore', 'render', 'encode', 'write')
+
+# 초 단위 지연 버킷 (타일 캐시 적중 ~수십 µs부터 Firestore 타임아웃 수 초까지)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+DEFAULT_LOG_SAMPLE = 0.01
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """단조 증가 카운터 (라벨 값 튜플별)"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, labels, value) for labels, value in sorted(items)]
+
+
+class Gauge(Counter):
+    """현재 값 게이지 (증가/감소/설정)"""
+
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    """누적 버킷 히스토그램 (라벨 값 튜플별)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels → [버킷별 개수..., 합계, 개수]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        result = []
+        names = self.labelnames + ('le',)
+        for labels, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                result.append((f'{self.name}_bucket', labels + (_format_value(float(bound)),),
+                               cumulative, names))
+            result.append((f'{self.name}_bucket', labels + ('+Inf',), series[-1], names))
+            result.append((f'{self.name}_sum', labels, series[-2], None))
+            result.append((f'{self.name}_count', labels, series[-1], None))
+        return result
+
+
+class MetricsRegistry:
+    """메트릭 목록 + 스크레이프 시점에 값을 읽는 collector 함수"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """collect() → [(이름, 종류, 설명, 라벨 이름, [(라벨 값 튜플, 값), ...]), ...]"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """Prometheus 텍스트 형식으로 전체 메트릭 출력"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample in metric.samples():
+                name, labels, value = sample[:3]
+                labelnames = sample[3] if len(sample) > 3 and sample[3] else metric.labelnames
+                lines.append(f'{name}{_format_labels(labelnames, labels)} {_format_value(value)}')
+
+        families = {}
+        for collect in collectors:
+            try:
+                for name, kind, help_text, labelnames, values in collect():
+                    family = families.setdefault(name, (kind, help_text, labelnames, []))
+                    family[3].extend(values)
+            except Exception:
+                continue
+        for name, (kind, help_text, labelnames, values) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in values:
+                lines.append(f'{name}{_format_labels(labelnames, labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter(
+    'fog_http_requests_total', '경로/상태 코드별 HTTP 요청 수', ('route', 'status'))
+REQUEST_LATENCY = REGISTRY.histogram(
+    'fog_http_request_duration_seconds', '경로별 HTTP 요청 처리 시간(초)', ('route',))
+STAGE_LATENCY = REGISTRY.histogram(
+    'fog_stage_duration_seconds', '요청 처리 단계별 소요 시간(초)', ('stage',))
+IN_FLIGHT = REGISTRY.gauge(
+    'fog_http_in_flight_requests', '처리 중인 HTTP 요청 수')
+
+
+class _StageTimer:
+    """단계 지연 측정 + 스레드의 현재 단계 기록 (프로파일러 샘플 분류용)"""
+
+    __slots__ = ('stage', 'started', 'previous')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        ident = threading.get_ident()
+        self.previous = THREAD_STAGES.get(ident)
+        THREAD_STAGES[ident] = self.stage
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        STAGE_LATENCY.observe(time.perf_counter() - self.started, self.stage)
+        ident = threading.get_ident()
+        if self.previous is None:
+            THREAD_STAGES.pop(ident, None)
+        else:
+            THREAD_STAGES[ident] = self.previous
+
+
+def stage_timer(stage):
+    """단계별 지연 측정 컨텍스트 매니저 (STAGES 중 하나)"""
+    return _StageTimer(stage)
+
+
+def register_tile_cache(name, cache):
+    """hits/misses 속성이 있는 타일 캐시를 cache 라벨로 등록"""
+    def collect():
+        return [
+            ('fog_tile_cache_hits_total', 'counter', '타일 캐시 적중 수', ('cache',),
+             [((name,), cache.hits)]),
+            ('fog_tile_cache_misses_total', 'counter', '타일 캐시 미스 수', ('cache',),
+             [((name,), cache.misses)]),
+        ]
+    REGISTRY.add_collector(collect)
+
+
+def register_visit_index(registry):
+    """방문 인덱스 사용자/타일 수 게이지 등록"""
+    def collect():
+        stats = registry.stats()
+        return [
+            ('fog_visit_index_users', 'gauge', '메모리 인덱스에 올라온 사용자 수', (),
+             [((), stats['users'])]),
+            ('fog_visit_index_tiles', 'gauge', '메모리 인덱스의 방문 타일 수', (),
+             [((), stats['tiles'])]),
+        ]
+    REGISTRY.add_collector(collect)
+
+
+def register_lookup_stats(store):
+    """FirestoreFogStore 비동기 조회 합치기(singleflight)/get_all 묶음 카운터 등록"""
+    def collect():
+        stats = store.lookup_stats()
+        metrics = [
+            ('fog_store_lookups_total', 'counter', '저장소 비동기 조회 수 (merged: 진행 중인 조회에 합쳐짐)',
+             ('result',), [(('executed',), stats['executed']), (('merged',), stats['merged'])]),
+        ]
+        if 'batches' in stats:
+            metrics.append(('fog_firestore_batches_total', 'counter', '타일 조회를 묶은 get_all 호출 수', (),
+                            [((), stats['batches'])]))
+            metrics.append(('fog_firestore_batch_documents_total', 'counter',
+                            '묶음 get_all로 읽은 문서 수', (), [((), stats['documents'])]))
+        if 'negative' in stats:
+            negative = stats['negative']
+            metrics.append(('fog_negative_cache_lookups_total', 'counter',
+                            '미방문 Bloom 필터 확인 수 (unvisited: 조회 생략, unknown: 문서 조회)', ('result',),
+                            [(('unvisited',), negative['hits']), (('unknown',), negative['misses'])]))
+            metrics.append(('fog_negative_cache_bytes', 'gauge', '사용자별 Bloom 필터 메모리', (),
+                            [((), negative['bytes'])]))
+        return metrics
+    REGISTRY.add_collector(collect)
+
+
+def register_prefetcher(prefetcher):
+    """주변 타일 미리 읽기(fog_prefetch.py) 적중/큐 통계 등록"""
+    def collect():
+        stats = prefetcher.stats()
+        return [
+            ('fog_prefetch_lookups_total', 'counter', '타일 요청이 미리 읽은 level을 사용했는지', ('result',),
+             [(('hit',), stats['hits']), (('miss',), stats['misses'])]),
+            ('fog_prefetch_jobs_total', 'counter', '미리 읽기 작업 수', ('result',),
+             [(('loaded',), stats['loaded']), (('dropped',), stats['dropped']),
+              (('error',), stats['errors'])]),
+            ('fog_prefetch_queue', 'gauge', '대기 중인 미리 읽기 작업 수', (), [((), stats['queued'])]),
+        ]
+    REGISTRY.add_collector(collect)
+
+
+def register_shedding(admission, guard=None):
+    """과부하 보호(fog_shed.py) 거절/기한 초과/stale 응답 통계 등록 (admission=None: 동시 요청 한도 없음)"""
+    def collect():
+        rejected = []
+        metrics = []
+        if admission is not None:
+            stats = admission.stats()
+            rejected = [((reason,), count) for reason, count in stats['rejected'].items()]
+            metrics.append(('fog_admission_in_flight', 'gauge', '동시 처리 한도에 포함된 요청 수', (),
+                            [((), stats['inFlight'])]))
+        if guard is not None:
+            guard_stats = guard.stats()
+            rejected.append((('backend',), guard_stats['unavailable']))
+            metrics.append(('fog_store_guard_total', 'counter',
+                            '저장소 조회 결과 (timeout/error: 실패, stale: 마지막 값으로 응답)', ('result',),
+                            [(('timeout',), guard_stats['timeouts']), (('error',), guard_stats['errors']),
+                             (('stale',), guard_stats['stale'])]))
+            metrics.append(('fog_store_circuit_open', 'gauge', '연속 실패로 저장소 호출을 멈춘 상태(1)', (),
+                            [((), int(guard_stats['circuitOpen']))]))
+        metrics.append(('fog_shed_requests_total', 'counter', '과부하로 바로 거절한 요청 수 (429/503)',
+                        ('reason',), rejected))
+        return metrics
+    REGISTRY.add_collector(collect)
+
+
+def register_groups(composer):
+    """그룹 합성 인덱스(fog_group.py) 캐시 통계 등록"""
+    def collect():
+        stats = composer.stats()
+        return [
+            ('fog_group_composites', 'gauge', '캐시된 그룹 합성 인덱스 수', (), [((), stats['groups'])]),
+            ('fog_group_lookups_total', 'counter', '그룹 합성 인덱스 조회 (hit: 캐시 재사용, build: 새로 합성)',
+             ('result',), [(('hit',), stats['hits']), (('build',), stats['builds'])]),
+            ('fog_group_build_seconds_total', 'counter', '그룹 합성에 쓴 시간', (),
+             [((), stats['buildSeconds'])]),
+        ]
+    REGISTRY.add_collector(collect)
+
+
+def log_sample_rate_from_env():
+    """FOG_LOG_SAMPLE 환경변수 (0.0~1.0)"""
+    try:
+        return min(1.0, max(0.0, float(os.environ.get('FOG_LOG_SAMPLE', DEFAULT_LOG_SAMPLE))))
+    except ValueError:
+        return DEFAULT_LOG_SAMPLE
+
+
+class RequestLog:
+    """요청 로그를 일부만 JSON 한 줄로 남기는 로거 (오류/5xx는 항상 기록)"""
+
+    def __init__(self, name='fog', sample_rate=None):
+        self.sample_rate = log_sample_rate_from_env() if sample_rate is None else sample_rate
+        self.logger = logging.getLogger(name)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+
+    def _emit(self, level, event, fields):
+        record = {"ts": round(time.time(), 3), "event": event}
+        record.update(fields)
+        self.logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+    def request(self, route, status, duration, **fields):
+        """요청 완료 로그 (샘플링)"""
+        if status < 500 and random.random() >= self.sample_rate:
+            return
+        fields.update(route=route, status=status, ms=round(duration * 1000, 3))
+        self._emit(logging.ERROR if status >= 500 else logging.INFO, 'request', fields)
+
+    def event(self, event, **fields):
+        """요청 경로의 부가 정보 (샘플링)"""
+        if random.random() < self.sample_rate:
+            self._emit(logging.INFO, event, fields)
+
+    def error(self, event, **fields):
+        """오류 로그 (항상 기록)"""
+        self._emit(logging.ERROR, event, fields)
+
+
+REQUEST_LOG = RequestLog()
+
+
+class InstrumentedHandlerMixin:
+    """BaseHTTPRequestHandler 용 계측 mixin
+
+    do_GET은 /metrics, /debug/profile을 직접 처리하고 나머지는 handle_get()으로, do_POST는 handle_post()로 넘깁니다.
+    handle_get()/handle_post()에서 self.metrics_route를 설정하면 그 값이 route 라벨이 됩니다.
+    """
+
+    metrics_route = 'not_found'
+    metrics_status = 0
+    log_fields = None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            self._instrumented(self.send_metrics, 'metrics')
+        elif path == PROFILE_PATH:
+            self._instrumented(self.send_profile, 'profile')
+        else:
+            self._instrumented(self.handle_get)
+
+    def do_POST(self):
+        self._instrumented(self.handle_post)
+
+    def handle_post(self):
+        self.send_error(405, "Method not allowed")
+
+    def _instrumented(self, handler, route='not_found'):
+        started = time.perf_counter()
+        self.metrics_route = route
+        self.log_fields = {}
+        IN_FLIGHT.inc()
+        request_started(self, sys._getframe())
+        try:
+            handler()
+        finally:
+            request_finished()
+            IN_FLIGHT.dec()
+            duration = time.perf_counter() - started
+            status = self.metrics_status
+            REQUESTS.inc(self.metrics_route, str(status))
+            REQUEST_LATENCY.observe(duration, self.metrics_route)
+            REQUEST_LOG.request(self.metrics_route, status, duration, **self.log_fields)
+
+    def send_response(self, code, message=None):
+        self.metrics_status = code
+        super().send_response(code, message)
+
+    def send_metrics(self):
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_profile(self):
+        """/debug/profile?seconds=N: 그동안 처리한 요청의 샘플링 프로파일 (관리자 전용)"""
+        if not admin_authorized(self.headers.get('Authorization'), self.client_address[0]):
+            self.send_error(403, "Forbidden")
+            return
+        status, body, detail = run_profile_request(self, parse_qs(urlparse(self.path).query))
+        if body is None:
+            self.send_error(status, "Profile unavailable", detail)
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', detail)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_body(self, body):
+        """응답 본문 전송 (write 단계 측정)"""
+        with stage_timer('write'):
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """기본 접근 로그(stderr, 요청마다)는 끄고 REQUEST_LOG 샘플링 로그로 대신함"""
+        pass
+
+    def log_error(self, format, *args):
+        """send_error 로그 (5xx는 요청 로그에 항상 남으므로 여기서는 샘플링)"""
+        REQUEST_LOG.event('http_error', client=self.address_string(), message=format % args)
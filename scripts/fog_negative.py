@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+사용자별 방문 타일 Bloom 필터 (미방문 타일 부정 캐시)
+
+사용자가 요청하는 타일은 대부분 방문한 적이 없는 타일인데, 문서 조회로는
+doc.exists == False(→ fog level 3)를 확인하는 데도 Firestore 읽기가 한 번 듭니다.
+visited 서브컬렉션의 문서 ID로 Bloom 필터를 만들어 두면 "확실히 방문하지 않음"인 타일은
+I/O 없이 검은 타일로 응답할 수 있습니다 (오탐은 문서 조회로 확인).
+
+- 처음 쓰는 사용자는 백그라운드 스레드에서 문서 ID만(select([])) 읽어 필터를 만들고,
+  만들어지기 전까지는 기존처럼 문서를 조회합니다
+- 서버를 거치는 쓰기(FogStore.put_many)는 필터에 바로 추가하고, prefork 워커끼리는
+  fork 전에 만든 공유 쓰기 기록(fog_prefork.SharedWriteLog, shared 속성)으로 다른 워커 필터에도 추가
+- 서버를 거치지 않은 쓰기(Cloud Functions, 마이그레이션, 앱 직접 쓰기 등)는 알 수 없으므로
+  필터를 FOG_NEGATIVE_TTL(기본 60초)까지만 믿고, 지나면 문서 ID 전체를 다시 읽어 새로 만듭니다
+  (다시 만드는 동안에는 문서를 조회). 즉 서버 밖에서 쓴 방문은 최대 TTL 동안 미방문으로 보일 수 있습니다.
+  문서 ID만 읽는 비용은 문서당 읽기 1회로, 갱신 시각 필드로 증분 조회하는 것과 거의 같으면서
+  쓰는 쪽이 그 필드를 채운다는 약속에 기대지 않습니다.
+
+설정 (환경변수):
+    FOG_NEGATIVE_CACHE     0이면 사용 안 함 (기본 1)
+    FOG_NEGATIVE_TTL       필터를 믿는 시간 (초, 기본 60)
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TTL = 60.0
+
+# 필터 크기를 정할 때 현재 문서 수보다 여유를 둠 (이후 방문 추가분)
+CAPACITY_HEADROOM = 2.0
+
+
+def negative_cache_enabled_from_env():
+    return os.environ.get('FOG_NEGATIVE_CACHE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def negative_ttl_from_env():
+    try:
+        return max(0.0, float(os.environ.get('FOG_NEGATIVE_TTL', DEFAULT_TTL)))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+class TileBloomFilter:
+    """타일 ID Bloom 필터 (비트 배열 + blake2b 이중 해싱)
+
+    capacity개를 넣었을 때 오탐률이 error_rate가 되도록 비트 수와 해시 수를 정합니다.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(64, int(capacity))
+        # m = -n ln p / (ln 2)^2, k = m/n ln 2
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2)) + 1
+        self.bits = (bits + 7) // 8 * 8
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._array = bytearray(self.bits // 8)
+
+    def _positions(self, tile_id):
+        digest = hashlib.blake2b(tile_id.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, tile_id):
+        for position in self._positions(tile_id):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, tile_id):
+        array = self._array
+        return all(array[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(tile_id))
+
+    @property
+    def saturated(self):
+        """설계 용량을 넘어 오탐률이 커졌는지"""
+        return self.count > self.capacity
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self._array)
+
+
+class _UserFilter:
+    def __init__(self, bloom):
+        self.bloom = bloom
+        self.refreshed = time.monotonic()
+        self.loading = False
+        self.pending = []              # 로딩 중에 들어온 쓰기 (로딩이 끝나면 추가)
+
+
+class NegativeTileCache:
+    """사용자별 TileBloomFilter (최근 사용 순으로 max_users명까지 유지)"""
+
+    def __init__(self, db, ttl=None, max_users=10000, error_rate=0.01, loaders=2):
+        self.db = db
+        self.ttl = negative_ttl_from_env() if ttl is None else ttl
+        self.max_users = max_users
+        self.error_rate = error_rate
+        self._filters = OrderedDict()  # user_id → _UserFilter (로딩 중이면 bloom=None)
+        self._lock = threading.Lock()
+        self.shared = None             # prefork 워커 공유 쓰기 기록 (fog_prefork.SharedWriteLog)
+        self._shared_seq = None        # 공유 쓰기 기록에서 다음에 읽을 순번
+        self._executor = ThreadPoolExecutor(max_workers=loaders, thread_name_prefix='fog-negative')
+        self.hits = 0     # I/O 없이 "미방문"으로 응답한 조회 수
+        self.misses = 0   # 필터가 없거나 "방문했을 수도 있음"이라 문서를 조회한 수
+
+    def _visited(self, user_id):
+        return self.db.collection('visits_tiles').document(user_id).collection('visited')
+
+    def _filter(self, user_id):
+        """사용할 수 있는 필터 (없거나 TTL이 지났으면 백그라운드 로딩을 걸고 None)"""
+        now = time.monotonic()
+        with self._lock:
+            if self.shared is not None:
+                self._sync_shared()
+            entry = self._filters.get(user_id)
+            if entry is None:
+                entry = self._filters[user_id] = _UserFilter(None)
+                entry.loading = True
+                self._evict()
+                self._executor.submit(self._load, user_id, entry)
+                return None
+            self._filters.move_to_end(user_id)
+            if entry.bloom is None:
+                return None
+            if now - entry.refreshed <= self.ttl:
+                return entry.bloom
+            if not entry.loading:
+                entry.loading = True
+                self._executor.submit(self._load, user_id, entry)
+            return None
+
+    def _sync_shared(self):
+        """다른 워커가 쓴 타일을 필터에 추가 (공유 기록을 놓쳤으면 모든 필터를 TTL 만료로 처리)"""
+        if self._shared_seq is None:
+            self._shared_seq = self.shared.sequence()
+            return
+        self._shared_seq, writes = self.shared.read(self._shared_seq)
+        if writes is None:
+            for entry in self._filters.values():
+                entry.refreshed = float('-inf')
+            return
+        for user_id, tile_id in writes:
+            entry = self._filters.get(user_id)
+            if entry is None:
+                continue
+            if tile_id is None:
+                entry.refreshed = float('-inf')  # 기록에 담지 못한 긴 ID
+                continue
+            if entry.loading:
+                entry.pending.append(tile_id)
+            if entry.bloom is not None:
+                entry.bloom.add(tile_id)
+
+    def _evict(self):
+        while len(self._filters) > self.max_users:
+            self._filters.popitem(last=False)
+
+    def _load(self, user_id, entry):
+        """visited 문서 ID 전체로 필터를 새로 만듦 (로딩 중에 들어온 쓰기도 추가)"""
+        try:
+            docs = list(self._visited(user_id).select([]).stream())
+            bloom = TileBloomFilter(len(docs) * CAPACITY_HEADROOM, self.error_rate)
+            for doc in docs:
+                bloom.add(doc.id)
+        except Exception:
+            with self._lock:
+                entry.loading = False
+                entry.pending = []
+                if entry.bloom is None:
+                    self._filters.pop(user_id, None)  # 다음 요청 때 다시 시도
+            return
+        with self._lock:
+            for tile_id in entry.pending:
+                bloom.add(tile_id)
+            entry.pending = []
+            entry.bloom = bloom
+            entry.refreshed = time.monotonic()
+            entry.loading = False
+
+    def definitely_unvisited(self, user_id, tile_id):
+        """True면 문서가 없음이 확실 (False는 "모름" → 문서 조회 필요)"""
+        bloom = self._filter(user_id)
+        if bloom is not None and tile_id not in bloom:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, user_id, tile_ids):
+        """서버를 거친 쓰기 반영 (필터가 있거나 로딩 중인 사용자만, 공유 기록이 있으면 다른 워커에도)"""
+        tile_ids = list(tile_ids)
+        if self.shared is not None:
+            self.shared.append(user_id, tile_ids)
+        with self._lock:
+            entry = self._filters.get(user_id)
+            if entry is None:
+                return
+            if entry.loading:
+                entry.pending.extend(tile_ids)  # 새로 만드는 필터에도 들어가도록
+            if entry.bloom is not None:
+                for tile_id in tile_ids:
+                    entry.bloom.add(tile_id)
+
+    def stats(self):
+        with self._lock:
+            blooms = [entry.bloom for entry in self._filters.values() if entry.bloom is not None]
+        return {"users": len(blooms), "tiles": sum(len(bloom) for bloom in blooms),
+                "bytes": sum(bloom.nbytes for bloom in blooms),
+                "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+주변 타일 미리 읽기 (predictive prefetch)
+
+타일 요청은 요청받은 타일만 조회/렌더링하므로, 화면을 옮기거나 확대할 때마다
+새로 보이는 타일은 Firestore 조회와 렌더링 지연을 처음부터 겪습니다.
+타일 (z, x, y)를 응답한 뒤 주변 8개 타일과 z+1의 자식 타일 4개를 백그라운드 스레드에서
+미리 읽어 두면(마스크 모드면 마스크 타일 렌더링까지) 다음 요청은 캐시에서 응답합니다.
+
+- 작업 큐는 max_queue개로 제한 (가득 차면 가장 오래된 작업을 버림 → dropped)
+  최근 요청 주변이 다음 요청일 가능성이 높으므로 나중에 들어온 작업부터 처리
+- 처리 중인 요청(fog_http_in_flight)이 있으면 끝날 때까지 기다렸다가 실행 (요청 처리 우선)
+- 미리 읽은 level은 방문 버전(인덱스가 있을 때)이 바뀌거나, 저장소에서 읽은 경우 ttl이 지나면 무효
+- hits/misses: 타일 요청이 미리 읽어 둔 level을 사용했는지 (/metrics)
+
+설정 (환경변수):
+    FOG_PREFETCH          0이면 사용 안 함 (기본 1)
+    FOG_PREFETCH_QUEUE    대기 작업 최대 수 (기본 512)
+    FOG_PREFETCH_TTL      저장소에서 읽은 level을 믿는 시간 (초, 기본 30)
+
+사용 예:
+    prefetcher = TilePrefetcher(load)   # load(user_id, z, x, y, fmt) → (fog level, 방문 버전 또는 None)
+    level = prefetcher.lookup(user_id, z, x, y, version)   # 없으면 None
+    prefetcher.schedule(user_id, z, x, y, fmt, version)     # 응답 후 주변 타일 예약
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from fog_metrics import IN_FLIGHT
+
+DEFAULT_MAX_QUEUE = 512
+DEFAULT_TTL = 30.0
+
+# 자식 타일을 미리 읽는 최대 줌 (앱 지도 최대 줌)
+MAX_PREFETCH_ZOOM = 18
+
+# 처리 중인 요청이 있을 때 다시 확인하기까지 기다리는 시간(초)
+IDLE_WAIT = 0.005
+
+
+def prefetch_enabled_from_env():
+    return os.environ.get('FOG_PREFETCH', '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def _env_number(name, default, cast=float):
+    try:
+        return max(0, cast(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def prefetch_targets(zoom, x, y, max_zoom=MAX_PREFETCH_ZOOM):
+    """주변 8개 타일 + z+1 자식 타일 4개 (지도 범위 밖 제외)"""
+    n = 1 << zoom
+    targets = [(zoom, x + dx, y + dy)
+               for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+               if (dx or dy) and 0 <= x + dx < n and 0 <= y + dy < n]
+    if zoom < max_zoom:
+        targets.extend((zoom + 1, 2 * x + cx, 2 * y + cy) for cy in (0, 1) for cx in (0, 1))
+    return targets
+
+
+def live_requests():
+    """처리 중인 HTTP 요청이 있는지 (두 서버 모두 IN_FLIGHT 게이지를 올림)"""
+    return IN_FLIGHT.value() > 0
+
+
+class TilePrefetcher:
+    """주변 타일 fog level을 백그라운드 스레드에서 미리 읽어 두는 캐시
+
+    load(user_id, zoom, x, y, fmt) → (fog level, 방문 버전 또는 None)은 작업 스레드에서 호출되며,
+    마스크 모드면 렌더러 캐시도 함께 채웁니다.
+    """
+
+    def __init__(self, load, max_queue=None, ttl=None, cache_size=8192, busy=live_requests):
+        self.load = load
+        self.max_queue = (_env_number('FOG_PREFETCH_QUEUE', DEFAULT_MAX_QUEUE, int)
+                          if max_queue is None else max_queue)
+        self.ttl = _env_number('FOG_PREFETCH_TTL', DEFAULT_TTL) if ttl is None else ttl
+        self.cache_size = cache_size
+        self.busy = busy
+        self._levels = OrderedDict()  # (user_id, z, x, y) → (level, 방문 버전, 만료 시각)
+        self._queue = deque()         # (user_id, z, x, y, fmt)
+        self._queued = set()          # 큐에 있는 (user_id, z, x, y)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.hits = 0        # 미리 읽어 둔 level로 응답한 타일 요청 수
+        self.misses = 0      # 미리 읽어 둔 level이 없어 직접 조회한 수
+        self.scheduled = 0   # 큐에 넣은 작업 수
+        self.dropped = 0     # 큐가 가득 차서 버린 작업 수
+        self.loaded = 0      # 미리 읽기를 마친 타일 수
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name='fog-prefetch', daemon=True)
+        self._thread.start()
+
+    def _valid(self, entry, version, now):
+        if entry is None:
+            return False
+        if version is not None:
+            return entry[1] == version
+        return entry[1] is None and now < entry[2]
+
+    def lookup(self, user_id, zoom, x, y, version=None):
+        """미리 읽어 둔 fog level (없거나 방문 버전/ttl이 맞지 않으면 None)"""
+        key = (user_id, zoom, x, y)
+        with self._cond:
+            entry = self._levels.get(key)
+            if self._valid(entry, version, time.monotonic()):
+                self._levels.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def schedule(self, user_id, zoom, x, y, fmt='png', version=None):
+        """(z, x, y)의 주변/자식 타일 중 캐시에 없는 것을 작업 큐에 넣음"""
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return
+            for target in prefetch_targets(zoom, x, y):
+                key = (user_id,) + target
+                if key in self._queued or self._valid(self._levels.get(key), version, now):
+                    continue
+                if len(self._queue) >= self.max_queue:
+                    oldest = self._queue.popleft()
+                    self._queued.discard(oldest[:4])
+                    self.dropped += 1
+                self._queue.append(key + (fmt,))
+                self._queued.add(key)
+                self.scheduled += 1
+            self._cond.notify()
+
+    def invalidate(self, user_id):
+        """사용자의 미리 읽은 level 삭제 (서버를 거친 방문 기록 쓰기 후)"""
+        with self._cond:
+            for key in [key for key in self._levels if key[0] == user_id]:
+                del self._levels[key]
+
+    def _next(self):
+        """다음 작업 (처리 중인 요청이 없을 때까지 대기, 종료되면 None)"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+        while self.busy():
+            time.sleep(IDLE_WAIT)
+            if self._closed:
+                return None
+        with self._cond:
+            if not self._queue:
+                return False
+            job = self._queue.pop()  # 가장 최근 요청 주변부터
+            self._queued.discard(job[:4])
+            return job
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            if job is False:
+                continue
+            user_id, zoom, x, y, fmt = job
+            try:
+                level, version = self.load(user_id, zoom, x, y, fmt)
+            except Exception:
+                self.errors += 1
+                continue
+            with self._cond:
+                self._levels[(user_id, zoom, x, y)] = (level, version, time.monotonic() + self.ttl)
+                self._levels.move_to_end((user_id, zoom, x, y))
+                while len(self._levels) > self.cache_size:
+                    self._levels.popitem(last=False)
+                self.loaded += 1
+
+    def stats(self):
+        with self._cond:
+            return {"hits": self.hits, "misses": self.misses, "scheduled": self.scheduled,
+                    "dropped": self.dropped, "loaded": self.loaded, "errors": self.errors,
+                    "queued": len(self._queue), "cached": len(self._levels)}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._queued.clear()
+            self._cond.notify_all()
+        self._thread.join(timeout=1.0)
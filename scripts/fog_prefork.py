@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""
+멀티 프로세스 prefork 실행 + 워커 간 공유 메모리
+
+HTTPServer/asyncio 서버는 한 프로세스라서 PIL 인코딩과 요청 파싱이 GIL 때문에 코어 하나만 씁니다.
+prefork 모드는 워커 프로세스 N개를 띄우고, 워커마다 SO_REUSEPORT 소켓으로 같은 포트를 열어
+커널이 연결을 워커들에 나눠 줍니다 (SO_REUSEPORT가 없으면 fork 전에 연 소켓 하나를 공유).
+
+- PreforkMaster: 워커 fork, 죽은 워커 재시작, SIGHUP → 워커 순차 재시작(새 워커를 먼저 띄우고
+  기존 워커는 처리 중인 요청을 마친 뒤 종료), SIGTERM/SIGINT → 전체 종료
+- SharedTileCache: fork 전에 만든 익명 공유 mmap 슬롯 캐시 (인코딩된 마스크 타일을 워커끼리 공유)
+- SharedWriteLog: fork 전에 만든 방문 쓰기 기록 (한 워커가 받은 쓰기를 다른 워커의 미방문 필터에 반영)
+- 방문 인덱스 공유: 인덱스 프로세스 하나만 Firestore 스냅샷 리스너를 유지하고, 변경이 생기면
+  바뀐 사용자만 공유 디렉터리(/dev/shm)에 스냅샷(fog_bitmap 형식) + 방문 위치 세그먼트로 발행합니다
+  (VisitIndexPublisher).
+  워커는 발행된 파일을 mmap으로 열어 읽으므로(SharedVisitIndex) 타일 데이터는 프로세스마다 복사되지 않습니다.
+  방문 버전은 내용 해시라서 어느 워커가 응답해도 ETag가 같습니다.
+
+설정 (환경변수):
+    FOG_WORKERS            워커 프로세스 수 (기본 1 = 기존 단일 프로세스, 0이면 CPU 코어 수)
+    FOG_SHARED_DIR         인덱스 발행 디렉터리 (기본 /dev/shm, 없으면 임시 디렉터리)
+    FOG_SHARED_CACHE_MB    공유 타일 캐시 크기 (MB, 기본 64)
+
+사용 예:
+    master = PreforkMaster(4, serve_worker)
+    master.add_service('index', run_index_process)
+    master.run()
+"""
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from http.server import HTTPServer
+from fog_bitmap import BitmapSnapshot, PointMap, write_snapshot
+from fog_index import UserVisitIndex
+
+DEFAULT_SHARED_CACHE_MB = 64
+
+# 워커가 이 시간 안에 죽으면 바로 다시 띄우지 않고 기다림 (재시작 루프 방지)
+RESTART_BACKOFF = 1.0
+
+# SIGTERM 후 이 시간이 지나도 끝나지 않은 워커는 SIGKILL
+STOP_TIMEOUT = 15.0
+
+# 순차 재시작 때 새 워커가 준비됐다고 알릴 때까지 기다리는 최대 시간(초)
+READY_TIMEOUT = 30.0
+
+# 자식 프로세스에서 준비 완료를 알릴 파이프 (notify_ready)
+_READY_FD = None
+
+
+def workers_from_env():
+    """FOG_WORKERS 환경변수 (0이면 CPU 코어 수)"""
+    try:
+        workers = int(os.environ.get('FOG_WORKERS', 1))
+    except ValueError:
+        return 1
+    return (os.cpu_count() or 1) if workers <= 0 else workers
+
+
+def shared_dir_from_env():
+    """FOG_SHARED_DIR 환경변수 (기본: 메모리 파일 시스템 /dev/shm)"""
+    path = os.environ.get('FOG_SHARED_DIR')
+    if path:
+        return path
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def shared_cache_mb_from_env():
+    try:
+        return max(1, int(os.environ.get('FOG_SHARED_CACHE_MB', DEFAULT_SHARED_CACHE_MB)))
+    except ValueError:
+        return DEFAULT_SHARED_CACHE_MB
+
+
+def bind_listener(host, port, backlog=512, reuse_port=True):
+    """리슨 소켓 생성 (reuse_port면 워커마다 같은 포트에 따로 bind)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+class ReusePortHTTPServer(HTTPServer):
+    """SO_REUSEPORT로 bind하는 HTTPServer (워커마다 같은 포트)"""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def worker_http_server(port, handler, listener=None):
+    """워커용 HTTPServer (listener를 주면 fork 전에 연 공유 소켓 사용)"""
+    if listener is None:
+        return ReusePortHTTPServer(('', port), handler)
+    httpd = HTTPServer(('', port), handler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = listener
+    httpd.server_name, httpd.server_port = socket.gethostname(), port
+    return httpd
+
+
+def notify_ready():
+    """워커가 리슨 소켓을 열었음을 마스터에 알림 (순차 재시작은 이 신호 후 기존 워커를 종료)"""
+    global _READY_FD
+    if _READY_FD is None:
+        return
+    try:
+        os.write(_READY_FD, b'1')
+    except OSError:
+        pass
+    os.close(_READY_FD)
+    _READY_FD = None
+
+
+def serve_http_until_term(httpd):
+    """SIGTERM을 받으면 처리 중인 요청을 마치고 serve_forever에서 빠져나옴"""
+    # shutdown()은 serve_forever 루프가 끝나기를 기다리므로 다른 스레드에서 호출
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=httpd.shutdown, daemon=True).start())
+    notify_ready()
+    try:
+        httpd.serve_forever()
+        # SO_REUSEPORT 소켓은 닫힐 때 accept 대기열의 연결이 reset되므로 남은 연결을 먼저 처리
+        while select.select([httpd], [], [], 0)[0]:
+            httpd._handle_request_noblock()
+    finally:
+        httpd.server_close()
+
+
+class PreforkMaster:
+    """워커 프로세스 관리자
+
+    run_worker(slot)는 자식 프로세스에서 호출되며, 리슨 소켓을 연 뒤 notify_ready()를 부르고
+    SIGTERM을 받으면 처리 중인 요청을 마치고 반환해야 합니다. add_service로 등록한 보조 프로세스(인덱스 발행 등)도 같은 방식으로 관리합니다.
+    """
+
+    def __init__(self, workers, run_worker, name='fog'):
+        self.workers = workers
+        self.run_worker = run_worker
+        self.name = name
+        self._services = {}   # 이름 → 함수
+        self._children = {}   # pid → (종류, slot)
+        self._started = {}    # (종류, slot) → 마지막 시작 시각
+        self._stopping = False
+        self._reload = False
+
+    def add_service(self, name, func):
+        """워커보다 먼저 띄워 계속 유지할 보조 프로세스 등록"""
+        self._services[name] = func
+
+    def _spawn(self, kind, slot, wait_ready=False):
+        """자식 프로세스 시작 (wait_ready면 notify_ready가 불리거나 자식이 끝날 때까지 대기)"""
+        global _READY_FD
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            _READY_FD = ready_write
+            # 자식: 마스터의 시그널 처리 제거 후 실행
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C는 마스터가 SIGTERM으로 전달
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                if kind == 'worker':
+                    self.run_worker(slot)
+                else:
+                    self._services[kind]()
+            except BaseException as e:
+                print(f"❌ {kind} {slot} 비정상 종료: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(ready_write)
+        self._children[pid] = (kind, slot)
+        self._started[(kind, slot)] = time.monotonic()
+        if wait_ready:
+            # 준비 알림(1바이트) 또는 자식 종료(EOF) 중 먼저 오는 쪽까지 대기
+            select.select([ready_read], [], [], READY_TIMEOUT)
+        os.close(ready_read)
+        return pid
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def run(self):
+        """자식 프로세스를 띄우고 종료 시그널까지 감시"""
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for name in self._services:
+            self._spawn(name, 0)
+        for slot in range(self.workers):
+            self._spawn('worker', slot)
+        print(f"👷 {self.name}: 워커 {self.workers}개 시작 (마스터 pid {os.getpid()}, "
+              f"SIGHUP: 워커 순차 재시작)")
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+            self._reap(respawn=True)
+            time.sleep(0.1)
+        self.stop_all()
+
+    def _reap(self, respawn):
+        """끝난 자식 정리 (respawn이면 같은 자리에 다시 띄움)"""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            child = self._children.pop(pid, None)
+            if child is None or not respawn or self._stopping:
+                continue
+            kind, slot = child
+            code = os.waitstatus_to_exitcode(status)
+            print(f"⚠️ {kind} {slot} 종료 (pid {pid}, 코드 {code}) → 재시작", file=sys.stderr)
+            elapsed = time.monotonic() - self._started.get(child, 0)
+            if elapsed < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF - elapsed)
+            self._spawn(kind, slot)
+
+    def _wait_exit(self, pid, timeout):
+        """자식 하나가 끝날 때까지 대기 (시간 초과 시 SIGKILL)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if done:
+                return
+            time.sleep(0.05)
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    def rolling_restart(self):
+        """워커를 하나씩 교체: 새 워커 시작·준비 대기 → 기존 워커 SIGTERM → 종료 대기"""
+        old = [(pid, slot) for pid, (kind, slot) in self._children.items() if kind == 'worker']
+        print(f"🔄 워커 순차 재시작 ({len(old)}개)")
+        for pid, slot in old:
+            self._children.pop(pid, None)
+            self._spawn('worker', slot, wait_ready=True)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+            self._wait_exit(pid, STOP_TIMEOUT)
+
+    def stop_all(self):
+        """워커 → 보조 프로세스 순서로 SIGTERM 후 종료 대기"""
+        children = sorted(self._children.items(), key=lambda item: item[1][0] != 'worker')
+        for pid, _ in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid, _ in children:
+            self._wait_exit(pid, STOP_TIMEOUT)
+        self._children.clear()
+
+
+class SharedTileCache:
+    """fork 전에 만들어 워커끼리 공유하는 인코딩 타일 캐시
+
+    익명 공유 mmap을 slot_size 바이트 슬롯으로 나누고, 키 해시로 슬롯 하나를 정합니다
+    (direct-mapped: 충돌하면 덮어씀). 슬롯 접근은 줄무늬(stripe) 프로세스 락으로 보호합니다.
+    슬롯보다 큰 타일은 공유하지 않습니다 (워커 로컬 캐시에만 보관).
+    """
+
+    SLOT_HEADER = struct.Struct('<16sI')
+
+    def __init__(self, size_mb=None, slot_size=8192, stripes=64):
+        size_mb = shared_cache_mb_from_env() if size_mb is None else size_mb
+        self.slot_size = slot_size
+        self.slots = max(1, size_mb * 1024 * 1024 // slot_size)
+        self._mmap = mmap.mmap(-1, self.slots * slot_size)  # MAP_SHARED → fork 후에도 같은 페이지
+        self._locks = [multiprocessing.Lock() for _ in range(stripes)]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+
+    def _slot(self, digest):
+        index = int.from_bytes(digest[:8], 'little') % self.slots
+        return index * self.slot_size, self._locks[index % len(self._locks)]
+
+    def get(self, key):
+        digest = self._digest(key)
+        offset, lock = self._slot(digest)
+        with lock:
+            stored, length = self.SLOT_HEADER.unpack_from(self._mmap, offset)
+            if stored != digest or length == 0:
+                self.misses += 1
+                return None
+            start = offset + self.SLOT_HEADER.size
+            data = self._mmap[start:start + length]
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.slot_size - self.SLOT_HEADER.size:
+            return False
+        digest = self._digest(key)
+        offset, lock = self._slot(digest)
+        start = offset + self.SLOT_HEADER.size
+        with lock:
+            self._mmap[start:start + len(data)] = data
+            self.SLOT_HEADER.pack_into(self._mmap, offset, digest, len(data))
+        return True
+
+
+class SharedWriteLog:
+    """fork 전에 만들어 워커끼리 공유하는 방문 쓰기 기록 (원형 버퍼)
+
+    한 워커가 받은 쓰기를 다른 워커의 미방문 필터(fog_negative.NegativeTileCache.shared)에도
+    추가하기 위한 것입니다. 각 워커는 다음에 읽을 순번을 들고 있다가 새 기록만 읽고,
+    원형 버퍼가 한 바퀴 넘게 앞서 나가 기록을 놓쳤으면 read()가 None을 돌려줍니다.
+    """
+
+    HEADER = struct.Struct('<Q')            # 다음 기록 순번
+    ENTRY = struct.Struct('<QIHH112s')      # 순번, 쓴 워커 pid, 사용자 ID 길이, 타일 ID 길이, 내용
+    NO_TILE = 0xFFFF                         # 타일 ID가 길어 못 담음 → 그 사용자 필터 만료
+    NO_USER = 0xFFFF                         # 사용자 ID가 길어 못 담음 → 모든 필터 만료
+
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self._mmap = mmap.mmap(-1, self.HEADER.size + capacity * self.ENTRY.size)
+        self._lock = multiprocessing.Lock()
+
+    def sequence(self):
+        return self.HEADER.unpack_from(self._mmap, 0)[0]
+
+    def _offset(self, seq):
+        return self.HEADER.size + (seq % self.capacity) * self.ENTRY.size
+
+    def append(self, user_id, tile_ids):
+        size = self.ENTRY.size - 16
+        user = user_id.encode('utf-8')
+        pid = os.getpid()
+        with self._lock:
+            seq = self.sequence()
+            for tile_id in tile_ids:
+                tile = tile_id.encode('utf-8')
+                if len(user) > size:
+                    fields = (self.NO_USER, 0, b'')
+                elif len(user) + len(tile) > size:
+                    fields = (len(user), self.NO_TILE, user)
+                else:
+                    fields = (len(user), len(tile), user + tile)
+                self.ENTRY.pack_into(self._mmap, self._offset(seq), seq, pid, *fields)
+                seq += 1
+            self.HEADER.pack_into(self._mmap, 0, seq)
+
+    def read(self, since):
+        """since 이후 다른 워커가 쓴 (user_id, tile_id 또는 None) 목록 → (다음 순번, 목록 또는 None)"""
+        seq = self.sequence()
+        if seq == since:
+            return seq, []
+        if seq - since > self.capacity:
+            return seq, None
+        pid = os.getpid()
+        writes = []
+        with self._lock:
+            seq = self.sequence()
+            if seq - since > self.capacity:
+                return seq, None
+            for current in range(since, seq):
+                _, writer, user_len, tile_len, data = self.ENTRY.unpack_from(self._mmap, self._offset(current))
+                if writer == pid:
+                    continue
+                if user_len == self.NO_USER:
+                    return seq, None
+                user_id = data[:user_len].decode('utf-8', 'replace')
+                tile_id = None if tile_len == self.NO_TILE else \
+                    data[user_len:user_len + tile_len].decode('utf-8', 'replace')
+                writes.append((user_id, tile_id))
+        return seq, writes
+
+
+def _content_version(sections, points):
+    """사용자 방문 데이터 내용 해시 (프로세스/재시작과 무관하게 같은 내용이면 같은 버전)"""
+    digest = hashlib.blake2b(digest_size=8)
+    for zoom, (key_bytes, level_bytes, count) in sorted(sections):
+        digest.update(struct.pack('<BI', zoom, count))
+        digest.update(key_bytes)
+        digest.update(level_bytes)
+    digest.update(points.tobytes())
+    return 's' + digest.hexdigest()
+
+
+class VisitIndexPublisher:
+    """인덱스 프로세스: VisitIndexRegistry를 공유 디렉터리에 주기적으로 발행
+
+    바뀐 사용자만 새 세그먼트에 쓰고, 바뀌지 않은 사용자는 이전 세그먼트를 그대로 가리킵니다.
+    세그먼트가 MAX_SEGMENTS개에 이르면 살아 있는 사용자가 가장 적은 세그먼트부터 새 세그먼트로 옮기고,
+    아무 사용자도 가리키지 않는 세그먼트는 두 세대 뒤에 삭제합니다.
+
+    파일 구성 (base = 공유 디렉터리/fog-index-{마스터 pid}, 세그먼트 = {인덱스 프로세스 pid}.{세대}):
+        {base}.{세그먼트}.bin    세그먼트 사용자의 방문 타일 스냅샷 (fog_bitmap 형식)
+        {base}.{세그먼트}.pts    세그먼트 사용자의 방문 위치 (위도, 경도) float64 배열
+        {base}.json              현재 세대 + 세그먼트 파일 + 사용자별 버전/세그먼트/위치 범위 (원자적 교체)
+    """
+
+    MAX_SEGMENTS = 8
+
+    def __init__(self, registry, base_path, interval=0.2):
+        self.registry = registry
+        self.base_path = base_path
+        self.interval = interval
+        self.generation = 0
+        self._signature = None
+        self._stamps = {}    # user_id → 발행한 (serial, version)
+        self._entries = {}   # user_id → {"version", "segment", "points"} (매니페스트 항목)
+        self._segments = {}  # 세그먼트 이름 → {"snapshot": 경로, "points": 경로}
+        self._retired = []   # (폐기한 세대, 파일 경로 목록)
+
+    def publish(self):
+        """바뀐 사용자만 새 세그먼트로 발행 (바뀐 것이 없으면 아무 일도 하지 않음)"""
+        with self.registry._lock:
+            indexes = {index.user_id: index for index in self.registry._indexes.values()
+                       if index.ready.is_set()}
+        pending = {user_id: index for user_id, index in indexes.items()
+                   if self._stamps.get(user_id) != (index.serial, index.version)}
+        removed = [user_id for user_id in self._entries if user_id not in indexes]
+        if self.generation and not pending and not removed:
+            return
+        for user_id in removed:
+            del self._entries[user_id]
+            self._stamps.pop(user_id, None)
+
+        self.generation += 1
+        # 세그먼트가 너무 많으면 살아 있는 사용자가 가장 적은 세그먼트부터 이번 세그먼트로 옮김
+        live = {}
+        for user_id, entry in self._entries.items():
+            if user_id not in pending:
+                live[entry["segment"]] = live.get(entry["segment"], 0) + 1
+        while len(live) >= self.MAX_SEGMENTS:
+            segment = min(live, key=live.get)
+            del live[segment]
+            pending.update((user_id, indexes[user_id]) for user_id, entry in self._entries.items()
+                           if entry["segment"] == segment)
+
+        if pending:
+            self._write_segment(pending)
+
+        referenced = {entry["segment"] for entry in self._entries.values()}
+        for segment in [segment for segment in self._segments if segment not in referenced]:
+            paths = self._segments.pop(segment)
+            self._retired.append((self.generation, [paths["snapshot"], paths["points"]]))
+
+        manifest = {"generation": self.generation, "segments": self._segments, "users": self._entries}
+        tmp_path = f"{self.base_path}.json.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, f"{self.base_path}.json")
+
+        # 두 세대 전에 폐기한 세그먼트 삭제 (이미 mmap한 워커는 그대로 읽을 수 있음)
+        while self._retired and self._retired[0][0] <= self.generation - 2:
+            _, paths = self._retired.pop(0)
+            _unlink(paths)
+
+    def _write_segment(self, pending):
+        """pending 사용자들을 이번 세대 세그먼트 파일에 쓰고 매니페스트 항목 갱신"""
+        segment = f"{os.getpid()}.{self.generation}"
+        sections = []
+        points = array('d')
+        for user_id, index in pending.items():
+            with index._lock:
+                packed = [(zoom, level_map.packed()) for zoom, level_map in index.level_maps().items()]
+                user_points = array('d', index.points.coords())
+                stamp = (index.serial, index.version)
+            self._stamps[user_id] = stamp
+            self._entries[user_id] = {"version": _content_version(packed, user_points),
+                                      "segment": segment,
+                                      "points": [len(points) // 2, len(user_points) // 2]}
+            points.extend(user_points)
+            sections.extend((user_id, zoom, data) for zoom, data in packed)
+
+        paths = {"snapshot": f"{self.base_path}.{segment}.bin", "points": f"{self.base_path}.{segment}.pts"}
+        write_snapshot(paths["snapshot"], sections)
+        with open(paths["points"], 'wb') as f:
+            f.write(points.tobytes() or b'\0' * 8)  # 빈 파일은 mmap 불가
+        self._segments[segment] = paths
+
+    def _changed(self):
+        with self.registry._lock:
+            signature = tuple((index.user_id, index.serial, index.version)
+                              for index in self.registry._indexes.values() if index.ready.is_set())
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
+
+    def _read_requests(self, request_fd):
+        """워커가 보낸 사용자 ID(줄 단위)마다 리스너 구독"""
+        pending = b''
+        while True:
+            chunk = os.read(request_fd, 4096)
+            if not chunk:
+                return
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                user_id = line.decode('utf-8', 'replace').strip()
+                if user_id:
+                    self.registry.index_for(user_id)
+
+    def run(self, request_fd, stop_event):
+        """stop_event가 설정될 때까지 구독 요청 처리 + 변경 시 발행"""
+        threading.Thread(target=self._read_requests, args=(request_fd,), daemon=True).start()
+        self.publish()
+        while not stop_event.wait(self.interval):
+            if self._changed():
+                self.publish()
+
+    def cleanup(self):
+        """발행 파일 삭제"""
+        _unlink([f"{self.base_path}.json"])
+        for paths in self._segments.values():
+            _unlink([paths["snapshot"], paths["points"]])
+        for _, paths in self._retired:
+            _unlink(paths)
+
+
+def _unlink(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class SharedUserIndex(UserVisitIndex):
+    """발행된 스냅샷으로 만든 읽기 전용 사용자 인덱스 (버전 = 내용 해시)
+
+    타일 맵과 방문 위치는 발행 파일의 mmap 뷰를 복사하지 않고 씁니다. 조상 타일 집계는
+    FogPyramid가 정렬된 Morton 키에서 조회할 때 계산하므로 만들 때 드는 비용이 없습니다.
+    """
+
+    def __init__(self, user_id, version, level_maps, points):
+        super().__init__(user_id)
+        self.shared_version = version
+        self.points = PointMap.from_coords(points)
+        self.load_level_maps(level_maps)
+
+    @property
+    def version_tag(self):
+        return self.shared_version
+
+
+class SharedVisitIndex:
+    """워커 쪽 방문 인덱스: 발행된 파일을 mmap으로 읽는 VisitIndexRegistry 대역
+
+    아직 발행되지 않은 사용자는 인덱스 프로세스에 구독을 요청하고 None을 반환합니다
+    (호출 측은 저장소 직접 조회로 대체).
+    """
+
+    load_timeout = 0.0
+    refresh_interval = 0.05
+    request_interval = 1.0
+
+    def __init__(self, base_path, request_fd):
+        self.base_path = base_path
+        self.request_fd = request_fd
+        self._manifest_stat = None
+        self._users = {}
+        self._segments = {}  # 세그먼트 이름 → (BitmapSnapshot, 방문 위치 mmap 뷰)
+        self._indexes = {}
+        self._requested = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """매니페스트가 바뀌었으면 새 세대로 교체 (refresh_interval마다 한 번 확인, 새 세그먼트만 엶)"""
+        now = time.monotonic()
+        if now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        try:
+            stat = os.stat(f"{self.base_path}.json")
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns)
+        if signature == self._manifest_stat:
+            return
+        try:
+            with open(f"{self.base_path}.json", encoding='utf-8') as f:
+                manifest = json.load(f)
+            segments = {name: self._segments.get(name) or _open_segment(paths)
+                        for name, paths in manifest["segments"].items()}
+        except (OSError, ValueError, KeyError):
+            return  # 발행 도중이면 다음 확인 때 다시 시도
+        self._manifest_stat = signature
+        self._users = manifest["users"]
+        self._segments = segments  # 빠진 세그먼트는 그 뷰를 쓰는 인덱스가 없어지면 GC가 해제
+
+    def _request(self, user_id):
+        """인덱스 프로세스에 구독 요청 (사용자당 request_interval에 한 번, 막히면 버림)"""
+        now = time.monotonic()
+        if now - self._requested.get(user_id, 0) < self.request_interval:
+            return
+        self._requested[user_id] = now
+        try:
+            os.write(self.request_fd, user_id.encode('utf-8') + b'\n')
+        except (BlockingIOError, BrokenPipeError):
+            pass
+
+    def index_for(self, user_id):
+        with self._lock:
+            self._refresh()
+            entry = self._users.get(user_id)
+            if entry is None:
+                self._request(user_id)
+                return None
+            index = self._indexes.get(user_id)
+            if index is not None and index.version_tag == entry["version"]:
+                return index
+            snapshot, points = self._segments[entry["segment"]]
+        # 타일 키/level과 방문 위치 모두 mmap 뷰를 그대로 쓰므로 만드는 비용은 섹션 수에만 비례
+        start, count = entry["points"]
+        index = SharedUserIndex(user_id, entry["version"], snapshot.level_maps(user_id),
+                                points[start * 2:(start + count) * 2])
+        with self._lock:
+            current = self._indexes.get(user_id)
+            if current is not None and current.version_tag == entry["version"]:
+                return current  # 다른 스레드가 먼저 만듦
+            self._indexes[user_id] = index
+        return index
+
+    def ready_index(self, user_id, timeout=None):
+        return self.index_for(user_id)
+
+    def fog_level(self, user_id, zoom, x, y, timeout=None):
+        index = self.index_for(user_id)
+        if index is None:
+            return None
+        return index.fog_level(zoom, x, y)
+
+    def stats(self):
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {"users": len(indexes), "tiles": sum(len(index) for index in indexes)}
+
+    def close(self):
+        with self._lock:
+            self._indexes.clear()
+            self._segments = {}
+
+
+def _open_segment(paths):
+    """세그먼트 파일 mmap: (BitmapSnapshot, 방문 위치 float64 뷰)"""
+    snapshot = BitmapSnapshot(paths["snapshot"])
+    with open(paths["points"], 'rb') as f:
+        points = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast('d')
+    return snapshot, points
+
+
+def index_request_pipe():
+    """워커 → 인덱스 프로세스 구독 요청 파이프 (쓰기 쪽은 막히지 않게)"""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(write_fd, False)
+    return read_fd, write_fd
+
+
+def shared_index_base(shared_dir=None):
+    """이번 실행의 인덱스 발행 파일 경로 접두어"""
+    return os.path.join(shared_dir or shared_dir_from_env(), f"fog-index-{os.getpid()}")
+
+
+def run_index_process(make_registry, base_path, request_fd):
+    """인덱스 프로세스 본문: 레지스트리 생성 → SIGTERM까지 발행 → 정리"""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    registry = make_registry()
+    publisher = VisitIndexPublisher(registry, base_path)
+    try:
+        publisher.run(request_fd, stop_event)
+    finally:
+        registry.close()
+        publisher.cleanup()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+운영 중 샘플링 프로파일러 (/debug/profile, --profile)
+
+타일 지연이 늘어났을 때 서버를 재시작하거나 외부 도구를 붙이지 않고, 실제 트래픽을 처리하는
+스레드의 스택을 일정 간격으로 샘플링해 어디서 시간을 쓰는지 확인합니다.
+
+- 별도 스레드가 sys._current_frames()로 요청 처리 중인 스레드의 스택만 읽음 (요청 경로 계측 없음)
+- 샘플마다 route 라벨(metrics_route)과 처리 단계(stage_timer: firestore / render / encode / write …)를
+  스택 맨 앞에 붙이므로 Firestore 조회, PIL 렌더링, PNG 인코딩 비율을 경로별로 바로 볼 수 있음
+- 결과는 collapsed stack 형식 ("route:tile;stage:encode;함수 (파일:줄);… 샘플 수")이라
+  flamegraph.pl / speedscope에 그대로 넣을 수 있고, format=json이면 경로/단계별 요약
+- 벽시계 기준 샘플링: Firestore 응답을 기다리며 블록된 시간도 샘플에 잡힘
+
+관리자 전용: FOG_ADMIN_TOKEN이 있으면 Authorization: Bearer 토큰이 필요하고,
+없으면 로컬(127.0.0.1 / ::1) 요청만 허용합니다.
+
+사용법:
+    curl 'http://localhost:8080/debug/profile?seconds=30' > fog.folded
+    curl -H "Authorization: Bearer $FOG_ADMIN_TOKEN" 'http://HOST:8080/debug/profile?seconds=10&format=json'
+    flamegraph.pl fog.folded > fog.svg
+    python fog_server_with_firestore.py --profile 60 --profile-output fog.folded
+
+쿼리 파라미터:
+    seconds   샘플링 시간 (기본 10, 최대 60)
+    hz        초당 샘플 수 (기본 100, 최대 1000)
+    format    folded (기본) | json
+    threads   all이면 요청을 처리하지 않는 백그라운드 스레드도 포함 (thread:이름)
+"""
+
+import hmac
+import json
+import os
+import select
+import socketserver
+import sys
+import threading
+import time
+
+PROFILE_PATH = '/debug/profile'
+
+DEFAULT_PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 60.0
+DEFAULT_PROFILE_HZ = 100
+MAX_PROFILE_HZ = 1000
+
+# 샘플 하나에 남길 최대 스택 깊이 (안쪽 프레임부터)
+MAX_STACK_DEPTH = 64
+
+# 토큰이 없을 때 관리자/쓰기 엔드포인트를 허용하는 클라이언트 주소
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+# 스레드 ID → 처리 중인 요청 [(handler, 요청 진입 프레임), ...] (중첩 처리 시 마지막이 현재 요청)
+ACTIVE_REQUESTS = {}
+
+# 스레드 ID → 현재 처리 단계 (fog_metrics.stage_timer가 갱신)
+THREAD_STAGES = {}
+
+# /debug/profile은 프로세스당 한 번에 하나만
+_ENDPOINT_LOCK = threading.Lock()
+
+
+def request_started(handler, frame):
+    """요청 처리 시작 (frame: 요청 진입 함수의 프레임, 샘플 스택은 그 안쪽만 남김)"""
+    ACTIVE_REQUESTS.setdefault(threading.get_ident(), []).append((handler, frame))
+
+
+def request_finished():
+    ident = threading.get_ident()
+    requests = ACTIVE_REQUESTS.get(ident)
+    if requests:
+        requests.pop()
+        if not requests:
+            ACTIVE_REQUESTS.pop(ident, None)
+
+
+def admin_token_from_env():
+    return os.environ.get('FOG_ADMIN_TOKEN') or None
+
+
+def bearer_authorized(authorization, client_host, token):
+    """token이 있으면 Bearer 토큰 비교, 없으면 로컬(loopback) 요청만 허용"""
+    if token is None:
+        return client_host in LOOPBACK_HOSTS
+    scheme, _, value = (authorization or '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip(), token)
+
+
+def admin_authorized(authorization, client_host, token=None):
+    """FOG_ADMIN_TOKEN이 있으면 Bearer 토큰 비교, 없으면 로컬 요청만 허용"""
+    token = admin_token_from_env() if token is None else token
+    return bearer_authorized(authorization, client_host, token)
+
+
+def _query_number(query, name, default, low, high, cast=float):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = cast(values[0])
+    except ValueError:
+        raise ValueError(f"{name}는 숫자여야 합니다")
+    if not low <= value <= high:
+        raise ValueError(f"{name}는 {low} ~ {high} 사이여야 합니다")
+    return value
+
+
+def profile_options(query):
+    """parse_qs 결과 → (seconds, hz, format, all_threads), 잘못되면 ValueError"""
+    seconds = _query_number(query, 'seconds', DEFAULT_PROFILE_SECONDS, 0.1, MAX_PROFILE_SECONDS)
+    hz = _query_number(query, 'hz', DEFAULT_PROFILE_HZ, 1, MAX_PROFILE_HZ, int)
+    fmt = query.get('format', ['folded'])[0]
+    if fmt not in ('folded', 'json'):
+        raise ValueError("format은 folded 또는 json")
+    return seconds, hz, fmt, query.get('threads', [''])[0] == 'all'
+
+
+class SamplingProfiler:
+    """요청 처리 스레드 스택 샘플러 (start → stop 사이 샘플을 collapsed stack으로 집계)"""
+
+    def __init__(self, hz=DEFAULT_PROFILE_HZ, all_threads=False):
+        self.interval = 1.0 / hz
+        self.hz = hz
+        self.all_threads = all_threads
+        self.stacks = {}  # (route, stage 또는 스레드 라벨, 프레임 라벨...) → 샘플 수
+        self.samples = 0
+        self.idle = 0  # 요청을 처리하지 않은 샘플 (요청 스레드가 모두 비어 있음)
+        self.started = None
+        self.elapsed = 0.0
+        self._labels = {}  # code 객체 → 프레임 라벨
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='fog-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        next_at = time.perf_counter()
+        while not self._stop.wait(max(0.0, next_at - time.perf_counter())):
+            self.sample(own)
+            next_at += self.interval
+            now = time.perf_counter()
+            if next_at < now:
+                # 샘플링이 밀리면 몰아서 찍지 않고 지금부터 다시
+                next_at = now
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (f"{code.co_name} "
+                                          f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        return label
+
+    def sample(self, own=None):
+        """모든 스레드의 현재 스택을 한 번 기록"""
+        names = None
+        busy = False
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            try:
+                handler, stop = ACTIVE_REQUESTS[ident][-1]
+            except (KeyError, IndexError):
+                handler = None
+            if handler is not None:
+                route = getattr(handler, 'metrics_route', 'unknown')
+                if route == 'profile':
+                    continue
+                root = (f"route:{route}", f"stage:{THREAD_STAGES.get(ident) or 'other'}")
+                busy = True
+            elif self.all_threads:
+                if names is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                root = (f"thread:{names.get(ident, ident)}",)
+                stop = None
+            else:
+                continue
+            stack = []
+            while frame is not None and frame is not stop and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            key = root + tuple(stack)
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+        if not busy:
+            self.idle += 1
+
+    def collapsed(self):
+        """flamegraph.pl / speedscope 입력 형식 ("프레임;프레임;… 샘플 수" 줄 목록)"""
+        lines = [f"{';'.join(stack)} {count}"
+                 for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])]
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def summary(self, top=20):
+        """경로별 샘플 수 + 단계별 비율 + 자체 시간(self) 상위 프레임"""
+        routes = {}
+        own_samples = {}
+        for stack, count in self.stacks.items():
+            if stack[0].startswith('route:'):
+                route = routes.setdefault(stack[0][6:], {'samples': 0, 'stages': {}, 'frames': {}})
+                route['samples'] += count
+                stage = stack[1][6:]
+                route['stages'][stage] = route['stages'].get(stage, 0) + count
+                frames = stack[2:]
+            else:
+                route = None
+                frames = stack[1:]
+            if frames:
+                own_samples[frames[-1]] = own_samples.get(frames[-1], 0) + count
+                if route is not None:
+                    route['frames'][frames[-1]] = route['frames'].get(frames[-1], 0) + count
+
+        busy = sum(route['samples'] for route in routes.values())
+        result = {}
+        for name, route in sorted(routes.items(), key=lambda item: -item[1]['samples']):
+            samples = route['samples']
+            result[name] = {
+                'samples': samples,
+                'percent': round(100.0 * samples / busy, 1) if busy else 0.0,
+                'stages': {stage: {'samples': count, 'percent': round(100.0 * count / samples, 1)}
+                           for stage, count in sorted(route['stages'].items(), key=lambda item: -item[1])},
+                'top': sorted(route['frames'].items(), key=lambda item: -item[1])[:5],
+            }
+        return {
+            'seconds': round(self.elapsed, 3),
+            'hz': self.hz,
+            'samples': self.samples,
+            'busySamples': self.samples - self.idle,
+            'routes': result,
+            'topSelf': sorted(own_samples.items(), key=lambda item: -item[1])[:top],
+        }
+
+    def summary_lines(self):
+        """콘솔 출력용 경로별 요약"""
+        summary = self.summary()
+        lines = [f"🔬 샘플 {summary['samples']}개 ({summary['seconds']:.1f}s, {self.hz}Hz), "
+                 f"요청 처리 중 {summary['busySamples']}개"]
+        for route, stats in summary['routes'].items():
+            stages = ', '.join(f"{stage} {info['percent']:g}%" for stage, info in stats['stages'].items())
+            lines.append(f"   {route}: {stats['percent']:g}% ({stages})")
+        return lines
+
+
+def run_profile_request(handler, query):
+    """/debug/profile 처리 → (상태 코드, 본문, Content-Type 또는 오류 설명)
+
+    단일 스레드 HTTPServer에서는 이 요청이 서버 루프를 붙잡으므로, 샘플링 시간 동안
+    같은 스레드에서 들어오는 다른 요청을 계속 처리합니다 (그 요청들이 프로파일 대상).
+    """
+    try:
+        seconds, hz, fmt, all_threads = profile_options(query)
+    except ValueError as e:
+        return 400, None, str(e)
+    if not _ENDPOINT_LOCK.acquire(blocking=False):
+        return 409, None, "다른 프로파일이 실행 중입니다"
+    try:
+        profiler = SamplingProfiler(hz, all_threads).start()
+        try:
+            serve_during(handler.server, seconds)
+        finally:
+            profiler.stop()
+    finally:
+        _ENDPOINT_LOCK.release()
+    if fmt == 'json':
+        body = json.dumps(profiler.summary(), ensure_ascii=False)
+        return 200, body.encode('utf-8'), 'application/json; charset=utf-8'
+    return 200, profiler.collapsed().encode('utf-8'), 'text/plain; charset=utf-8'
+
+
+def serve_during(server, seconds):
+    """seconds 동안 대기 (요청마다 스레드를 쓰지 않는 서버면 그동안 들어온 요청을 직접 처리)"""
+    deadline = time.monotonic() + seconds
+    threaded = isinstance(server, socketserver.ThreadingMixIn)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if threaded or server is None:
+            time.sleep(remaining)
+            return
+        if select.select([server], [], [], min(remaining, 0.5))[0]:
+            server._handle_request_noblock()
+
+
+def add_profile_arguments(parser):
+    """서버 CLI의 --profile 옵션"""
+    parser.add_argument('--profile', type=float, metavar='SECONDS',
+                        help='시작 후 SECONDS초 동안 샘플링 프로파일 (0이면 종료할 때까지)')
+    parser.add_argument('--profile-output', default=None,
+                        help='collapsed stack 출력 파일 (기본: fog_profile_<pid>.folded)')
+    parser.add_argument('--profile-hz', type=int, default=DEFAULT_PROFILE_HZ,
+                        help=f'초당 샘플 수 (기본 {DEFAULT_PROFILE_HZ})')
+
+
+class ProfileRun:
+    """--profile: 백그라운드 샘플링 후 collapsed stack 파일 저장 + 경로별 요약 출력"""
+
+    def __init__(self, seconds, output=None, hz=DEFAULT_PROFILE_HZ):
+        self.seconds = seconds
+        self.output = output
+        self.profiler = SamplingProfiler(min(max(1, hz), MAX_PROFILE_HZ))
+        self._finished = threading.Lock()
+        self._timer = None
+
+    @classmethod
+    def from_args(cls, args):
+        """--profile 옵션이 있으면 시작한 ProfileRun, 없으면 None"""
+        if args.profile is None:
+            return None
+        return cls(max(0.0, args.profile), args.profile_output, args.profile_hz).start()
+
+    def start(self):
+        self.profiler.start()
+        if self.seconds:
+            self._timer = threading.Timer(self.seconds, self.finish)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def finish(self):
+        """샘플링 종료 후 파일 저장 (여러 번 불러도 한 번만)"""
+        if not self._finished.acquire(blocking=False):
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self.profiler.stop()
+        path = self.output or f"fog_profile_{os.getpid()}.folded"
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.profiler.collapsed())
+        os.replace(tmp_path, path)
+        print(f"🔬 프로파일 저장: {path}")
+        for line in self.profiler.summary_lines():
+            print(line)
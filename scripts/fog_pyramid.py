@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+줌 피라미드(쿼드트리) fog 집계
+
+앱은 한 줌 레벨(base zoom)에서만 방문 타일을 기록하므로, 다른 줌의 타일 ID로
+직접 조회하면 항상 미방문(3, 검은색)이 됩니다. FogPyramid는 base zoom 타일의
+정렬된 Morton 키에서 상위 줌 조상 타일의 집계를 구해, 어느 줌이든 fog 상태를 얻을 수 있게 합니다.
+
+- 조상 타일: 하위 타일 중 level 1 / level 2 개수 (Morton 키에서 조상의 자식은 연속 구간이므로
+  키 배열 이분 탐색 두 번 + level 1 누적 개수 배열로 계산, 조상별 dict를 따로 두지 않음)
+- 줌 아웃 (zoom < base): 하위 타일이 모두 level 1이면 1, 하나라도 방문했으면 2(부분 탐색), 없으면 3
+- 줌 인 (zoom > base): base zoom 조상 타일의 level을 그대로 사용
+
+base zoom 타일 자체는 압축 맵(fog_bitmap.TileLevelMap)에 보관합니다. 맵의 overlay(아직 압축되지
+않은 변경분)에 해당하는 조상 집계 변화만 작은 dict(_delta)에 두고, 맵이 압축되면 비웁니다.
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from fog_bitmap import TileLevelMap, morton_encode
+
+DEFAULT_FOG_LEVEL = 3
+
+# 집계하는 fog level (1=투명, 2=회색); 3은 미방문과 같으므로 집계하지 않음
+VISITED_LEVELS = (1, 2)
+
+# 2비트 level 바이트(타일 4개) → level 1 타일 수
+_LEVEL1_IN_BYTE = bytes(sum(1 for slot in range(4) if (b >> (slot * 2)) & 0b11 == 1) for b in range(256))
+
+
+class FogPyramid:
+    """한 base zoom의 방문 타일을 min_zoom까지 집계한 쿼드트리"""
+
+    def __init__(self, base_zoom, min_zoom=0, levels=None):
+        self.base_zoom = base_zoom
+        self.min_zoom = min(min_zoom, base_zoom)
+        # 스냅샷 등에서 읽은 base zoom 맵은 그대로 쓰고, 조상 집계는 조회할 때 키 배열에서 계산
+        self.levels = levels if levels is not None else TileLevelMap(base_zoom)  # (x, y) → level
+        self.levels.compact()  # 집계는 기본 배열 기준 (overlay가 없으면 아무 일도 하지 않음)
+        self._rebase()
+
+    def _rebase(self):
+        """맵의 기본 배열 기준으로 집계 상태 초기화 (level 1 누적 개수는 첫 줌 아웃 조회 때 계산)"""
+        keys, levels = self.levels.base()
+        self._base = (keys, levels, None)  # (키 배열, 2비트 level, level 1 누적 개수) — 한 번에 교체
+        self._delta = {}  # (z, x, y) → [level 1 증감, level 2 증감] (overlay 변경분)
+
+    def _compacted(self):
+        """맵이 overlay를 압축해 기본 배열이 바뀌었으면 집계 상태를 새로 잡음
+        (packed() 등 피라미드 밖에서 압축될 수도 있으므로 변경 전후 모두 확인)"""
+        if self.levels.base()[0] is self._base[0]:
+            return False
+        self._rebase()
+        return True
+
+    def set(self, x, y, level):
+        """base zoom 타일의 fog level 설정 (조상 집계 변화는 overlay 변경분으로 기록)"""
+        if level not in VISITED_LEVELS:
+            self.remove(x, y)
+            return
+        old = self.levels.get((x, y))
+        if old == level:
+            return
+        self._compacted()
+        self.levels[(x, y)] = level
+        if not self._compacted():
+            self._apply(x, y, old, -1)
+            self._apply(x, y, level, +1)
+
+    def remove(self, x, y):
+        """base zoom 타일의 방문 기록 삭제"""
+        self._compacted()
+        old = self.levels.pop((x, y), None)
+        if not self._compacted():
+            self._apply(x, y, old, -1)
+
+    def _apply(self, x, y, level, delta):
+        if level not in VISITED_LEVELS:
+            return
+        slot = level - 1
+        for zoom in range(self.base_zoom - 1, self.min_zoom - 1, -1):
+            shift = self.base_zoom - zoom
+            key = (zoom, x >> shift, y >> shift)
+            counts = self._delta.get(key)
+            if counts is None:
+                counts = self._delta[key] = [0, 0]
+            counts[slot] += delta
+            if counts[0] == 0 and counts[1] == 0:
+                del self._delta[key]
+
+    def _level1_prefix(self):
+        """기본 배열의 바이트(타일 4개)별 level 1 누적 개수 (타일 4개당 4바이트, 필요할 때 한 번 계산)"""
+        keys, levels, prefix = self._base
+        if prefix is None:
+            prefix = array('I', [0])
+            prefix.extend(accumulate(_LEVEL1_IN_BYTE[b] for b in levels))
+            self._base = (keys, levels, prefix)
+        return levels, prefix
+
+    def _level1_before(self, i):
+        """기본 배열 앞쪽 i개 타일 중 level 1 수"""
+        levels, prefix = self._level1_prefix()
+        count = prefix[i >> 2]
+        if i & 3:
+            count += _LEVEL1_IN_BYTE[levels[i >> 2] & ((1 << (2 * (i & 3))) - 1)]
+        return count
+
+    def counts(self, zoom, x, y):
+        """조상 타일 (zoom < base)의 (level 1 하위 타일 수, level 2 하위 타일 수)"""
+        shift = 2 * (self.base_zoom - zoom)
+        ancestor = morton_encode(x, y)
+        keys = self._base[0]
+        start = bisect_left(keys, ancestor << shift)
+        end = bisect_left(keys, (ancestor + 1) << shift, start)
+        revealed = self._level1_before(end) - self._level1_before(start) if end > start else 0
+        gray = end - start - revealed
+        delta = self._delta.get((zoom, x, y))
+        if delta is not None:
+            revealed += delta[0]
+            gray += delta[1]
+        return revealed, gray
+
+    def state(self, zoom, x, y):
+        """타일의 (fog level, 방문 커버리지 0.0~1.0) 반환"""
+        if zoom >= self.base_zoom:
+            shift = zoom - self.base_zoom
+            level = self.levels.get((x >> shift, y >> shift), DEFAULT_FOG_LEVEL)
+            return level, (1.0 if level in VISITED_LEVELS else 0.0)
+
+        if zoom < self.min_zoom:
+            return DEFAULT_FOG_LEVEL, 0.0
+
+        revealed, gray = self.counts(zoom, x, y)
+        if revealed + gray == 0:
+            return DEFAULT_FOG_LEVEL, 0.0
+
+        total = 1 << (2 * (self.base_zoom - zoom))
+        coverage = (revealed + gray) / total
+        level = 1 if revealed == total else 2
+        return level, coverage
+
+    def nbytes(self):
+        """대략적인 메모리 크기 (base zoom 맵 + level 1 누적 개수, overlay/_delta 제외)"""
+        prefix = self._base[2]
+        return self.levels.nbytes() + (0 if prefix is None else len(prefix) * prefix.itemsize)
+
+    def __len__(self):
+        return len(self.levels)
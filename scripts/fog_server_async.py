@@ -0,0 +1,917 @@
+#!/usr/bin/env python3
+"""
+asyncio 기반 동시 처리 Fog of War 타일 서버
+
+기존 서버들(HTTPServer)은 요청을 하나씩 처리하므로 느린 Firestore 조회 하나가
+다른 사용자의 타일 요청까지 모두 막습니다. 이 서버는 다음과 같이 동작합니다.
+
+- 비동기 Firestore 클라이언트(firestore_async)로 조회 → 조회 중에도 다른 요청 처리
+- HTTP/1.1 keep-alive: 한 연결로 여러 타일 요청 처리 (뷰포트당 12~30개 타일)
+- --concurrency 로 동시에 처리하는 타일 요청 수 제한
+- 사용자별 방문 타일 메모리 인덱스(fog_index.py)로 타일당 Firestore 조회 제거
+- --render mask: 방문 위치 기준 픽셀 단위 마스크 타일 (fog_mask.py, NumPy 필요)
+- Accept: image/webp 클라이언트에는 무손실 WebP, 나머지는 팔레트 PNG (--png-compress, --no-webp)
+- 같은 타일의 동시 조회는 하나로 합치고, 짧은 시간(--batch-window-ms) 동안 들어온
+  타일 조회는 Firestore get_all 한 번으로 묶음 (fog_batch.py)
+- --store memory|sqlite:PATH: Firestore 대신 로컬 방문 기록 저장소 사용 (fog_store.py)
+- --workers N: 워커 프로세스 N개가 SO_REUSEPORT로 같은 포트를 나눠 처리 (fog_prefork.py)
+- 응답한 타일의 주변 8개 + 다음 줌 자식 4개를 백그라운드에서 미리 읽음 (fog_prefetch.py, --no-prefetch)
+- POST /visits/{userId}: GPS 궤적을 받아 방문 타일/fog level을 계산해 일괄 저장 (fog_ingest.py)
+- GET /groups/{groupId}/tiles|viewport/...: 그룹 멤버의 방문 타일을 합성한 fog (fog_group.py)
+- 과부하 보호 (fog_shed.py): 전체/사용자별 동시 요청 한도를 넘으면 바로 503/429 + Retry-After,
+  Firestore 조회는 --store-deadline-ms 안에 못 받으면 마지막으로 알던 level을 stale로 응답
+- SIGTERM: 새 연결을 받지 않고 처리 중인 요청을 마친 뒤 종료
+
+설치 요구사항:
+pip install firebase-admin pillow
+
+사용법:
+python fog_server_async.py                        # serviceAccountKey.json 사용
+python fog_server_async.py --auth adc             # Application Default Credentials
+python fog_server_async.py --port 8080 --concurrency 64 --keepalive-timeout 15
+python fog_server_async.py --store sqlite:fog.db  # 로컬 SQLite 저장소 (Firebase 불필요)
+python fog_server_async.py --workers 0            # CPU 코어 수만큼 워커 (SIGHUP: 순차 재시작)
+python fog_server_async.py --max-in-flight 256 --max-user-in-flight 32 --store-deadline-ms 800
+
+URL 예시:
+http://localhost:8080/tiles/user123/15/26910/12667.png
+http://localhost:8080/viewport/user123/15?x0=26905&y0=12662&x1=26915&y1=12672
+http://localhost:8080/groups/_/tiles/15/26910/12667.png?users=user1,user2,user3
+http://localhost:8080/health
+http://localhost:8080/metrics
+POST http://localhost:8080/visits/user123   {"points": [[위도, 경도, 시각?], ...]}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import time
+from http import HTTPStatus
+from urllib.parse import urlparse
+from fog_tiles import (
+    FOG_LEVEL_COLORS, RENDER_MODES, TILE_CONTENT_TYPES, RenderedTileCache, TileEncoder,
+    debug_mode_enabled,
+    normalize_fog_level, render_debug_tile, render_fog_level, render_mode_from_env,
+)
+from fog_index import VisitIndexRegistry
+from fog_metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, IN_FLIGHT, REGISTRY, REQUEST_LATENCY, REQUEST_LOG,
+    REQUESTS, register_groups, register_lookup_stats, register_prefetcher, register_shedding, register_tile_cache,
+    register_visit_index, stage_timer,
+)
+from fog_http import cache_control_from_env, level_matches, make_etag, version_matches
+from fog_viewport import (
+    VIEWPORT_PATTERN, Viewport, encode_viewport, etag_matches, levels_from_index, parse_format,
+    viewport_etag,
+)
+from fog_batch import SingleFlight
+from fog_group import (
+    GROUP_TILE_PATTERN, GROUP_VIEWPORT_PATTERN, GroupComposer, GroupDirectory, GroupNotFound,
+    group_label, member_indexes, min_levels,
+)
+from fog_ingest import INGEST_PATTERN, MAX_INGEST_BODY, authorized, ingest_banner, ingest_visits, parse_points
+from fog_prefetch import TilePrefetcher, prefetch_enabled_from_env
+from fog_shed import AdmissionControl, Overloaded, StoreGuard
+from fog_store import FirestoreFogStore, create_store, store_spec_from_env, store_uses_firestore
+from fog_prefork import (
+    PreforkMaster, SharedTileCache, SharedVisitIndex, SharedWriteLog, bind_listener, index_request_pipe,
+    notify_ready, reuse_port_supported, run_index_process, shared_index_base, workers_from_env,
+)
+
+TILE_PATTERN = re.compile(r'/tiles/([^/]+)/(\d+)/(\d+)/(\d+)\.png')
+
+# 요청 헤더 개수 제한 (비정상 클라이언트 방어)
+MAX_HEADER_LINES = 100
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': '*',
+    'Access-Control-Expose-Headers': 'ETag, X-Fog-Bbox, X-Fog-Width, X-Fog-Version, X-Fog-Stale, Retry-After',
+}
+
+# fog level별 인코딩된 PNG 캐시 (디버그 모드가 아니면 모든 사용자가 공유)
+TILE_CACHE = RenderedTileCache(render_fog_level)
+DEBUG_TILES = debug_mode_enabled()
+
+# 타일 Cache-Control (FOG_TILE_MAX_AGE / FOG_TILE_SWR 환경변수로 조정)
+TILE_CACHE_CONTROL = cache_control_from_env()
+
+# SIGTERM 후 처리 중인 요청을 기다리는 최대 시간(초)
+DRAIN_TIMEOUT = 10.0
+
+
+class BadRequest(Exception):
+    """파싱할 수 없는 HTTP 요청"""
+
+    status = 400
+
+
+class PayloadTooLarge(BadRequest):
+    """본문이 MAX_INGEST_BODY보다 큰 요청 (본문을 읽지 않고 연결을 닫음)"""
+
+    status = 413
+
+
+class HttpRequest:
+    """파싱된 HTTP 요청 (요청 라인 + 헤더 + 본문)"""
+
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        parsed = urlparse(target)
+        self.path = parsed.path
+        self.query = parsed.query
+        self.route = 'not_found'  # 메트릭 route 라벨
+        self.client_host = None  # 클라이언트 주소 (handle_connection이 채움)
+        self.log_fields = {}
+
+    @property
+    def keep_alive(self):
+        """연결 유지 여부 (HTTP/1.1은 기본 유지, HTTP/1.0은 명시 요청 시에만)"""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+async def read_request(reader):
+    """스트림에서 HTTP 요청 하나를 읽음 (연결이 닫혔으면 None)"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise BadRequest(f"잘못된 요청 라인: {request_line!r}")
+    method, target, version = parts
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep:
+            raise BadRequest(f"잘못된 헤더: {line!r}")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise BadRequest("헤더가 너무 많습니다")
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise BadRequest("잘못된 Content-Length")
+    if length < 0:
+        raise BadRequest("잘못된 Content-Length")
+    if length > MAX_INGEST_BODY:
+        raise PayloadTooLarge(f"본문이 너무 큽니다 (최대 {MAX_INGEST_BODY} bytes)")
+    body = await reader.readexactly(length) if length > 0 else b''
+
+    return HttpRequest(method.upper(), target, version, headers, body)
+
+
+def build_response(status, headers, body, keep_alive):
+    """상태 라인 + 헤더 + 본문을 바이트로 직렬화"""
+    status = HTTPStatus(status)
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    merged = dict(CORS_HEADERS)
+    merged.update(headers)
+    if status != HTTPStatus.NOT_MODIFIED:
+        merged['Content-Length'] = str(len(body))
+    merged['Connection'] = 'keep-alive' if keep_alive else 'close'
+    lines.extend(f"{name}: {value}" for name, value in merged.items())
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+    return head + body
+
+
+def json_response(status, payload):
+    """JSON 응답 튜플 생성"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return status, {'Content-Type': 'application/json; charset=utf-8'}, body
+
+
+def vary_headers():
+    """WebP 협상을 하면 Accept에 따라 응답이 달라지므로 Vary 헤더 추가"""
+    return {'Vary': 'Accept'} if TILE_CACHE.encoder.webp else {}
+
+
+def not_modified(etag):
+    """304 Not Modified 응답 튜플 (본문 없음)"""
+    return 304, {'ETag': etag, 'Cache-Control': TILE_CACHE_CONTROL, **vary_headers()}, b''
+
+
+def viewport_not_modified(etag):
+    """뷰포트 304 응답 튜플 (뷰포트는 매번 재검증)"""
+    return 304, {'ETag': etag, 'Cache-Control': 'no-cache'}, b''
+
+
+def overloaded_response(error):
+    """과부하 거절 응답 튜플 (429: 사용자 한도, 503: 전체 한도/저장소 장애)"""
+    status, headers, body = json_response(error.status, {"error": str(error), "reason": error.reason})
+    headers.update({'Retry-After': str(error.retry_after), 'Cache-Control': 'no-store'})
+    return status, headers, body
+
+
+class AsyncFogTileServer:
+    """방문 기록 저장소(FogStore)를 공유하는 keep-alive 타일 서버"""
+
+    def __init__(self, store, concurrency=64, keepalive_timeout=15.0, debug_lines=(),
+                 visit_index=None, mask_renderer=None, admission=None, guard=None, groups=None):
+        self.store = store
+        self.admission = admission   # 전체/사용자별 동시 요청 한도 (None이면 제한 없음)
+        self.guard = guard           # 저장소 조회 기한 + stale 응답 (로컬 저장소면 None)
+        self.visit_index = visit_index
+        self.mask_renderer = mask_renderer
+        self.concurrency = concurrency
+        self.keepalive_timeout = keepalive_timeout
+        self.debug_lines = tuple(debug_lines)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.open_connections = 0
+        self.draining = False
+        self._idle_writers = set()  # 다음 요청을 기다리는 keep-alive 연결
+        self.prefetcher = None       # start_prefetcher() 후 주변 타일 미리 읽기
+        self.groups = groups if groups is not None else GroupDirectory()  # 그룹 ID → 멤버
+        self.composer = GroupComposer()  # 멤버 인덱스 → 그룹 합성 인덱스 캐시
+        self._group_builds = SingleFlight()  # 같은 그룹의 동시 합성은 하나로
+
+    async def handle_connection(self, reader, writer):
+        """연결 하나에서 keep-alive 동안 요청을 순서대로 처리"""
+        self.open_connections += 1
+        peer = writer.get_extra_info('peername')
+        client_host = peer[0] if peer else None
+        try:
+            while not self.draining:
+                self._idle_writers.add(writer)
+                try:
+                    request = await asyncio.wait_for(read_request(reader), self.keepalive_timeout)
+                except BadRequest as e:
+                    status, headers, body = json_response(e.status, {"error": str(e)})
+                    writer.write(build_response(status, headers, body, keep_alive=False))
+                    await writer.drain()
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                finally:
+                    self._idle_writers.discard(writer)
+                if request is None:
+                    break
+                request.client_host = client_host
+
+                started = time.perf_counter()
+                status = 0
+                IN_FLIGHT.inc()
+                try:
+                    status, headers, body = await self.route(request)
+                    keep_alive = request.keep_alive and not self.draining
+                    response = build_response(status, headers, body, keep_alive)
+                    if request.method == 'HEAD':
+                        response = response[:len(response) - len(body)]
+                    with stage_timer('write'):
+                        writer.write(response)
+                        await writer.drain()
+                finally:
+                    IN_FLIGHT.dec()
+                    self.observe_request(request, status, time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """처리 중인 요청이 끝날 때까지 대기 (유휴 keep-alive 연결은 바로 닫고, 이후 응답은 Connection: close)"""
+        self.draining = True
+        for writer in list(self._idle_writers):
+            writer.close()
+        deadline = time.monotonic() + timeout
+        while self.open_connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    @staticmethod
+    def observe_request(request, status, duration):
+        """요청 수/지연 메트릭 기록 + 샘플링 요청 로그"""
+        REQUESTS.inc(request.route, str(status))
+        REQUEST_LATENCY.observe(duration, request.route)
+        REQUEST_LOG.request(request.route, status, duration, **request.log_fields)
+
+    async def route(self, request):
+        """경로별 처리 → (status, headers, body)"""
+        if request.method == 'OPTIONS':
+            # CORS preflight 요청 처리
+            request.route = 'options'
+            return 200, {}, b''
+        if request.method == 'POST':
+            return await self.route_post(request)
+        if request.method not in ('GET', 'HEAD'):
+            return json_response(405, {"error": "Method Not Allowed"})
+
+        with stage_timer('route'):
+            match = TILE_PATTERN.match(request.path)
+            viewport_match = None if match else VIEWPORT_PATTERN.match(request.path)
+            group_match = GROUP_TILE_PATTERN.match(request.path)
+            group_viewport_match = GROUP_VIEWPORT_PATTERN.match(request.path)
+
+        if match:
+            request.route = 'tile'
+            user_id, zoom, x, y = match.groups()
+            request.log_fields = {"userId": user_id, "z": int(zoom), "x": int(x), "y": int(y)}
+            if_none_match = None if DEBUG_TILES else request.headers.get('if-none-match')
+            # Accept 헤더에 image/webp가 있으면 WebP (디버그 타일은 항상 PNG)
+            fmt = 'png' if DEBUG_TILES else TILE_CACHE.encoder.negotiate(request.headers.get('accept'))
+            return await self.admitted(user_id, self.handle_tile,
+                                       user_id, int(zoom), int(x), int(y), if_none_match, fmt)
+
+        if viewport_match:
+            request.route = 'viewport'
+            user_id, zoom = viewport_match.groups()
+            request.log_fields = {"userId": user_id, "z": int(zoom)}
+            return await self.admitted(user_id, self.handle_viewport, user_id, int(zoom), request.query,
+                                       request.headers.get('if-none-match'))
+
+        if group_match or group_viewport_match:
+            group_id = (group_match or group_viewport_match).group(1)
+            label = group_label(group_id, request.query)
+            if group_match:
+                request.route = 'group_tile'
+                _, zoom, x, y = group_match.groups()
+                request.log_fields = {"groupId": group_id, "z": int(zoom), "x": int(x), "y": int(y)}
+                if_none_match = None if DEBUG_TILES else request.headers.get('if-none-match')
+                fmt = 'png' if DEBUG_TILES else TILE_CACHE.encoder.negotiate(request.headers.get('accept'))
+                args = (self.handle_tile, label, int(zoom), int(x), int(y), if_none_match, fmt)
+            else:
+                request.route = 'group_viewport'
+                zoom = group_viewport_match.group(2)
+                request.log_fields = {"groupId": group_id, "z": int(zoom)}
+                args = (self.handle_viewport, label, int(zoom), request.query,
+                        request.headers.get('if-none-match'))
+            return await self.admitted(label, self.handle_group, request, group_id, *args)
+
+        if request.path == '/metrics':
+            request.route = 'metrics'
+            return 200, {'Content-Type': METRICS_CONTENT_TYPE}, REGISTRY.render().encode('utf-8')
+
+        if request.path == '/health':
+            request.route = 'health'
+            return json_response(200, {
+                "status": "ok",
+                "service": "fog-tile-server-async",
+                "inFlight": self.in_flight,
+                "connections": self.open_connections,
+                "concurrency": self.concurrency,
+                "visitIndex": self.visit_index.stats() if self.visit_index else None,
+                "admission": self.admission.stats() if self.admission else None,
+                "storeGuard": self.guard.stats() if self.guard else None,
+                "groups": self.composer.stats(),
+            })
+
+        return json_response(404, {"error": "Invalid tile URL format"})
+
+    async def admitted(self, user_id, handler, *args):
+        """동시 요청 한도 안이면 handler(*args) 실행, 넘으면 바로 429/503"""
+        if self.admission is None:
+            return await handler(*args)
+        try:
+            self.admission.acquire(user_id)
+        except Overloaded as e:
+            return overloaded_response(e)
+        try:
+            return await handler(*args)
+        finally:
+            self.admission.release(user_id)
+
+    async def handle_group(self, request, group_id, handler, *args):
+        """그룹 멤버를 찾아 handler(*args, members=멤버)로 처리 (없는 그룹 404, 잘못된 멤버 목록 400)"""
+        try:
+            members = self.groups.cached(group_id, request.query)
+            if members is None:
+                # Firestore fog_groups 문서 조회 (동기 클라이언트이므로 스레드에서)
+                with stage_timer('firestore'):
+                    members = await asyncio.to_thread(self.groups.members, group_id, request.query)
+        except GroupNotFound:
+            return json_response(404, {"error": f"Unknown group: {group_id}"})
+        except ValueError as e:
+            return json_response(400, {"error": str(e)})
+        except Exception as e:
+            REQUEST_LOG.error('group_error', groupId=group_id, error=str(e))
+            return json_response(500, {"error": f"Internal Server Error: {e}"})
+        request.log_fields["members"] = len(members)
+        return await handler(*args, members=members)
+
+    async def route_post(self, request):
+        """POST /visits/{userId}: GPS 궤적 일괄 반영"""
+        match = INGEST_PATTERN.match(request.path)
+        if not match:
+            return json_response(404, {"error": "Invalid URL"})
+        request.route = 'ingest'
+        user_id = match.group(1)
+        request.log_fields = {"userId": user_id}
+        if not authorized(request.headers.get('authorization'), request.client_host):
+            return json_response(401, {"error": "Unauthorized"})
+        try:
+            points = parse_points(request.body)
+        except ValueError as e:
+            return json_response(400, {"error": str(e)})
+
+        # 거리 계산(NumPy)과 저장소 읽기/쓰기(동기 클라이언트)는 스레드에서 실행
+        try:
+            with stage_timer('firestore'):
+                summary = await asyncio.to_thread(
+                    ingest_visits, self.store, user_id, points, self.visit_index)
+            if self.prefetcher is not None:
+                self.prefetcher.invalidate(user_id)
+        except Exception as e:
+            REQUEST_LOG.error('ingest_error', error=str(e), **request.log_fields)
+            return json_response(500, {"error": f"Internal Server Error: {e}"})
+        request.log_fields.update(points=summary["points"], written=summary["written"])
+        status, headers, body = json_response(200, summary)
+        headers['Cache-Control'] = 'no-store'
+        return status, headers, body
+
+    async def handle_tile(self, user_id, zoom, x, y, if_none_match=None, fmt='png', members=None):
+        """타일 요청 처리 (동시 처리 수는 semaphore로 제한, ETag 일치 시 304)
+
+        members를 주면 user_id는 그룹 이름이고, 멤버 합성 인덱스로 응답합니다.
+        """
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                # 방문 기록 버전이 클라이언트 ETag와 같으면 조회/렌더링 없이 304
+                with stage_timer('firestore'):
+                    if members is None:
+                        index = await self.ready_index(user_id)
+                    else:
+                        index = await self.group_index(members)
+                version = index.version_tag if index is not None else None
+                cached_level = version_matches(if_none_match, version, fmt)
+                if cached_level is not None:
+                    return not_modified(make_etag(cached_level, version, fmt))
+
+                # 미리 읽어 둔 level이 있으면 사용 (Firestore 조회/마스크 렌더링처럼 지연이 있을 때만)
+                prefetch = members is None and self.prefetch_wanted(index)
+                stale = False
+                with stage_timer('firestore'):
+                    fog_level = self.prefetcher.lookup(user_id, zoom, x, y, version) if prefetch else None
+                    if fog_level is None:
+                        if members is None:
+                            fog_level, stale = await self.get_fog_level(user_id, zoom, x, y)
+                        else:
+                            fog_level, stale = await self.get_group_fog_level(members, index, zoom, x, y)
+                        fog_level = normalize_fog_level(fog_level)
+                if prefetch:
+                    self.prefetcher.schedule(user_id, zoom, x, y, fmt, version)
+                if stale:
+                    # 마지막으로 알던 level: 클라이언트가 캐시/재검증하지 않도록 ETag 없이 응답
+                    with stage_timer('render'):
+                        tile_data = await self.generate_tile_image(x, y, zoom, user_id, fog_level, fmt)
+                    return 200, {'Content-Type': TILE_CONTENT_TYPES[fmt], 'Cache-Control': 'no-cache',
+                                 'X-Fog-Stale': '1', **vary_headers()}, tile_data
+                if self.mask_renderer is not None and index is not None:
+                    # 마스크 타일은 fog level이 같아도 내용이 다르므로 방문 버전으로만 비교
+                    etag = make_etag('m', version, fmt)
+                    with stage_timer('render'):
+                        tile_data = await self.generate_mask_tile(index, zoom, x, y, fog_level, fmt)
+                else:
+                    etag = make_etag(fog_level, version, fmt)
+                    if level_matches(if_none_match, fog_level, fmt):
+                        return not_modified(etag)
+                    with stage_timer('render'):
+                        tile_data = await self.generate_tile_image(x, y, zoom, user_id, fog_level, fmt)
+            except Overloaded as e:
+                return overloaded_response(e)
+            except Exception as e:
+                REQUEST_LOG.error('tile_error', userId=user_id, z=zoom, x=x, y=y, error=str(e))
+                return json_response(500, {"error": f"Internal Server Error: {e}"})
+            finally:
+                self.in_flight -= 1
+
+        if DEBUG_TILES:
+            # 디버그 타일은 타일마다 내용이 달라 캐시하지 않음
+            return 200, {'Content-Type': 'image/png', 'Cache-Control': 'no-cache'}, tile_data
+        headers = {'Content-Type': TILE_CONTENT_TYPES[fmt], 'Cache-Control': TILE_CACHE_CONTROL,
+                   'ETag': etag, **vary_headers()}
+        return 200, headers, tile_data
+
+    async def handle_viewport(self, user_id, zoom, query, if_none_match=None, members=None):
+        """뷰포트 범위의 fog level을 한 번에 응답 (JSON / 2비트 패킹 / RLE, ETag 일치 시 304)
+
+        members를 주면 user_id는 그룹 이름이고, 멤버 합성 인덱스로 응답합니다.
+        """
+        try:
+            viewport = Viewport.from_query(zoom, query)
+            fmt = parse_format(query)
+        except ValueError as e:
+            return json_response(400, {"error": str(e)})
+
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                with stage_timer('firestore'):
+                    if members is None:
+                        index = await self.ready_index(user_id)
+                    else:
+                        index = await self.group_index(members)
+                    # 방문 버전을 level보다 먼저 읽음 (사이에 바뀌면 다음 요청에서 다시 받음)
+                    version = index.version_tag if index is not None else None
+                    if version is not None and etag_matches(if_none_match, viewport_etag(fmt, version)):
+                        return viewport_not_modified(viewport_etag(fmt, version))
+                    stale = False
+                    if index is not None:
+                        levels = levels_from_index(index, viewport)
+                    elif members is not None:
+                        # 합성 인덱스를 못 쓰면 멤버별 저장소 조회 → 타일마다 최솟값
+                        results = await asyncio.gather(
+                            *(self.store_viewport_levels(member, viewport) for member in members))
+                        levels = min_levels([member_levels for member_levels, _ in results])
+                        stale = any(member_stale for _, member_stale in results)
+                    else:
+                        levels, stale = await self.store_viewport_levels(user_id, viewport)
+            except Overloaded as e:
+                return overloaded_response(e)
+            except Exception as e:
+                REQUEST_LOG.error('viewport_error', userId=user_id, z=zoom, error=str(e))
+                return json_response(500, {"error": f"Internal Server Error: {e}"})
+            finally:
+                self.in_flight -= 1
+
+        with stage_timer('encode'):
+            content_type, body, headers = encode_viewport(user_id, viewport, levels, fmt, version)
+        if stale:
+            headers['X-Fog-Stale'] = '1'
+        elif etag_matches(if_none_match, headers['ETag']):
+            return viewport_not_modified(headers['ETag'])
+        headers.update({'Content-Type': content_type, 'Cache-Control': 'no-cache'})
+        return 200, headers, body
+
+    async def store_viewport_levels(self, user_id, viewport):
+        """저장소에서 뷰포트 fog level 일괄 조회 → (levels, stale)"""
+        if self.guard is not None:
+            return await self.guard.viewport_levels_async(
+                lambda: self.store.viewport_levels_async(user_id, viewport), user_id, viewport)
+        return await self.store.viewport_levels_async(user_id, viewport), False
+
+    async def group_index(self, members):
+        """멤버 인덱스를 합성한 그룹 인덱스 (인덱스가 없거나 로딩 실패면 None → 멤버별 저장소 조회)
+
+        멤버 인덱스 로딩 대기와 합성(NumPy)은 스레드에서 하고, 같은 그룹의 동시 합성은 하나로 합칩니다.
+        """
+        if self.visit_index is None:
+            return None
+        indexes = member_indexes(self.visit_index, members, timeout=0)
+        if indexes is None:
+            indexes = await asyncio.to_thread(member_indexes, self.visit_index, members)
+            if indexes is None:
+                return None
+        group = self.composer.cached(members, indexes)
+        if group is not None:
+            return group
+        return await self._group_builds.do(
+            members, lambda: asyncio.to_thread(self.composer.composite, members, indexes))
+
+    async def get_group_fog_level(self, members, group, zoom, x, y):
+        """그룹 타일 fog level → (멤버 중 최솟값, stale) (합성 인덱스가 없으면 멤버마다 저장소 조회)"""
+        if group is not None:
+            return group.fog_level(zoom, x, y), False
+        results = await asyncio.gather(
+            *(self.get_store_fog_level(member, zoom, x, y) for member in members))
+        return (min(normalize_fog_level(level) for level, _ in results),
+                any(stale for _, stale in results))
+
+    def start_prefetcher(self):
+        """주변 타일 미리 읽기 스레드 시작 (동기 저장소 조회/마스크 렌더링은 작업 스레드에서)"""
+        self.prefetcher = TilePrefetcher(self.prefetch_load)
+        register_prefetcher(self.prefetcher)
+        return self.prefetcher
+
+    def prefetch_wanted(self, index):
+        """주변 타일 미리 읽기가 도움이 되는지 (인덱스/로컬 저장소 조회와 단색 타일은 µs 단위)"""
+        if self.prefetcher is None:
+            return False
+        if index is None:
+            # 저장소 장애로 호출을 멈춘 동안에는 미리 읽기도 하지 않음
+            return not self.store.is_local and not (self.guard is not None and self.guard.circuit_open)
+        return self.mask_renderer is not None
+
+    def prefetch_load(self, user_id, zoom, x, y, fmt):
+        """미리 읽기 작업 → (fog level, 방문 버전 또는 None) (로딩 중인 인덱스는 기다리지 않음)"""
+        index = self.visit_index.index_for(user_id) if self.visit_index is not None else None
+        if index is None or not index.ready.is_set():
+            return normalize_fog_level(self.store.fog_level(user_id, zoom, x, y)), None
+        version = index.version_tag
+        fog_level = normalize_fog_level(index.fog_level(zoom, x, y))
+        if self.mask_renderer is not None:
+            self.mask_renderer.tile_png(index, zoom, x, y, fog_level, fmt)
+        return fog_level, version
+
+    async def get_fog_level(self, user_id, zoom, x, y):
+        """타일의 fog level 확인 → (level, stale)
+
+        메모리 인덱스를 먼저 쓰고, 없으면 저장소를 비동기 조회합니다. Firestore 조회는 기한 안에
+        못 받으면 마지막으로 알던 level(stale=True)로, 그것도 없으면 Overloaded(503)로 끝납니다.
+        """
+        fog_level = await self.get_fog_level_from_index(user_id, zoom, x, y)
+        if fog_level is not None:
+            return fog_level, False
+        return await self.get_store_fog_level(user_id, zoom, x, y)
+
+    async def get_store_fog_level(self, user_id, zoom, x, y):
+        """저장소에서 직접 fog level 조회 → (level, stale) (기한/stale 처리는 get_fog_level 참고)"""
+        if self.guard is not None:
+            return await self.guard.fog_level_async(
+                lambda: self.store.fog_level_async(user_id, zoom, x, y), user_id, zoom, x, y)
+        try:
+            return await self.store.fog_level_async(user_id, zoom, x, y), False
+        except Exception as e:
+            REQUEST_LOG.error('store_error', store=self.store.kind, z=zoom, x=x, y=y, error=str(e))
+            return 3, False  # 오류 시 기본값 (검은색)
+
+    async def ready_index(self, user_id):
+        """첫 로딩이 끝난 사용자 인덱스 (로딩 대기는 스레드에서, 쓸 수 없으면 None)"""
+        if self.visit_index is None:
+            return None
+        index = self.visit_index.index_for(user_id)
+        if index is None:
+            return None
+        if not index.ready.is_set():
+            loaded = await asyncio.to_thread(index.ready.wait, self.visit_index.load_timeout)
+            if not loaded:
+                return None
+        return index
+
+    async def get_fog_level_from_index(self, user_id, zoom, x, y):
+        """스냅샷 리스너 인덱스 조회 (인덱스를 쓸 수 없으면 None)"""
+        index = await self.ready_index(user_id)
+        if index is None:
+            return None
+        return index.fog_level(zoom, x, y)
+
+    async def generate_tile_image(self, x, y, zoom, user_id, fog_level, fmt='png'):
+        """캐시된 타일 바이트 반환 (디버그 모드에서는 렌더링을 스레드풀로 넘김)"""
+        if not DEBUG_TILES:
+            return TILE_CACHE.get(normalize_fog_level(fog_level), fmt)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, render_debug_tile, fog_level, zoom, x, y, user_id, self.debug_lines)
+
+    async def generate_mask_tile(self, index, zoom, x, y, fog_level, fmt='png'):
+        """픽셀 마스크 타일 (캐시 적중은 바로 반환, NumPy 렌더링/인코딩은 스레드풀에서)"""
+        data = self.mask_renderer.cached_png(index, zoom, x, y, fmt)
+        if data is not None:
+            return data
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.mask_renderer.tile_png, index, zoom, x, y, fog_level, fmt)
+
+
+def initialize_firebase(auth):
+    """인증 방식에 맞게 Firebase Admin SDK 초기화"""
+    if auth == 'adc':
+        from fog_server_adc import initialize_firebase as init
+    else:
+        from fog_server_with_firestore import initialize_firebase as init
+    return init()
+
+
+async def serve(args, visit_index=None, sock=None, shared_cache=None, shared_writes=None, banner=True):
+    """asyncio 서버 시작
+
+    prefork 워커로 실행될 때는 공유 방문 인덱스(visit_index), fork 전에 연 리슨 소켓(sock,
+    SO_REUSEPORT를 못 쓸 때만), 워커 공유 타일 캐시(shared_cache), 워커 공유 쓰기 기록(shared_writes)을 받습니다.
+    """
+    # 로컬 저장소(memory/sqlite)는 Firebase 없이 동작하고 메모리 인덱스도 쓰지 않음
+    if store_uses_firestore(args.store):
+        from firebase_admin import firestore, firestore_async
+
+        if not initialize_firebase(args.auth):
+            print("❌ Firebase 초기화 실패로 서버를 시작할 수 없습니다")
+            return
+        batch_window = args.batch_window_ms / 1000.0 if args.batch_window_ms is not None else None
+        store = FirestoreFogStore(firestore.client(), firestore_async.client(),
+                                  batch=not args.no_batch, batch_window=batch_window)
+        if store.negative is not None:
+            store.negative.shared = shared_writes
+        register_lookup_stats(store)
+
+        # 스냅샷 리스너는 동기 클라이언트에서만 지원되므로 인덱스는 동기 클라이언트 사용
+        if not args.no_index and visit_index is None:
+            visit_index = VisitIndexRegistry(
+                store.db, max_users=args.index_max_users, snapshot_path=args.snapshot)
+    else:
+        try:
+            store = create_store(args.store)
+        except ValueError as e:
+            print(f"❌ 저장소 설정 오류: {e}")
+            return
+
+    # 마스크 모드는 방문 위치가 필요하므로 메모리 인덱스를 쓸 때만 동작 (디버그 모드 우선)
+    mask_renderer = None
+    if args.render == 'mask' and visit_index is not None and not DEBUG_TILES:
+        from fog_mask import FogMaskRenderer
+        mask_renderer = FogMaskRenderer(TILE_CACHE, metatile=args.metatile)
+        mask_renderer.shared = shared_cache
+
+    debug_lines = ("ADC Auth",) if args.auth == 'adc' else ()
+    admission = AdmissionControl(args.max_in_flight, args.max_user_in_flight)
+    guard = None
+    if not store.is_local:
+        guard = StoreGuard(None if args.store_deadline_ms is None else args.store_deadline_ms / 1000.0)
+    register_shedding(admission, guard)
+    groups = GroupDirectory(getattr(store, 'db', None), path=args.groups_file)
+    server = AsyncFogTileServer(
+        store,
+        concurrency=args.concurrency,
+        keepalive_timeout=args.keepalive_timeout,
+        debug_lines=debug_lines,
+        visit_index=visit_index,
+        mask_renderer=mask_renderer,
+        admission=admission,
+        guard=guard,
+        groups=groups,
+    )
+    register_groups(server.composer)
+    # 인코딩 설정 (옵션을 주지 않으면 FOG_PNG_COMPRESS / FOG_WEBP 환경변수)
+    TILE_CACHE.encoder = TileEncoder(png_compress=args.png_compress,
+                                     webp=False if args.no_webp else None)
+    TILE_CACHE.warm(FOG_LEVEL_COLORS)
+    register_tile_cache('flat', TILE_CACHE)
+    if mask_renderer is not None:
+        register_tile_cache('mask', mask_renderer)
+    if mask_renderer is not None and shared_cache is not None:
+        register_tile_cache('shared', shared_cache)
+    if visit_index is not None:
+        register_visit_index(visit_index)
+    if not args.no_prefetch:
+        server.start_prefetcher()
+
+    if sock is not None:
+        httpd = await asyncio.start_server(server.handle_connection, sock=sock)
+    else:
+        httpd = await asyncio.start_server(
+            server.handle_connection, args.host or None, args.port, backlog=args.backlog,
+            reuse_port=args.workers > 1)
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    notify_ready()
+    if not banner:
+        return await run_until_stopped(httpd, server, stop, visit_index, store)
+
+    workers = f", 워커 {args.workers}개" if args.workers > 1 else ""
+    print(f"✅ 서버가 포트 {args.port}에서 실행 중입니다 (asyncio, 동시 처리 {args.concurrency}{workers})")
+    print(f"🗄️ 방문 기록 저장소: {args.store}")
+    if getattr(store, 'batcher', None) is not None:
+        print(f"📦 타일 조회 묶음: {store.batcher.window * 1000:g}ms 동안 모아 get_all "
+              f"(최대 {store.batcher.max_batch}개)")
+    print(f"📡 URL 예시: http://localhost:{args.port}/tiles/USER_ID/15/26910/12667.png")
+    print(f"📈 메트릭: http://localhost:{args.port}/metrics" + (" (응답한 워커의 값)" if workers else ""))
+    print(ingest_banner())
+    print(f"🗜️ 타일 인코딩: {'/'.join(TILE_CACHE.encoder.formats)} "
+          f"(PNG 압축 레벨 {TILE_CACHE.encoder.png_compress})")
+    print(f"🚦 동시 요청 한도: 전체 {admission.max_in_flight or '∞'}, 사용자별 {admission.max_per_user or '∞'} "
+          f"(초과 시 503/429 + Retry-After {admission.retry_after}s)")
+    if guard is not None:
+        print(f"⏳ 저장소 조회 기한: {guard.deadline * 1000:g}ms (초과/장애 시 마지막 값 {guard.stale_ttl:g}초까지 stale 응답)")
+    group_source = "fog_groups 문서" if groups.db is not None else "그룹 파일"
+    print(f"👥 그룹 합성 타일: /groups/GROUP_ID/tiles/... ({group_source}, 최대 {groups.max_members}명) "
+          f"또는 /groups/_/tiles/...?users=A,B")
+    if server.prefetcher is not None:
+        print(f"🔮 주변 타일 미리 읽기: 주변 8개 + 다음 줌 자식 4개 (큐 {server.prefetcher.max_queue}개)")
+    if DEBUG_TILES:
+        print("🐞 디버그 타일 모드: 타일마다 좌표/사용자 정보를 렌더링합니다 (캐시 미사용)")
+    if mask_renderer is not None:
+        print(f"🎭 마스크 타일 모드: 방문 위치 반경 {mask_renderer.radius_m:.0f}m 픽셀 단위 렌더링 "
+              f"(메타타일 {mask_renderer.metatile}x{mask_renderer.metatile})")
+    print("🛑 서버 종료: Ctrl+C")
+    await run_until_stopped(httpd, server, stop, visit_index, store)
+
+
+async def run_until_stopped(httpd, server, stop, visit_index, store):
+    """SIGTERM까지 서비스 → 새 연결 중단 → 처리 중인 요청 마무리 → 정리"""
+    try:
+        async with httpd:
+            await httpd.start_serving()
+            await stop.wait()
+            httpd.close()
+            await server.drain()
+    finally:
+        if server.prefetcher is not None:
+            server.prefetcher.close()
+        if server.guard is not None:
+            server.guard.close()
+        if visit_index is not None:
+            visit_index.close()
+        store.close()
+
+
+def run_prefork(args):
+    """--workers N: 워커 프로세스 N개 (Firebase 초기화는 fork 이후 각 프로세스에서)
+
+    Firestore 스냅샷 리스너는 인덱스 프로세스 하나만 유지하고, 워커는 발행된 인덱스를
+    공유 메모리로 읽습니다 (SharedVisitIndex).
+    """
+    uses_index = store_uses_firestore(args.store) and not args.no_index
+    base_path = shared_index_base()
+    read_fd, write_fd = index_request_pipe()
+    shared_cache = SharedTileCache() if args.render == 'mask' and uses_index else None
+    shared_writes = SharedWriteLog() if store_uses_firestore(args.store) else None
+    sock = None
+    if not reuse_port_supported():
+        sock = bind_listener(args.host, args.port, args.backlog, reuse_port=False)
+
+    def make_registry():
+        from firebase_admin import firestore
+
+        if not initialize_firebase(args.auth):
+            raise RuntimeError("Firebase 초기화 실패")
+        return VisitIndexRegistry(
+            firestore.client(), max_users=args.index_max_users, snapshot_path=args.snapshot)
+
+    def run_worker(slot):
+        visit_index = SharedVisitIndex(base_path, write_fd) if uses_index else None
+        asyncio.run(serve(args, visit_index=visit_index, sock=sock,
+                          shared_cache=shared_cache, shared_writes=shared_writes, banner=slot == 0))
+
+    master = PreforkMaster(args.workers, run_worker, name='fog_server_async')
+    if uses_index:
+        master.add_service('index', lambda: run_index_process(make_registry, base_path, read_fd))
+    master.run()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio 기반 Fog of War 타일 서버")
+    parser.add_argument('--host', default='', help="바인드 주소 (기본: 모든 인터페이스)")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--auth', choices=['service-account', 'adc'], default='service-account',
+                        help="Firebase 인증 방식 (serviceAccountKey.json 또는 ADC)")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="동시에 처리할 최대 타일 요청 수")
+    parser.add_argument('--keepalive-timeout', type=float, default=15.0,
+                        help="유휴 keep-alive 연결을 닫기까지의 시간(초)")
+    parser.add_argument('--backlog', type=int, default=512)
+    parser.add_argument('--store', default=store_spec_from_env(),
+                        help="방문 기록 저장소: firestore | memory | sqlite:PATH (기본: FOG_STORE 또는 firestore)")
+    parser.add_argument('--workers', type=int, default=workers_from_env(),
+                        help="워커 프로세스 수 (기본: FOG_WORKERS 또는 1, 0이면 CPU 코어 수)")
+    parser.add_argument('--batch-window-ms', type=float, default=None,
+                        help="Firestore 타일 조회를 get_all로 묶는 시간 (기본: FOG_BATCH_WINDOW_MS 또는 2)")
+    parser.add_argument('--no-batch', action='store_true',
+                        help="타일 조회를 묶지 않고 타일마다 get() (같은 타일 동시 조회 합치기는 유지)")
+    parser.add_argument('--no-index', action='store_true',
+                        help="방문 타일 메모리 인덱스 없이 타일마다 Firestore 조회")
+    parser.add_argument('--index-max-users', type=int, default=1000,
+                        help="메모리 인덱스를 유지할 최대 사용자 수 (최근 사용 순)")
+    parser.add_argument('--snapshot', default=None,
+                        help="방문 타일 스냅샷 파일 (시작 시 mmap으로 열고 종료 시 저장)")
+    parser.add_argument('--render', choices=RENDER_MODES, default=render_mode_from_env(),
+                        help="타일 렌더링 방식 (flat: fog level 단색, mask: 방문 위치 픽셀 마스크)")
+    parser.add_argument('--metatile', type=int, default=None,
+                        help="마스크 모드에서 N x N 타일 블록을 한 번에 렌더링 (기본: FOG_METATILE 또는 1)")
+    parser.add_argument('--png-compress', type=int, choices=range(10), default=None, metavar='0-9',
+                        help="PNG zlib 압축 레벨 (기본: FOG_PNG_COMPRESS 또는 6)")
+    parser.add_argument('--no-webp', action='store_true',
+                        help="Accept: image/webp 요청에도 PNG로만 응답")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="워커당 동시 처리 타일/뷰포트 요청 한도, 넘으면 503 (기본: FOG_MAX_IN_FLIGHT 또는 256)")
+    parser.add_argument('--max-user-in-flight', type=int, default=None,
+                        help="사용자별 동시 처리 요청 한도, 넘으면 429 (기본: FOG_MAX_USER_IN_FLIGHT 또는 32)")
+    parser.add_argument('--store-deadline-ms', type=float, default=None,
+                        help="Firestore 조회 기한, 넘으면 마지막 값으로 응답 (기본: FOG_STORE_DEADLINE_MS 또는 800)")
+    parser.add_argument('--groups-file', default=None,
+                        help="그룹 정의 JSON 파일 {groupId: [userId, ...]} (기본: FOG_GROUPS_FILE)")
+    parser.add_argument('--no-prefetch', action='store_true', default=not prefetch_enabled_from_env(),
+                        help="응답한 타일 주변을 미리 읽지 않음 (기본: FOG_PREFETCH)")
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    return args
+
+
+def main():
+    """서버 시작"""
+    args = parse_args()
+    print("🚀 asyncio Fog of War 타일 서버 시작")
+    if args.workers > 1:
+        run_prefork(args)
+        print("\n🛑 서버 종료")
+        return
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n🛑 서버 종료")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,27 +5,81 @@ Firestore 연동 Fog of War 타일 서버
 이 서버는 Firebase Firestore에서 사용자의 방문 타일 정보를 읽어와서
 동적으로 타일을 생성합니다.
 
+방문 기록 저장소는 FOG_STORE 환경변수로 바꿀 수 있습니다 (fog_store.py 참고).
+    FOG_STORE=firestore (기본) | memory | sqlite:/path/to/fog.db
+로컬 저장소(memory/sqlite)를 쓰면 Firebase 초기화 없이 실행됩니다.
+fog_server_adc.py는 인증 방식(ADC)만 다르고 이 서버를 그대로 사용합니다.
+
+FOG_WORKERS=N 으로 실행하면 워커 프로세스 N개가 같은 포트를 나눠 처리합니다 (fog_prefork.py).
+Firestore 조회는 FOG_STORE_DEADLINE_MS(기본 800ms) 안에 못 받으면 마지막으로 알던 level을
+stale로 응답하고, 그것도 없으면 503 + Retry-After로 바로 응답합니다 (fog_shed.py).
+
 설치 요구사항:
 pip install firebase-admin pillow
 
 사용법:
 python fog_server_with_firestore.py
+python fog_server_with_firestore.py --profile 60   # 시작 후 60초 샘플링 프로파일 (fog_profile.py)
 
 URL 예시:
 http://localhost:8080/tiles/user123/15/26910/12667.png
+http://localhost:8080/groups/group1/tiles/15/26910/12667.png   (그룹 합성 타일, fog_group.py)
+POST http://localhost:8080/visits/user123   (GPS 궤적 일괄 반영, fog_ingest.py)
+http://localhost:8080/debug/profile?seconds=10   (관리자 전용 샘플링 프로파일, fog_profile.py)
 """
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
+import argparse
 import json
 import re
 from urllib.parse import urlparse
-from PIL import Image, ImageDraw
-import io
 import math
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime
 import os
+from fog_tiles import (
+    FOG_LEVEL_COLORS, TILE_CONTENT_TYPES, RenderedTileCache, debug_mode_enabled,
+    normalize_fog_level, render_debug_tile, render_fog_level, render_mode_from_env,
+)
+from fog_index import VisitIndexRegistry
+from fog_metrics import (
+    REQUEST_LOG, InstrumentedHandlerMixin, register_groups, register_lookup_stats, register_prefetcher,
+    register_shedding, register_tile_cache, register_visit_index, stage_timer,
+)
+from fog_http import cache_control_from_env, level_matches, make_etag, version_matches
+from fog_viewport import (
+    VIEWPORT_PATTERN, Viewport, encode_viewport, etag_matches, levels_from_index, parse_format,
+    viewport_etag,
+)
+from fog_group import (
+    GROUP_TILE_PATTERN, GROUP_VIEWPORT_PATTERN, GroupComposer, GroupDirectory, GroupNotFound,
+    group_label, member_indexes, min_levels,
+)
+from fog_ingest import INGEST_PATTERN, MAX_INGEST_BODY, authorized, ingest_banner, ingest_visits, parse_points
+from fog_prefetch import TilePrefetcher, prefetch_enabled_from_env
+from fog_profile import PROFILE_PATH, ProfileRun, add_profile_arguments
+from fog_shed import Overloaded, StoreGuard
+from fog_store import create_store, store_spec_from_env, store_uses_firestore
+from fog_prefork import (
+    PreforkMaster, SharedTileCache, SharedVisitIndex, SharedWriteLog, bind_listener, index_request_pipe,
+    reuse_port_supported, run_index_process, serve_http_until_term, shared_index_base,
+    worker_http_server, workers_from_env,
+)
+
+# fog level별 인코딩된 PNG 캐시 (디버그 모드가 아니면 모든 사용자가 공유)
+TILE_CACHE = RenderedTileCache(render_fog_level)
+DEBUG_TILES = debug_mode_enabled()
+
+# 타일 Cache-Control (FOG_TILE_MAX_AGE / FOG_TILE_SWR 환경변수로 조정)
+TILE_CACHE_CONTROL = cache_control_from_env()
+
+# FOG_RENDER_MODE=mask: 방문 위치 기준 픽셀 단위 마스크 타일 (NumPy 필요, 디버그 모드 우선)
+if render_mode_from_env() == 'mask' and not DEBUG_TILES:
+    from fog_mask import FogMaskRenderer
+    MASK_RENDERER = FogMaskRenderer(TILE_CACHE)
+else:
+    MASK_RENDERER = None
 
 # Firebase 초기화 (서비스 계정 키 필요)
 def initialize_firebase():
@@ -46,142 +100,606 @@ def initialize_firebase():
         print(f"❌ Firebase 초기화 실패: {e}")
         return False
 
-class FogTileHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """GET 요청 처리"""
-        path = self.path
-        
-        # CORS 헤더 추가
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
-        
-        # 타일 요청 URL 파싱: /tiles/{userId}/{zoom}/{x}/{y}.png
-        tile_pattern = r'/tiles/([^/]+)/(\d+)/(\d+)/(\d+)\.png'
-        match = re.match(tile_pattern, path)
+class FogTileHandler(InstrumentedHandlerMixin, BaseHTTPRequestHandler):
+    # main()에서 저장소 생성 후 설정 (요청마다 client를 새로 만들지 않음)
+    store = None
+    visit_index = None
+    prefetcher = None  # 주변 타일 미리 읽기 (FOG_PREFETCH=0이면 None)
+    guard = None  # 저장소 조회 기한 + stale 응답 (로컬 저장소면 None)
+    groups = None  # 그룹 ID → 멤버 (fog_group.py)
+    composer = None  # 멤버 인덱스 → 그룹 합성 인덱스 캐시
+    debug_lines = ()  # 디버그 타일에 추가로 그릴 줄 (예: 인증 방식)
+    
+    def handle_get(self):
+        """GET 요청 처리 (/metrics는 InstrumentedHandlerMixin이 처리)"""
+        with stage_timer('route'):
+            path = self.path
+            
+            # 타일 요청 URL 파싱: /tiles/{userId}/{zoom}/{x}/{y}.png
+            tile_pattern = r'/tiles/([^/]+)/(\d+)/(\d+)/(\d+)\.png'
+            match = re.match(tile_pattern, path)
+            
+            # 뷰포트 일괄 조회 URL 파싱: /viewport/{userId}/{zoom}?x0=&y0=&x1=&y1=
+            parsed = urlparse(path)
+            viewport_match = VIEWPORT_PATTERN.match(parsed.path)
+            
+            # 그룹 합성: /groups/{groupId}/tiles/{zoom}/{x}/{y}.png, /groups/{groupId}/viewport/{zoom}
+            group_match = GROUP_TILE_PATTERN.match(parsed.path)
+            group_viewport_match = GROUP_VIEWPORT_PATTERN.match(parsed.path)
         
         if match:
+            self.metrics_route = 'tile'
             user_id, zoom, x, y = match.groups()
             zoom, x, y = int(zoom), int(x), int(y)
-            
-            print(f"🎯 타일 요청: userId={user_id}, z={zoom}, x={x}, y={y}")
-            
-            try:
-                # Firestore에서 타일 정보 조회
-                fog_level = self.get_fog_level_from_firestore(user_id, zoom, x, y)
-                
-                # 타일 이미지 생성
-                tile_data = self.generate_tile_image(x, y, zoom, user_id, fog_level)
-                
-                # 응답 전송
-                self.send_response(200)
-                self.send_header('Content-Type', 'image/png')
-                self.send_header('Cache-Control', 'no-cache')  # 캐시 비활성화 (개발용)
-                self.end_headers()
-                self.wfile.write(tile_data)
-                
-            except Exception as e:
-                print(f"❌ 타일 생성 오류: {e}")
-                self.send_error(500, f"Internal Server Error: {e}")
+            self.log_fields = {"userId": user_id, "z": zoom, "x": x, "y": y}
+            self.handle_tile(user_id, zoom, x, y)
+        elif viewport_match:
+            self.metrics_route = 'viewport'
+            user_id, zoom = viewport_match.groups()
+            self.handle_viewport(user_id, int(zoom), parsed.query)
+        elif group_match:
+            self.metrics_route = 'group_tile'
+            group_id, zoom, x, y = group_match.groups()
+            zoom, x, y = int(zoom), int(x), int(y)
+            self.log_fields = {"z": zoom, "x": x, "y": y}
+            label = group_label(group_id, parsed.query)
+            self.handle_group(group_id, parsed.query, self.handle_tile, label, zoom, x, y)
+        elif group_viewport_match:
+            self.metrics_route = 'group_viewport'
+            group_id, zoom = group_viewport_match.groups()
+            label = group_label(group_id, parsed.query)
+            self.handle_group(group_id, parsed.query, self.handle_viewport, label, int(zoom), parsed.query)
         else:
             self.send_error(404, "Invalid tile URL format")
     
-    def do_OPTIONS(self):
-        """CORS preflight 요청 처리"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
-        self.end_headers()
+    def handle_group(self, group_id, query, handler, *args):
+        """그룹 멤버를 찾아 handler(*args, members=멤버)로 처리 (없는 그룹 404, 잘못된 멤버 목록 400)"""
+        try:
+            with stage_timer('firestore'):
+                members = self.groups.members(group_id, query)
+        except GroupNotFound:
+            self.send_error(404, "Unknown group", group_id)
+            return
+        except ValueError as e:
+            self.send_error(400, "Invalid group members", str(e))
+            return
+        except Exception as e:
+            REQUEST_LOG.error('group_error', groupId=group_id, error=str(e))
+            self.send_error(500, "Internal Server Error", str(e))
+            return
+        self.log_fields.update(groupId=group_id, members=len(members))
+        handler(*args, members=members)
     
-    def get_fog_level_from_firestore(self, user_id, zoom, x, y):
-        """Firestore에서 타일의 fog level 조회"""
+    def handle_tile(self, user_id, zoom, x, y, members=None):
+        """타일 요청 처리 (방문 버전/fog level ETag 일치 시 304)
+
+        members를 주면 user_id는 그룹 이름이고, 멤버 합성 인덱스로 응답합니다.
+        """
         try:
-            db = firestore.client()
-            
-            # 타일 ID 생성 (FogOfWarManager와 동일한 방식)
-            tile_id = f"{zoom}_{x}_{y}"
+            if_none_match = None if DEBUG_TILES else self.headers.get('If-None-Match')
+            # Accept 헤더에 image/webp가 있으면 WebP (디버그 타일은 항상 PNG)
+            fmt = 'png' if DEBUG_TILES else TILE_CACHE.encoder.negotiate(self.headers.get('Accept'))
             
-            # Firestore 경로: visits_tiles/{userId}/visited/{tileId}
-            doc_ref = db.collection('visits_tiles').document(user_id).collection('visited').document(tile_id)
-            doc = doc_ref.get()
+            # 방문 기록 버전이 클라이언트 ETag와 같으면 조회/렌더링 없이 304
+            with stage_timer('firestore'):
+                index = self.get_visit_index(user_id) if members is None else self.get_group_index(members)
+            version = index.version_tag if index is not None else None
+            cached_level = version_matches(if_none_match, version, fmt)
+            if cached_level is not None:
+                self.send_not_modified(make_etag(cached_level, version, fmt))
+                return
             
-            if doc.exists:
-                data = doc.to_dict()
-                fog_level = data.get('fogLevel', 3)  # 기본값: 3 (검은색)
-                visited_at = data.get('visitedAt')
-                distance = data.get('distance', 0)
-                
-                print(f"✅ Firestore 조회 성공: tileId={tile_id}, fogLevel={fog_level}, distance={distance:.3f}km")
-                return fog_level
+            # Firestore에서 타일 정보 조회 (미리 읽어 둔 level이 있으면 사용)
+            prefetch = members is None and self.prefetch_wanted(index)
+            stale = False
+            with stage_timer('firestore'):
+                fog_level = self.prefetcher.lookup(user_id, zoom, x, y, version) if prefetch else None
+                if fog_level is None:
+                    if members is None:
+                        fog_level, stale = self.get_fog_level(user_id, zoom, x, y)
+                    else:
+                        fog_level, stale = self.get_group_fog_level(members, index, zoom, x, y)
+                    fog_level = normalize_fog_level(fog_level)
+            if stale:
+                # 마지막으로 알던 level: 클라이언트가 캐시/재검증하지 않도록 ETag 없이 응답
+                with stage_timer('render'):
+                    tile_data = self.generate_tile_image(x, y, zoom, user_id, fog_level, fmt)
+            elif MASK_RENDERER is not None and index is not None:
+                # 마스크 타일은 fog level이 같아도 내용이 다르므로 방문 버전으로만 비교
+                etag = make_etag('m', version, fmt)
+                with stage_timer('render'):
+                    tile_data = MASK_RENDERER.tile_png(index, zoom, x, y, fog_level, fmt)
             else:
-                print(f"❌ Firestore에 타일 정보 없음: tileId={tile_id}")
-                return 3  # 방문하지 않은 타일 = 검은색
+                etag = make_etag(fog_level, version, fmt)
+                if level_matches(if_none_match, fog_level, fmt):
+                    self.send_not_modified(etag)
+                    return
                 
+                # 타일 이미지 생성
+                with stage_timer('render'):
+                    tile_data = self.generate_tile_image(x, y, zoom, user_id, fog_level, fmt)
+            
+            # 응답 전송
+            self.send_response(200)
+            self.send_header('Content-Type', TILE_CONTENT_TYPES[fmt])
+            self.send_header('Content-Length', str(len(tile_data)))
+            if DEBUG_TILES or stale:
+                self.send_header('Cache-Control', 'no-cache')  # 디버그/stale 타일은 캐시 안 함
+                if stale:
+                    self.send_header('X-Fog-Stale', '1')
+            else:
+                self.send_header('Cache-Control', TILE_CACHE_CONTROL)
+                self.send_header('ETag', etag)
+                self.send_vary()
+            self.end_headers()
+            self.write_body(tile_data)
+            self.log_fields["bytes"] = len(tile_data)
+            if prefetch:
+                self.prefetcher.schedule(user_id, zoom, x, y, fmt, version)
+            
+        except Overloaded as e:
+            self.send_overloaded(e)
         except Exception as e:
-            print(f"❌ Firestore 조회 오류: {e}")
-            return 3  # 오류 시 기본값
-    
-    def generate_tile_image(self, x, y, zoom, user_id, fog_level):
-        """fog_level에 따라 타일 이미지 생성"""
-        size = 256
-        img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
+            REQUEST_LOG.error('tile_error', error=str(e), **self.log_fields)
+            self.send_error(500, "Internal Server Error", str(e))
+    
+    def send_overloaded(self, error):
+        """과부하 거절 응답 (429: 사용자 한도, 503: 전체 한도/저장소 장애) + Retry-After"""
+        body = json.dumps({"error": str(error), "reason": error.reason}).encode('utf-8')
+        self.send_response(error.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Retry-After', str(error.retry_after))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.write_body(body)
+    
+    def handle_post(self):
+        """POST 요청 처리: /visits/{userId} GPS 궤적 일괄 반영 (fog_ingest.py)"""
+        ingest_match = INGEST_PATTERN.match(urlparse(self.path).path)
+        if not ingest_match:
+            self.send_error(404, "Invalid URL")
+            return
+        self.metrics_route = 'ingest'
+        user_id = ingest_match.group(1)
+        self.log_fields = {"userId": user_id}
         
-        # fog_level에 따른 색상 설정
-        if fog_level == 1:
-            # 완전히 탐색된 지역 - 투명 (지도가 완전히 보임)
-            pass  # 투명하게 유지
-            debug_color = "투명"
-        elif fog_level == 2:
-            # 부분적으로 탐색된 지역 - 연한 회색
-            draw.rectangle([0, 0, size, size], fill=(128, 128, 128, 80))
-            debug_color = "연한회색"
-        elif fog_level == 3:
-            # 미탐색 지역 - 검은색 (완전히 가림)
-            draw.rectangle([0, 0, size, size], fill=(0, 0, 0, 255))
-            debug_color = "검은색"
-        else:
-            # 알 수 없는 level - 기본 검은색
-            draw.rectangle([0, 0, size, size], fill=(0, 0, 0, 255))
-            debug_color = "기본검은색"
+        if not authorized(self.headers.get('Authorization'), self.client_address[0]):
+            self.send_error(401, "Unauthorized")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error(411, "Length Required")
+            return
+        if length < 0:
+            self.send_error(400, "Bad Request", "invalid Content-Length")
+            return
+        if length > MAX_INGEST_BODY:
+            self.send_error(413, "Payload Too Large", f"max {MAX_INGEST_BODY} bytes")
+            return
+        try:
+            points = parse_points(self.rfile.read(length))
+        except ValueError as e:
+            self.send_error(400, "Invalid visit points", str(e))
+            return
         
-        # 디버그 정보 표시 (개발용)
         try:
-            draw.text((10, 10), f"Z:{zoom} X:{x} Y:{y}", fill=(255, 255, 255, 255))
-            draw.text((10, 30), f"User:{user_id[:8]}...", fill=(255, 255, 255, 255))
-            draw.text((10, 50), f"Level:{fog_level} ({debug_color})", fill=(255, 255, 255, 255))
-        except:
-            pass  # 텍스트 렌더링 실패해도 무시
+            with stage_timer('firestore'):
+                summary = ingest_visits(self.store, user_id, points, self.visit_index)
+            if self.prefetcher is not None:
+                self.prefetcher.invalidate(user_id)
+        except Exception as e:
+            REQUEST_LOG.error('ingest_error', error=str(e), **self.log_fields)
+            self.send_error(500, "Internal Server Error", str(e))
+            return
+        self.log_fields.update(points=summary["points"], written=summary["written"])
         
-        # PNG 바이트로 변환
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        return img_byte_arr.getvalue()
+        body = json.dumps(summary).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.write_body(body)
+    
+    def handle_viewport(self, user_id, zoom, query, members=None):
+        """뷰포트 범위의 fog level을 한 번에 응답 (JSON / 2비트 패킹 / RLE, ETag 일치 시 304)
 
-def main():
-    """서버 시작"""
-    print("🚀 Firestore 연동 Fog of War 타일 서버 시작")
+        members를 주면 user_id는 그룹 이름이고, 멤버 합성 인덱스로 응답합니다.
+        """
+        try:
+            viewport = Viewport.from_query(zoom, query)
+            fmt = parse_format(query)
+        except ValueError as e:
+            self.send_error(400, "Invalid viewport", str(e))
+            return
+        
+        self.log_fields.update(userId=user_id, z=zoom, tiles=len(viewport))
+        if_none_match = self.headers.get('If-None-Match')
+        
+        try:
+            with stage_timer('firestore'):
+                # 방문 버전을 level보다 먼저 읽음 (사이에 바뀌면 다음 요청에서 다시 받음)
+                if members is None:
+                    index = self.get_visit_index(user_id)
+                else:
+                    index = self.get_group_index(members)
+                version = index.version_tag if index is not None else None
+                if version is not None and etag_matches(if_none_match, viewport_etag(fmt, version)):
+                    self.send_viewport_not_modified(viewport_etag(fmt, version))
+                    return
+                if members is None:
+                    levels, stale = self.get_viewport_fog_levels(user_id, viewport)
+                else:
+                    levels, stale = self.get_group_viewport_levels(members, index, viewport)
+            with stage_timer('encode'):
+                content_type, body, headers = encode_viewport(user_id, viewport, levels, fmt, version)
+        except Overloaded as e:
+            self.send_overloaded(e)
+            return
+        except Exception as e:
+            REQUEST_LOG.error('viewport_error', error=str(e), **self.log_fields)
+            self.send_error(500, "Internal Server Error", str(e))
+            return
+        if stale:
+            headers['X-Fog-Stale'] = '1'
+        elif etag_matches(if_none_match, headers['ETag']):
+            self.send_viewport_not_modified(headers['ETag'])
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.write_body(body)
+    
+    def send_viewport_not_modified(self, etag):
+        """뷰포트 304 응답 (뷰포트는 매번 재검증)"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
     
-    # Firebase 초기화
-    if not initialize_firebase():
-        print("❌ Firebase 초기화 실패로 서버를 시작할 수 없습니다")
+    def send_not_modified(self, etag):
+        """304 Not Modified 응답 (본문 없음)"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', TILE_CACHE_CONTROL)
+        self.send_vary()
+        self.end_headers()
+    
+    def send_vary(self):
+        """WebP 협상을 하면 Accept에 따라 응답이 달라지므로 Vary 헤더 추가"""
+        if TILE_CACHE.encoder.webp:
+            self.send_header('Vary', 'Accept')
+    
+    def end_headers(self):
+        """모든 응답(에러 포함)에 CORS 헤더 추가"""
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', '*')
+        self.send_header('Access-Control-Expose-Headers',
+                         'ETag, X-Fog-Bbox, X-Fog-Width, X-Fog-Version, X-Fog-Stale, Retry-After')
+        super().end_headers()
+    
+    def do_OPTIONS(self):
+        """CORS preflight 요청 처리"""
+        self.send_response(200)
+        self.end_headers()
+    
+    def get_visit_index(self, user_id):
+        """로딩이 끝난 사용자 방문 인덱스 (없으면 None → ETag는 fog level만 사용)"""
+        if self.visit_index is None:
+            return None
+        return self.visit_index.ready_index(user_id)
+    
+    def prefetch_wanted(self, index):
+        """주변 타일 미리 읽기가 도움이 되는지
+
+        인덱스/로컬 저장소 조회와 단색 타일은 µs 단위라 미리 읽을 필요가 없고,
+        Firestore 직접 조회(인덱스 없음)나 마스크 렌더링처럼 지연이 있을 때만 사용합니다.
+        """
+        if self.prefetcher is None:
+            return False
+        if index is None:
+            # 저장소 장애로 호출을 멈춘 동안에는 미리 읽기도 하지 않음
+            return not self.store.is_local and not (self.guard is not None and self.guard.circuit_open)
+        return MASK_RENDERER is not None
+    
+    def get_fog_level(self, user_id, zoom, x, y):
+        """타일의 fog level 조회 → (level, stale)
+
+        사용자별 메모리 인덱스(스냅샷 리스너)를 먼저 사용하고,
+        인덱스를 쓸 수 없을 때만 저장소(Firestore 문서 / 로컬 DB)를 직접 조회합니다.
+        Firestore 조회는 기한 안에 못 받으면 마지막으로 알던 level(stale=True)로,
+        그것도 없으면 Overloaded(503)로 끝납니다.
+        """
+        if self.visit_index is not None:
+            fog_level = self.visit_index.fog_level(user_id, zoom, x, y)
+            if fog_level is not None:
+                return fog_level, False
+        return self.get_store_fog_level(user_id, zoom, x, y)
+    
+    def get_store_fog_level(self, user_id, zoom, x, y):
+        """저장소에서 직접 fog level 조회 → (level, stale) (기한/stale 처리는 get_fog_level 참고)"""
+        if self.guard is not None:
+            fog_level, stale = self.guard.fog_level(
+                lambda: self.store.fog_level(user_id, zoom, x, y), user_id, zoom, x, y)
+            REQUEST_LOG.event('store_lookup', store=self.store.kind, z=zoom, x=x, y=y,
+                              fogLevel=fog_level, stale=stale)
+            return fog_level, stale
+        try:
+            fog_level = self.store.fog_level(user_id, zoom, x, y)
+            REQUEST_LOG.event('store_lookup', store=self.store.kind, z=zoom, x=x, y=y, fogLevel=fog_level)
+            return fog_level, False
+        except Exception as e:
+            REQUEST_LOG.error('store_error', store=self.store.kind, z=zoom, x=x, y=y, error=str(e))
+            return 3, False  # 오류 시 기본값 (검은색)
+    
+    def get_viewport_fog_levels(self, user_id, viewport):
+        """뷰포트 fog level 목록 → (levels, stale) (메모리 인덱스 우선, 없으면 저장소 일괄 조회)"""
+        if self.visit_index is not None:
+            index = self.visit_index.ready_index(user_id)
+            if index is not None:
+                return levels_from_index(index, viewport), False
+        return self.get_store_viewport_levels(user_id, viewport)
+    
+    def get_store_viewport_levels(self, user_id, viewport):
+        """저장소에서 뷰포트 fog level 일괄 조회 → (levels, stale)"""
+        if self.guard is not None:
+            return self.guard.viewport_levels(
+                lambda: self.store.viewport_levels(user_id, viewport), user_id, viewport)
+        return self.store.viewport_levels(user_id, viewport), False
+    
+    def get_group_index(self, members):
+        """멤버 인덱스를 합성한 그룹 인덱스 (인덱스가 없거나 로딩 실패면 None → 멤버별 저장소 조회)"""
+        if self.visit_index is None:
+            return None
+        indexes = member_indexes(self.visit_index, members)
+        if indexes is None:
+            return None
+        return self.composer.composite(members, indexes)
+    
+    def get_group_fog_level(self, members, group, zoom, x, y):
+        """그룹 타일 fog level → (멤버 중 최솟값, stale) (합성 인덱스가 없으면 멤버마다 저장소 조회)"""
+        if group is not None:
+            return group.fog_level(zoom, x, y), False
+        results = [self.get_store_fog_level(member, zoom, x, y) for member in members]
+        return (min(normalize_fog_level(level) for level, _ in results),
+                any(stale for _, stale in results))
+    
+    def get_group_viewport_levels(self, members, group, viewport):
+        """그룹 뷰포트 fog level 목록 → (levels, stale) (타일마다 멤버 중 최솟값)"""
+        if group is not None:
+            return levels_from_index(group, viewport), False
+        results = [self.get_store_viewport_levels(member, viewport) for member in members]
+        return min_levels([levels for levels, _ in results]), any(stale for _, stale in results)
+    
+    def generate_tile_image(self, x, y, zoom, user_id, fog_level, fmt='png'):
+        """fog_level에 따라 타일 이미지 생성
+
+        결과는 fog_level에만 의존하므로 캐시된 타일 바이트(fmt 형식)를 그대로 반환합니다.
+        디버그 모드(FOG_TILE_DEBUG=1)에서만 타일별 정보를 그려 매번 PNG로 인코딩합니다.
+        """
+        if not DEBUG_TILES:
+            return TILE_CACHE.get(normalize_fog_level(fog_level), fmt)
+        
+        return render_debug_tile(fog_level, zoom, x, y, user_id, extra_lines=self.debug_lines)
+
+def prefetch_load(user_id, zoom, x, y, fmt):
+    """미리 읽기 작업 (TilePrefetcher 작업 스레드) → (fog level, 방문 버전 또는 None)"""
+    index = FogTileHandler.visit_index.ready_index(user_id, 0) if FogTileHandler.visit_index else None
+    if index is None:
+        return normalize_fog_level(FogTileHandler.store.fog_level(user_id, zoom, x, y)), None
+    version = index.version_tag
+    fog_level = normalize_fog_level(index.fog_level(zoom, x, y))
+    if MASK_RENDERER is not None:
+        MASK_RENDERER.tile_png(index, zoom, x, y, fog_level, fmt)
+    return fog_level, version
+
+def start_prefetcher():
+    """FOG_PREFETCH가 켜져 있으면 주변 타일 미리 읽기 스레드 시작"""
+    if prefetch_enabled_from_env():
+        FogTileHandler.prefetcher = TilePrefetcher(prefetch_load)
+        register_prefetcher(FogTileHandler.prefetcher)
+
+def stop_prefetcher():
+    if FogTileHandler.prefetcher is not None:
+        FogTileHandler.prefetcher.close()
+
+def start_shedding(store):
+    """(Firestore 저장소면) 조회 기한/stale 응답 설정
+
+    동시 요청 한도(AdmissionControl)는 쓰지 않습니다: HTTPServer는 워커당 요청을 하나씩 처리하므로
+    처리 중인 요청이 1을 넘지 않고, 대기 중인 요청은 커널 accept 큐에 있어 셀 수 없습니다.
+    동기 서버의 지연 상한은 저장소 조회 기한(StoreGuard)이고, 동시 요청 한도는 asyncio 서버에만 있습니다.
+    """
+    FogTileHandler.guard = None if store.is_local else StoreGuard()
+    register_shedding(None, FogTileHandler.guard)
+
+def start_groups(db):
+    """그룹 합성 타일 설정 (그룹 정의: FOG_GROUPS_FILE / Firestore fog_groups 문서)"""
+    FogTileHandler.groups = GroupDirectory(db)
+    FogTileHandler.composer = GroupComposer()
+    register_groups(FogTileHandler.composer)
+
+def stop_shedding():
+    if FogTileHandler.guard is not None:
+        FogTileHandler.guard.close()
+
+def open_store(spec, initialize, init_hints=()):
+    """저장소 생성 (Firestore 저장소면 Firebase 초기화) → (store, db), 실패 시 (None, None)"""
+    db = None
+    if store_uses_firestore(spec):
+        if not initialize():
+            print("❌ Firebase 초기화 실패로 서버를 시작할 수 없습니다")
+            for hint in init_hints:
+                print(hint)
+            return None, None
+        db = firestore.client()
+    try:
+        return create_store(spec, db), db
+    except ValueError as e:
+        print(f"❌ 저장소 설정 오류: {e}")
+        return None, None
+
+def print_banner(port, spec, info_lines=(), workers=1):
+    """시작 안내 출력"""
+    print(f"✅ 서버가 포트 {port}에서 실행 중입니다" + (f" (워커 {workers}개)" if workers > 1 else ""))
+    print(f"🗄️ 방문 기록 저장소: {spec}")
+    print(f"📡 URL 예시: http://localhost:{port}/tiles/USER_ID/15/26910/12667.png")
+    print(f"🗺️ 뷰포트 예시: http://localhost:{port}/viewport/USER_ID/15?x0=26905&y0=12662&x1=26915&y1=12672")
+    print(f"👥 그룹 타일 예시: http://localhost:{port}/groups/_/tiles/15/26910/12667.png?users=USER1,USER2")
+    print(f"📈 메트릭: http://localhost:{port}/metrics" + (" (응답한 워커의 값)" if workers > 1 else ""))
+    print(f"🔬 프로파일: http://localhost:{port}{PROFILE_PATH}?seconds=10 (관리자 전용"
+          + (", 응답한 워커만)" if workers > 1 else ")"))
+    print(ingest_banner())
+    print(f"🗜️ 타일 인코딩: {'/'.join(TILE_CACHE.encoder.formats)} (PNG 압축 레벨 {TILE_CACHE.encoder.png_compress})")
+    for line in info_lines:
+        print(line)
+    if FogTileHandler.guard is not None:
+        print(f"⏳ 저장소 조회 기한: {FogTileHandler.guard.deadline * 1000:g}ms "
+              f"(초과/장애 시 마지막 값으로 stale 응답, 없으면 503 + Retry-After)")
+    if prefetch_enabled_from_env():
+        print("🔮 주변 타일 미리 읽기: 응답한 타일의 주변 8개 + 다음 줌 자식 4개 (FOG_PREFETCH=0으로 끄기)")
+    if DEBUG_TILES:
+        print("🐞 디버그 타일 모드: 타일마다 좌표/사용자 정보를 렌더링합니다 (캐시 미사용)")
+    if MASK_RENDERER is not None:
+        if not store_uses_firestore(spec):
+            print("⚠️ 마스크 타일은 Firestore 방문 인덱스가 필요합니다: 단색 타일로 응답합니다")
+        print(f"🎭 마스크 타일 모드: 방문 위치 반경 {MASK_RENDERER.radius_m:.0f}m 픽셀 단위 렌더링 "
+              f"(메타타일 {MASK_RENDERER.metatile}x{MASK_RENDERER.metatile})")
+    print("🛑 서버 종료: Ctrl+C")
+
+def run_prefork(spec, port, workers, initialize, init_hints=(), info_lines=(), args=None):
+    """FOG_WORKERS > 1: 워커 프로세스 N개가 SO_REUSEPORT로 같은 포트에서 처리
+
+    Firebase 초기화와 Firestore 클라이언트 생성은 fork 이후 각 프로세스에서 합니다.
+    방문 인덱스는 인덱스 프로세스 하나가 발행하고 워커는 공유 메모리로 읽습니다.
+    """
+    uses_firestore = store_uses_firestore(spec)
+    base_path = shared_index_base()
+    read_fd, write_fd = index_request_pipe()
+    listener = None if reuse_port_supported() else bind_listener('', port, reuse_port=False)
+    shared_cache = None
+    if MASK_RENDERER is not None:
+        shared_cache = MASK_RENDERER.shared = SharedTileCache()
+    write_log = SharedWriteLog() if uses_firestore else None  # 워커끼리 미방문 필터 갱신
+    TILE_CACHE.warm(FOG_LEVEL_COLORS)  # fork 전에 채워 두면 워커가 그대로 물려받음
+
+    def make_registry():
+        if not initialize():
+            raise RuntimeError("Firebase 초기화 실패")
+        return VisitIndexRegistry(firestore.client(), snapshot_path=os.environ.get('FOG_SNAPSHOT_PATH'))
+
+    def run_worker(slot):
+        store, db = open_store(spec, initialize, init_hints)
+        if store is None:
+            raise RuntimeError("저장소를 열 수 없습니다")
+        FogTileHandler.store = store
+        if uses_firestore:
+            if store.negative is not None:
+                store.negative.shared = write_log
+            FogTileHandler.visit_index = SharedVisitIndex(base_path, write_fd)
+            register_visit_index(FogTileHandler.visit_index)
+            register_lookup_stats(store)
+        register_tile_cache('flat', TILE_CACHE)
+        if MASK_RENDERER is not None:
+            register_tile_cache('mask', MASK_RENDERER)
+            register_tile_cache('shared', shared_cache)
+        start_prefetcher()
+        start_shedding(store)
+        start_groups(db)
+        profile = None
+        if args is not None and args.profile is not None:
+            # 워커마다 따로 샘플링하므로 출력 파일도 워커별
+            output = f"{args.profile_output}.{os.getpid()}" if args.profile_output else None
+            profile = ProfileRun(args.profile, output, args.profile_hz).start()
+        httpd = worker_http_server(port, FogTileHandler, listener)
+        try:
+            serve_http_until_term(httpd)
+        finally:
+            if profile is not None:
+                profile.finish()
+            stop_prefetcher()
+            stop_shedding()
+            if FogTileHandler.visit_index is not None:
+                FogTileHandler.visit_index.close()
+            store.close()
+
+    master = PreforkMaster(workers, run_worker, name='fog_server')
+    if uses_firestore:
+        master.add_service('index', lambda: run_index_process(make_registry, base_path, read_fd))
+    print_banner(port, spec, info_lines, workers)
+    master.run()
+    print("\n🛑 서버 종료")
+
+def parse_server_args(title):
+    """서버 CLI 옵션 (설정은 환경변수, 명령행은 --profile만)"""
+    parser = argparse.ArgumentParser(description=f'{title} Fog of War 타일 서버')
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def run_server(initialize, title, debug_lines=(), init_hints=(), info_lines=()):
+    """서버 시작 (initialize: Firestore 저장소일 때 호출할 Firebase 초기화 함수)"""
+    args = parse_server_args(title)
+    print(f"🚀 {title} Fog of War 타일 서버 시작")
+    
+    spec = store_spec_from_env()
+    port = 8080
+    FogTileHandler.debug_lines = tuple(debug_lines)
+    workers = workers_from_env()
+    if workers > 1:
+        run_prefork(spec, port, workers, initialize, init_hints, info_lines, args)
+        return
+    
+    # 저장소 선택 (Firestore일 때만 Firebase 초기화)
+    store, db = open_store(spec, initialize, init_hints)
+    if store is None:
         return
     
     # HTTP 서버 시작
-    port = 8080
     server_address = ('', port)
     httpd = HTTPServer(server_address, FogTileHandler)
+    TILE_CACHE.warm(FOG_LEVEL_COLORS)
+    FogTileHandler.store = store
+    # 스냅샷 리스너 인덱스는 Firestore 저장소에서만 사용 (로컬 저장소는 조회 자체가 µs 단위)
+    # FOG_SNAPSHOT_PATH를 지정하면 방문 타일 스냅샷으로 바로 시작하고 종료 시 저장
+    if db is not None:
+        FogTileHandler.visit_index = VisitIndexRegistry(
+            db, snapshot_path=os.environ.get('FOG_SNAPSHOT_PATH'))
+        register_visit_index(FogTileHandler.visit_index)
+        register_lookup_stats(store)
+    register_tile_cache('flat', TILE_CACHE)
+    if MASK_RENDERER is not None:
+        register_tile_cache('mask', MASK_RENDERER)
+    start_prefetcher()
+    start_shedding(store)
+    start_groups(db)
     
-    print(f"✅ 서버가 포트 {port}에서 실행 중입니다")
-    print(f"📡 URL 예시: http://localhost:{port}/tiles/USER_ID/15/26910/12667.png")
-    print("🛑 서버 종료: Ctrl+C")
+    print_banner(port, spec, info_lines)
+    profile = ProfileRun.from_args(args)
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 서버 종료")
+        if profile is not None:
+            profile.finish()
+        stop_prefetcher()
+        stop_shedding()
+        if FogTileHandler.visit_index is not None:
+            FogTileHandler.visit_index.close()
+        store.close()
         httpd.server_close()
 
+def main():
+    """서버 시작 (서비스 계정 키 인증)"""
+    run_server(initialize_firebase, "Firestore 연동")
+
 if __name__ == '__main__':
-    main()
+    main()
\ No newline at end of file
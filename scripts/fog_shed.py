@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+과부하 보호 (load shedding) + 마지막으로 알던 fog level 제공 (stale-while-revalidate)
+
+Firestore가 느려지거나 오류를 내면 타일 요청은 RPC 시간만큼 붙잡혀 있다가 level 3(검은색)으로
+응답했고, 그동안 요청이 계속 쌓였습니다. 여기서는 다음과 같이 지연 상한을 둡니다.
+
+- AdmissionControl: 서버 전체 / 사용자별 동시 처리 타일·뷰포트 요청 수 제한
+  사용자 한도 초과 → 429, 전체 한도 초과 → 503 (둘 다 Retry-After, 대기열에 쌓지 않고 바로 응답)
+  asyncio 서버 전용 (동기 HTTPServer는 워커당 요청을 하나씩 처리해 동시 처리 수가 1을 넘지 않음)
+- StoreGuard: 저장소 조회에 기한(deadline)을 두고, 기한 안에 못 받으면 마지막으로 알던 level을
+  stale로 응답 (X-Fog-Stale: 1). 기한이 지난 조회는 백그라운드에서 계속 진행되어 끝나면
+  마지막 값을 갱신합니다 (다음 요청부터 최신 값).
+  연속 실패가 failure_threshold번이면 cooldown 동안 저장소를 부르지 않고 (circuit breaker)
+  마지막 값으로만 응답하며, 마지막 값도 없으면 503 + Retry-After.
+- 로컬 저장소(memory/sqlite)는 조회가 µs 단위라 StoreGuard를 쓰지 않습니다.
+
+설정 (환경변수):
+    FOG_MAX_IN_FLIGHT        서버(워커) 전체 동시 처리 요청 수 (기본 256, 0이면 제한 없음)
+    FOG_MAX_USER_IN_FLIGHT   사용자별 동시 처리 요청 수 (기본 32, 0이면 제한 없음)
+    FOG_STORE_DEADLINE_MS    저장소 조회 기한 (기본 800)
+    FOG_STALE_TTL            마지막 값을 stale로 응답할 수 있는 시간 (초, 기본 600)
+    FOG_RETRY_AFTER          429/503 응답의 Retry-After (초, 기본 1)
+
+사용 예:
+    guard = StoreGuard()
+    level, stale = guard.fog_level(lambda: store.fog_level(user_id, z, x, y), user_id, z, x, y)
+    level, stale = await guard.fog_level_async(lambda: store.fog_level_async(user_id, z, x, y),
+                                               user_id, z, x, y)
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+DEFAULT_MAX_IN_FLIGHT = 256
+DEFAULT_MAX_USER_IN_FLIGHT = 32
+DEFAULT_DEADLINE = 0.8
+DEFAULT_STALE_TTL = 600.0
+DEFAULT_RETRY_AFTER = 1
+
+# 연속 실패(기한 초과/오류) 몇 번이면 저장소 호출을 멈출지, 멈추는 시간(초)
+FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 2.0
+
+# 동기 서버에서 기한이 지나도 계속 진행되는 조회 스레드 수 (다 차면 새 조회 없이 stale/503)
+MAX_BACKGROUND_LOOKUPS = 16
+
+# 마지막으로 알던 fog level 최대 항목 수 (사용자, z, x, y)
+MAX_LAST_KNOWN = 50000
+
+
+def _env_number(name, default, cast=float):
+    try:
+        return max(0, cast(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def retry_after_from_env():
+    return max(1, _env_number('FOG_RETRY_AFTER', DEFAULT_RETRY_AFTER, int))
+
+
+class Overloaded(Exception):
+    """요청을 처리하지 않고 바로 거절 (status: 429/503, retry_after: 초)"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(f"{reason} overloaded")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """서버 전체 / 사용자별 동시 처리 요청 수 제한 (스레드 안전)"""
+
+    def __init__(self, max_in_flight=None, max_per_user=None, retry_after=None):
+        self.max_in_flight = (_env_number('FOG_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT, int)
+                              if max_in_flight is None else max_in_flight)
+        self.max_per_user = (_env_number('FOG_MAX_USER_IN_FLIGHT', DEFAULT_MAX_USER_IN_FLIGHT, int)
+                             if max_per_user is None else max_per_user)
+        self.retry_after = retry_after_from_env() if retry_after is None else retry_after
+        self.in_flight = 0
+        self._users = {}  # user_id → 처리 중인 요청 수
+        self._lock = threading.Lock()
+        self.rejected = {'user': 0, 'global': 0}
+
+    def acquire(self, user_id):
+        """요청 시작 (한도를 넘으면 Overloaded, 성공하면 반드시 release)"""
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejected['global'] += 1
+                raise Overloaded(503, 'global', self.retry_after)
+            count = self._users.get(user_id, 0)
+            if self.max_per_user and count >= self.max_per_user:
+                self.rejected['user'] += 1
+                raise Overloaded(429, 'user', self.retry_after)
+            self._users[user_id] = count + 1
+            self.in_flight += 1
+
+    def release(self, user_id):
+        with self._lock:
+            self.in_flight -= 1
+            count = self._users.get(user_id, 0) - 1
+            if count > 0:
+                self._users[user_id] = count
+            else:
+                self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"inFlight": self.in_flight, "users": len(self._users),
+                    "maxInFlight": self.max_in_flight, "maxPerUser": self.max_per_user,
+                    "rejected": dict(self.rejected)}
+
+
+class StoreGuard:
+    """저장소 조회 기한 + 연속 실패 차단 + 마지막으로 알던 fog level
+
+    fog_level/fog_level_async → (level, stale), viewport_levels/_async → (levels, stale)
+    최신 값도 stale 값도 없으면 Overloaded(503).
+    """
+
+    def __init__(self, deadline=None, stale_ttl=None, retry_after=None,
+                 failure_threshold=FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN,
+                 max_entries=MAX_LAST_KNOWN, max_background=MAX_BACKGROUND_LOOKUPS):
+        self.deadline = (_env_number('FOG_STORE_DEADLINE_MS', DEFAULT_DEADLINE * 1000) / 1000.0
+                         if deadline is None else deadline)
+        self.stale_ttl = _env_number('FOG_STALE_TTL', DEFAULT_STALE_TTL) if stale_ttl is None else stale_ttl
+        self.retry_after = retry_after_from_env() if retry_after is None else retry_after
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_entries = max_entries
+        self.max_background = max_background
+        self._levels = OrderedDict()  # (user_id, z, x, y) → (level, 저장 시각)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0        # 이 시각까지 저장소 호출 중단
+        self._executor = None         # 동기 조회 스레드 (처음 사용할 때 생성)
+        self._background = 0          # 진행 중인 동기 조회 수
+        self._tasks = set()           # 기한이 지나 계속 진행 중인 비동기 조회 (GC 방지)
+        self.timeouts = 0             # 기한 초과 수
+        self.errors = 0               # 저장소 오류 수
+        self.stale = 0                # stale 값으로 응답한 수
+        self.unavailable = 0          # 최신/stale 값이 없어 503으로 응답한 수
+
+    # ---- 마지막으로 알던 level ----
+
+    def remember(self, user_id, levels):
+        """{(z, x, y): level} 저장 (조회 성공 시, 기한이 지난 백그라운드 조회 포함)"""
+        now = time.monotonic()
+        with self._lock:
+            for (zoom, x, y), level in levels.items():
+                key = (user_id, zoom, x, y)
+                self._levels[key] = (level, now)
+                self._levels.move_to_end(key)
+            while len(self._levels) > self.max_entries:
+                self._levels.popitem(last=False)
+
+    def last_known(self, user_id, zoom, x, y):
+        """stale_ttl 안에 저장된 level (없으면 None)"""
+        with self._lock:
+            entry = self._levels.get((user_id, zoom, x, y))
+        if entry is None or time.monotonic() - entry[1] > self.stale_ttl:
+            return None
+        return entry[0]
+
+    # ---- 연속 실패 차단 ----
+
+    def _available(self):
+        """저장소를 불러도 되는지 (차단 중이면 cooldown마다 한 번만 시험 호출)"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            if self._failures >= self.failure_threshold:
+                self._open_until = now + self.cooldown  # 시험 호출 하나만 통과
+            return True
+
+    def _succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._open_until = 0.0
+
+    def _failed(self, timeout):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.errors += 1
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+
+    @property
+    def circuit_open(self):
+        with self._lock:
+            return time.monotonic() < self._open_until
+
+    def _fallback(self, user_id, tiles):
+        """최신 값을 못 받았을 때: 모든 타일의 stale 값 → (levels, True), 하나라도 없으면 Overloaded"""
+        levels = []
+        for zoom, x, y in tiles:
+            level = self.last_known(user_id, zoom, x, y)
+            if level is None:
+                with self._lock:
+                    self.unavailable += 1
+                    remaining = self._open_until - time.monotonic()
+                raise Overloaded(503, 'backend', max(self.retry_after, math.ceil(remaining)))
+            levels.append(level)
+        with self._lock:
+            self.stale += 1
+        return levels, True
+
+    # ---- 동기 조회 (HTTPServer 핸들러) ----
+
+    def _call(self, fetch, user_id, tiles, to_levels):
+        """fetch()를 조회 스레드에서 실행하고 deadline까지 기다림 → (levels, stale)"""
+        if not self._available():
+            return self._fallback(user_id, tiles)
+        with self._lock:
+            if self._background >= self.max_background:
+                busy = True
+            else:
+                busy = False
+                self._background += 1
+        if busy:
+            return self._fallback(user_id, tiles)  # 조회 스레드가 모두 멈춰 있음
+
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_background, thread_name_prefix='fog-store')
+        timed_out = threading.Event()
+        future = self._executor.submit(fetch)
+        future.add_done_callback(lambda done: self._finished(done, user_id, tiles, to_levels, timed_out))
+        try:
+            return to_levels(future.result(timeout=self.deadline)), False
+        except FutureTimeout:
+            timed_out.set()
+            self._failed(timeout=True)
+        except Exception:
+            pass  # 오류 집계는 _finished에서
+        return self._fallback(user_id, tiles)
+
+    def _finished(self, future, user_id, tiles, to_levels, timed_out):
+        """조회 완료 (기한 안/밖 모두): 성공하면 마지막 값 갱신"""
+        with self._lock:
+            self._background -= 1
+        if future.exception() is not None:
+            if not timed_out.is_set():
+                self._failed(timeout=False)  # 기한 초과는 이미 집계
+            return
+        if not timed_out.is_set():
+            # 기한이 지나 끝난 조회는 마지막 값만 갱신 (느린 저장소가 차단을 풀지 않도록)
+            self._succeeded()
+        self.remember(user_id, dict(zip(tiles, to_levels(future.result()))))
+
+    def fog_level(self, fetch, user_id, zoom, x, y):
+        """fetch() → level (동기 저장소 조회)"""
+        levels, stale = self._call(fetch, user_id, [(zoom, x, y)], lambda level: [level])
+        return levels[0], stale
+
+    def viewport_levels(self, fetch, user_id, viewport):
+        """fetch() → 뷰포트 level 목록 (행 우선)"""
+        tiles = [(viewport.zoom, x, y) for x, y in viewport.tiles()]
+        return self._call(fetch, user_id, tiles, list)
+
+    # ---- 비동기 조회 (asyncio 서버) ----
+
+    async def _call_async(self, fetch, user_id, tiles, to_levels):
+        if not self._available():
+            return self._fallback(user_id, tiles)
+        task = asyncio.ensure_future(fetch())
+        try:
+            # shield: 기한이 지나도 조회는 계속되어 끝나면 마지막 값을 갱신
+            result = await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except asyncio.TimeoutError:
+            self._failed(timeout=True)
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: self._finished_async(done, user_id, tiles, to_levels))
+            return self._fallback(user_id, tiles)
+        except Exception:
+            self._failed(timeout=False)
+            return self._fallback(user_id, tiles)
+        self._succeeded()
+        levels = to_levels(result)
+        self.remember(user_id, dict(zip(tiles, levels)))
+        return levels, False
+
+    def _finished_async(self, task, user_id, tiles, to_levels):
+        self._tasks.discard(task)
+        if task.cancelled() or task.exception() is not None:
+            return  # 기한 초과로 이미 실패 집계
+        # 마지막 값만 갱신 (느린 저장소가 차단을 풀지 않도록 성공으로 세지 않음)
+        self.remember(user_id, dict(zip(tiles, to_levels(task.result()))))
+
+    async def fog_level_async(self, fetch, user_id, zoom, x, y):
+        """await fetch() → level (비동기 저장소 조회)"""
+        levels, stale = await self._call_async(fetch, user_id, [(zoom, x, y)], lambda level: [level])
+        return levels[0], stale
+
+    async def viewport_levels_async(self, fetch, user_id, viewport):
+        tiles = [(viewport.zoom, x, y) for x, y in viewport.tiles()]
+        return await self._call_async(fetch, user_id, tiles, list)
+
+    def stats(self):
+        with self._lock:
+            return {"timeouts": self.timeouts, "errors": self.errors, "stale": self.stale,
+                    "unavailable": self.unavailable, "background": self._background + len(self._tasks),
+                    "remembered": len(self._levels),
+                    "circuitOpen": time.monotonic() < self._open_until}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
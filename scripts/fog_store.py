@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+방문 타일 저장소 (fog store) 인터페이스
+
+타일 서버는 저장소 종류를 모르고 FogStore 메서드만 호출합니다.
+- FirestoreFogStore: visits_tiles/{userId}/visited/{tileId} 문서 (동기/비동기 클라이언트)
+                     비동기 조회는 같은 조회를 합치고(singleflight) 짧은 시간 동안 들어온
+                     타일 조회를 get_all 한 번으로 묶음 (fog_batch.py)
+                     사용자별 Bloom 필터로 미방문이 확실한 타일은 조회하지 않음 (fog_negative.py)
+- MemoryFogStore:    프로세스 메모리 dict (테스트/벤치마크용)
+- SqliteFogStore:    로컬 SQLite 파일, (user_id, z, x, y) 클러스터드 기본 키
+                     → 타일 한 장은 키 조회, 뷰포트는 (user_id, z, x 범위) 범위 스캔
+
+FOG_STORE 환경변수 (또는 --store 옵션) 형식:
+    firestore (기본) | memory | sqlite:/path/to/fog.db
+
+로컬 저장소 만들기 / 확인:
+    python fog_store.py import fog.db          # Firestore 전체 방문 기록 → SQLite
+    python fog_store.py info fog.db
+    python fog_store.py bench fog.db [조회 수]   # 타일/뷰포트 조회 지연 측정
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from fog_batch import FirestoreLookupBatcher, SingleFlight
+from fog_index import parse_tile_key, tile_key, visit_location
+from fog_negative import NegativeTileCache, negative_cache_enabled_from_env
+from fog_tiles import normalize_fog_level
+from fog_viewport import fetch_levels, fetch_levels_async, fetch_tile_levels
+
+DEFAULT_FOG_LEVEL = 3
+
+STORE_KINDS = ('firestore', 'memory', 'sqlite')
+
+
+def _visited_at_seconds(value):
+    """visitedAt(Timestamp/datetime/숫자) → epoch 초 (없으면 None)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    timestamp = getattr(value, 'timestamp', None)
+    return timestamp() if callable(timestamp) else None
+
+
+def _firestore_document(data):
+    """location이 {'latitude', 'longitude'} dict면 앱과 같은 GeoPoint로 변환"""
+    location = data.get('location')
+    if not isinstance(location, dict):
+        return data
+    try:
+        from google.cloud.firestore import GeoPoint
+    except ImportError:
+        return data  # 메모리 Firestore 대역 (fog_fake_firestore.py)
+    return dict(data, location=GeoPoint(location['latitude'], location['longitude']))
+
+
+class FogStore:
+    """방문 타일 저장소 기본 클래스
+
+    is_local이 True면 조회가 프로세스 안에서 끝나므로(µs) 이벤트 루프에서 바로 호출해도 됩니다.
+    """
+
+    kind = None
+    is_local = True
+
+    def fog_level(self, user_id, zoom, x, y):
+        """타일 fog level (방문 기록이 없으면 3)"""
+        raise NotImplementedError
+
+    def viewport_levels(self, user_id, viewport):
+        """뷰포트 타일들의 fog level 목록 (행 우선)"""
+        return [self.fog_level(user_id, viewport.zoom, x, y) for x, y in viewport.tiles()]
+
+    def fog_levels(self, user_id, tile_ids):
+        """여러 타일의 fog level {tile_id: level} (방문 기록이 없는 타일은 3)"""
+        levels = {}
+        for tile_id in tile_ids:
+            coords = parse_tile_key(tile_id)
+            levels[tile_id] = DEFAULT_FOG_LEVEL if coords is None else self.fog_level(user_id, *coords)
+        return levels
+
+    async def fog_level_async(self, user_id, zoom, x, y):
+        return self.fog_level(user_id, zoom, x, y)
+
+    async def viewport_levels_async(self, user_id, viewport):
+        return self.viewport_levels(user_id, viewport)
+
+    def put(self, user_id, zoom, x, y, data):
+        """방문 문서 하나 저장 (Firestore 문서와 같은 필드: fogLevel, location, visitedAt ...)"""
+        self.put_many([(user_id, tile_key(zoom, x, y), data)])
+
+    def put_many(self, docs):
+        """[(user_id, tile_id, 문서 dict), ...] 일괄 저장 → 저장한 문서 수 (잘못된 타일 ID는 건너뜀)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FirestoreFogStore(FogStore):
+    """Firestore 문서 저장소 (async_db를 주면 비동기 조회 지원)
+
+    batch_window: 비동기 타일 조회를 모으는 시간(초, None이면 FOG_BATCH_WINDOW_MS),
+    batch=False면 타일마다 get() (같은 타일의 동시 조회 합치기는 그대로)
+    negative: 미방문 타일 Bloom 필터 사용 여부 (None이면 FOG_NEGATIVE_CACHE)
+    """
+
+    kind = 'firestore'
+    is_local = False
+
+    def __init__(self, db, async_db=None, batch=True, batch_window=None, negative=None):
+        self.db = db
+        self.async_db = async_db
+        if negative is None:
+            negative = negative_cache_enabled_from_env()
+        self.negative = NegativeTileCache(db) if negative else None
+        self.flights = SingleFlight()
+        self.batcher = None
+        if async_db is not None and batch:
+            self.batcher = FirestoreLookupBatcher(async_db, window=batch_window)
+
+    def _doc_ref(self, db, user_id, tile_id):
+        # Firestore 경로: visits_tiles/{userId}/visited/{tileId}
+        return db.collection('visits_tiles').document(user_id).collection('visited').document(tile_id)
+
+    def _skip(self, user_id):
+        """미방문이 확실한 타일 판별 함수 (필터를 쓰지 않으면 None)"""
+        if self.negative is None:
+            return None
+        return lambda tile_id: self.negative.definitely_unvisited(user_id, tile_id)
+
+    def fog_level(self, user_id, zoom, x, y):
+        tile_id = tile_key(zoom, x, y)
+        if self.negative is not None and self.negative.definitely_unvisited(user_id, tile_id):
+            return DEFAULT_FOG_LEVEL
+        doc = self._doc_ref(self.db, user_id, tile_id).get()
+        if not doc.exists:
+            return DEFAULT_FOG_LEVEL  # 방문하지 않은 타일 = 검은색
+        return (doc.to_dict() or {}).get('fogLevel', DEFAULT_FOG_LEVEL)
+
+    def viewport_levels(self, user_id, viewport):
+        return fetch_levels(self.db, user_id, viewport, self._skip(user_id))
+
+    def fog_levels(self, user_id, tile_ids):
+        found = fetch_tile_levels(self.db, user_id, tile_ids, self._skip(user_id))
+        return {tile_id: found.get(tile_id, DEFAULT_FOG_LEVEL) for tile_id in tile_ids}
+
+    async def fog_level_async(self, user_id, zoom, x, y):
+        tile_id = tile_key(zoom, x, y)
+        if self.negative is not None and self.negative.definitely_unvisited(user_id, tile_id):
+            return DEFAULT_FOG_LEVEL
+        if self.batcher is not None:
+            lookup = lambda: self.batcher.fog_level(user_id, tile_id)
+        else:
+            lookup = lambda: self._get_level_async(user_id, tile_id)
+        return await self.flights.do(('tile', user_id, tile_id), lookup)
+
+    async def _get_level_async(self, user_id, tile_id):
+        doc = await self._doc_ref(self.async_db, user_id, tile_id).get()
+        if not doc.exists:
+            return DEFAULT_FOG_LEVEL
+        return (doc.to_dict() or {}).get('fogLevel', DEFAULT_FOG_LEVEL)
+
+    async def viewport_levels_async(self, user_id, viewport):
+        key = ('viewport', user_id, viewport.zoom, viewport.x0, viewport.y0, viewport.x1, viewport.y1)
+        return await self.flights.do(
+            key, lambda: fetch_levels_async(self.async_db, user_id, viewport, self._skip(user_id)))
+
+    def lookup_stats(self):
+        """비동기 조회 합치기/묶음 통계"""
+        stats = {"executed": self.flights.executed, "merged": self.flights.merged}
+        if self.batcher is not None:
+            stats.update(self.batcher.stats())
+        if self.negative is not None:
+            stats["negative"] = self.negative.stats()
+        return stats
+
+    def put_many(self, docs):
+        if self.negative is not None:
+            # 쓰기 전에 필터에 먼저 추가 (쓰는 도중 조회가 "미방문"으로 답하지 않도록)
+            for user_id, tile_id, _ in docs:
+                self.negative.add(user_id, [tile_id])
+        batch = self.db.batch()
+        count = 0
+        for user_id, tile_id, data in docs:
+            batch.set(self._doc_ref(self.db, user_id, tile_id), _firestore_document(data), merge=True)
+            count += 1
+            if count % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.commit()
+        return count
+
+    def close(self):
+        if self.negative is not None:
+            self.negative.close()
+
+
+class MemoryFogStore(FogStore):
+    """프로세스 메모리 저장소: user_id → {(z, x, y): fog level}"""
+
+    kind = 'memory'
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def fog_level(self, user_id, zoom, x, y):
+        return self._users.get(user_id, {}).get((zoom, x, y), DEFAULT_FOG_LEVEL)
+
+    def put_many(self, docs):
+        count = 0
+        with self._lock:
+            for user_id, tile_id, data in docs:
+                coords = parse_tile_key(tile_id)
+                if coords is not None:
+                    level = data.get('fogLevel', DEFAULT_FOG_LEVEL)
+                    self._users.setdefault(user_id, {})[coords] = level
+                    count += 1
+        return count
+
+    def __len__(self):
+        return sum(len(tiles) for tiles in self._users.values())
+
+
+class SqliteFogStore(FogStore):
+    """로컬 SQLite 저장소 (WITHOUT ROWID 테이블 = 기본 키 순서로 클러스터링)
+
+    스레드마다 연결을 따로 엽니다 (HTTPServer/스레드풀에서 공유 가능).
+    """
+
+    kind = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fog_tiles (
+            user_id    TEXT    NOT NULL,
+            z          INTEGER NOT NULL,
+            x          INTEGER NOT NULL,
+            y          INTEGER NOT NULL,
+            fog_level  INTEGER NOT NULL,
+            latitude   REAL,
+            longitude  REAL,
+            visited_at REAL,
+            PRIMARY KEY (user_id, z, x, y)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def fog_level(self, user_id, zoom, x, y):
+        row = self._connection().execute(
+            'SELECT fog_level FROM fog_tiles WHERE user_id=? AND z=? AND x=? AND y=?',
+            (user_id, zoom, x, y)).fetchone()
+        return row[0] if row is not None else DEFAULT_FOG_LEVEL
+
+    def viewport_levels(self, user_id, viewport):
+        """(user_id, z, x 범위) 범위 스캔 한 번으로 뷰포트 전체 조회"""
+        rows = self._connection().execute(
+            'SELECT x, y, fog_level FROM fog_tiles '
+            'WHERE user_id=? AND z=? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?',
+            (user_id, viewport.zoom, viewport.x0, viewport.x1, viewport.y0, viewport.y1))
+        levels = [DEFAULT_FOG_LEVEL] * len(viewport)
+        for x, y, level in rows:
+            levels[(y - viewport.y0) * viewport.width + (x - viewport.x0)] = normalize_fog_level(level)
+        return levels
+
+    def put_many(self, docs):
+        rows = []
+        for user_id, tile_id, data in docs:
+            coords = parse_tile_key(tile_id)
+            if coords is None:
+                continue
+            location = visit_location(data) or (None, None)
+            rows.append((user_id, *coords, data.get('fogLevel', DEFAULT_FOG_LEVEL),
+                         location[0], location[1], _visited_at_seconds(data.get('visitedAt'))))
+        conn = self._connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO fog_tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def user_ids(self):
+        """저장된 사용자 ID 목록"""
+        return [row[0] for row in self._connection().execute(
+            'SELECT DISTINCT user_id FROM fog_tiles ORDER BY user_id')]
+
+    def user_documents(self, user_id):
+        """사용자의 방문 기록 → (타일 ID, Firestore 문서와 같은 형식의 dict) 목록 (내보내기용)"""
+        rows = self._connection().execute(
+            'SELECT z, x, y, fog_level, latitude, longitude FROM fog_tiles WHERE user_id=?', (user_id,))
+        docs = []
+        for z, x, y, level, lat, lon in rows:
+            data = {'fogLevel': level}
+            if lat is not None and lon is not None:
+                data['location'] = {'latitude': lat, 'longitude': lon}
+            docs.append((tile_key(z, x, y), data))
+        return docs
+
+    def stats(self):
+        conn = self._connection()
+        users, tiles = conn.execute(
+            'SELECT COUNT(DISTINCT user_id), COUNT(*) FROM fog_tiles').fetchone()
+        return {"users": users, "tiles": tiles}
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __len__(self):
+        return self.stats()["tiles"]
+
+
+def store_spec_from_env():
+    """FOG_STORE 환경변수 (기본 firestore)"""
+    return os.environ.get('FOG_STORE', 'firestore')
+
+
+def store_uses_firestore(spec):
+    return spec.split(':', 1)[0] == 'firestore'
+
+
+def create_store(spec, db=None, async_db=None):
+    """저장소 지정 문자열로 FogStore 생성 (firestore는 db 필요)"""
+    kind, _, arg = spec.partition(':')
+    if kind == 'firestore':
+        if db is None:
+            raise ValueError("firestore 저장소에는 Firestore 클라이언트가 필요합니다")
+        return FirestoreFogStore(db, async_db)
+    if kind == 'memory':
+        return MemoryFogStore()
+    if kind == 'sqlite':
+        if not arg:
+            raise ValueError("sqlite 저장소는 파일 경로가 필요합니다 (예: sqlite:fog.db)")
+        return SqliteFogStore(arg)
+    raise ValueError(f"알 수 없는 저장소: {spec} ({', '.join(STORE_KINDS)})")
+
+
+def import_from_firestore(db, store):
+    """Firestore의 모든 visits_tiles/*/visited 문서를 저장소로 복사"""
+    docs = []
+    count = 0
+    for doc in db.collection_group('visited').stream():
+        user_ref = doc.reference.parent.parent
+        if user_ref is None or user_ref.parent.id != 'visits_tiles':
+            continue
+        docs.append((user_ref.id, doc.id, doc.to_dict() or {}))
+        if len(docs) >= 5000:
+            count += store.put_many(docs)
+            docs = []
+    if docs:
+        count += store.put_many(docs)
+    return count
+
+
+def _bench(store, lookups):
+    """타일 키 조회 / 뷰포트 범위 스캔 지연 측정"""
+    from fog_viewport import Viewport
+    conn = store._connection()
+    sample = conn.execute(
+        'SELECT user_id, z, x, y FROM fog_tiles ORDER BY random() LIMIT ?', (lookups,)).fetchall()
+    if not sample:
+        print("❌ 저장소가 비어 있습니다")
+        return
+
+    started = time.perf_counter()
+    for user_id, z, x, y in sample:
+        store.fog_level(user_id, z, x, y)
+    single = (time.perf_counter() - started) / len(sample)
+
+    started = time.perf_counter()
+    for user_id, z, x, y in sample:
+        store.viewport_levels(user_id, Viewport(z, max(0, x - 2), max(0, y - 4), x + 2, y + 3))
+    viewport = (time.perf_counter() - started) / len(sample)
+
+    print(f"⏱️ 타일 조회 {single * 1e6:.1f}µs, 5x8 뷰포트 조회 {viewport * 1e6:.1f}µs "
+          f"({len(sample)}회 평균)")
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('import', 'info', 'bench'):
+        print("Usage: python fog_store.py import|info|bench <sqlite_path> [조회 수]")
+        sys.exit(1)
+    command, path = sys.argv[1], sys.argv[2]
+    store = SqliteFogStore(path)
+
+    if command == 'import':
+        from firebase_admin import firestore
+        from fog_server_with_firestore import initialize_firebase
+        if not initialize_firebase():
+            sys.exit(1)
+        count = import_from_firestore(firestore.client(), store)
+        print(f"✅ SQLite 저장소로 복사 완료: {path} ({count}개 문서)")
+    elif command == 'info':
+        stats = store.stats()
+        print(f"📊 사용자 {stats['users']}명, 타일 {stats['tiles']}개, 파일 {os.path.getsize(path)} bytes")
+    else:
+        _bench(store, int(sys.argv[3]) if len(sys.argv) > 3 else 10000)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
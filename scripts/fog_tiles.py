@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Fog of War 타일 렌더링 / 인코딩 캐시
+
+타일 이미지는 fog level에만 의존하므로 level별로 한 번만 렌더링하고
+PNG 인코딩 결과(bytes)를 그대로 재사용합니다.
+
+인코딩 (TileEncoder):
+- 색이 256개 이하인 타일(단색 fog 타일, 마스크 타일)은 팔레트 PNG로 저장
+  (단색은 1비트, tRNS로 투명도 보존) → 단색 타일 ~850 bytes → ~120 bytes
+- 클라이언트 Accept 헤더에 image/webp가 있으면 무손실 WebP로 응답 (~40 bytes)
+
+설정 (환경변수):
+    FOG_PNG_COMPRESS   PNG zlib 압축 레벨 0~9 (기본 6, 9는 마스크 타일 ~10% 작고 인코딩 ~6배 느림)
+    FOG_WEBP           0이면 WebP 응답 끔 (기본 켜짐, Pillow WebP 지원 필요)
+    FOG_WEBP_METHOD    WebP 압축 노력 0~6 (기본 2, 높여도 fog 타일 크기는 거의 같음)
+
+타일마다 좌표/사용자 정보를 그려 넣는 디버그 모드는
+FOG_TILE_DEBUG=1 환경변수로 명시적으로 켜야 하며, 이 경우에만 매 요청 렌더링합니다.
+
+사용 예:
+    cache = RenderedTileCache(render_fog_level)
+    fmt = cache.encoder.negotiate(self.headers.get('Accept'))
+    self.wfile.write(cache.get(fog_level, fmt))
+"""
+
+import io
+import os
+import threading
+from PIL import Image, ImageDraw, features
+from fog_metrics import stage_timer
+
+TILE_SIZE = 256
+
+# Firestore fogLevel → RGBA 색상 (1=투명, 2=연한 회색, 3=검은색)
+FOG_LEVEL_COLORS = {
+    1: (0, 0, 0, 0),
+    2: (128, 128, 128, 80),
+    3: (0, 0, 0, 255),
+}
+
+FOG_LEVEL_LABELS = {
+    1: "투명",
+    2: "연한회색",
+    3: "검은색",
+}
+
+DEFAULT_FOG_LEVEL = 3
+
+RENDER_MODES = ('flat', 'mask')
+
+# 타일 출력 형식 → Content-Type
+TILE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+DEFAULT_PNG_COMPRESS = 6
+DEFAULT_WEBP_METHOD = 2
+
+
+def debug_mode_enabled():
+    """FOG_TILE_DEBUG 환경변수로 디버그 타일 모드 여부 확인"""
+    return os.environ.get('FOG_TILE_DEBUG', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def render_mode_from_env():
+    """FOG_RENDER_MODE 환경변수로 타일 렌더링 방식 확인 (flat: fog level 단색, mask: 픽셀 마스크)"""
+    mode = os.environ.get('FOG_RENDER_MODE', 'flat').lower()
+    return mode if mode in RENDER_MODES else 'flat'
+
+
+def normalize_fog_level(fog_level):
+    """알 수 없는 fogLevel은 기본값(3, 검은색)으로 취급"""
+    return fog_level if fog_level in FOG_LEVEL_COLORS else DEFAULT_FOG_LEVEL
+
+
+def render_fog_level(fog_level):
+    """fog_level에 해당하는 단색 타일 이미지 생성"""
+    color = FOG_LEVEL_COLORS[normalize_fog_level(fog_level)]
+    return Image.new('RGBA', (TILE_SIZE, TILE_SIZE), color)
+
+
+def _env_int(name, default, low, high):
+    try:
+        return min(high, max(low, int(os.environ.get(name, default))))
+    except ValueError:
+        return default
+
+
+def png_compress_from_env():
+    """FOG_PNG_COMPRESS 환경변수 (zlib 레벨 0~9)"""
+    return _env_int('FOG_PNG_COMPRESS', DEFAULT_PNG_COMPRESS, 0, 9)
+
+
+def webp_enabled_from_env():
+    """FOG_WEBP 환경변수 (기본 켜짐, Pillow에 WebP 지원이 없으면 항상 꺼짐)"""
+    if os.environ.get('FOG_WEBP', '1').lower() in ('0', 'false', 'no', 'off'):
+        return False
+    return features.check('webp')
+
+
+def webp_method_from_env():
+    """FOG_WEBP_METHOD 환경변수 (압축 노력 0~6)"""
+    return _env_int('FOG_WEBP_METHOD', DEFAULT_WEBP_METHOD, 0, 6)
+
+
+def accepts_webp(accept):
+    """Accept 헤더에 image/webp가 q>0으로 명시되어 있는지 (image/* 와일드카드는 무시)"""
+    if not accept:
+        return False
+    for item in accept.split(','):
+        media_type, *params = item.strip().split(';')
+        if media_type.strip().lower() != 'image/webp':
+            continue
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def to_palette(img):
+    """색이 256개 이하인 RGBA 이미지 → 팔레트(P) 이미지 (색이 그대로 보존될 때만, 아니면 None)"""
+    if img.mode == 'P':
+        return img
+    if img.mode != 'RGBA':
+        return None
+    colors = img.getcolors(256)
+    if colors is None:
+        return None
+    if len(colors) == 1:
+        # 단색 타일: 팔레트 한 칸 + tRNS 알파
+        r, g, b, a = colors[0][1]
+        palette_img = Image.new('P', img.size, 0)
+        palette_img.putpalette((r, g, b), rawmode='RGB')
+        palette_img.info['transparency'] = bytes((a,))
+        return palette_img
+    palette_img = img.quantize(colors=len(colors), method=Image.Quantize.FASTOCTREE,
+                               dither=Image.Dither.NONE)
+    if palette_img.convert('RGBA').tobytes() != img.tobytes():
+        return None  # 팔레트로 정확히 표현되지 않으면 RGBA 유지
+    return palette_img
+
+
+def _palette_bits(img):
+    """팔레트 크기에 맞는 PNG 비트 깊이 (1/2/4/8)"""
+    count = len(img.getpalette() or ()) // 3
+    for bits in (1, 2, 4):
+        if count <= 1 << bits:
+            return bits
+    return 8
+
+
+class TileEncoder:
+    """타일 이미지 → 팔레트 PNG / 무손실 WebP 바이트"""
+
+    def __init__(self, png_compress=None, webp=None, webp_method=None):
+        self.png_compress = png_compress_from_env() if png_compress is None else png_compress
+        self.webp = webp_enabled_from_env() if webp is None else (webp and features.check('webp'))
+        self.webp_method = webp_method_from_env() if webp_method is None else webp_method
+
+    @property
+    def formats(self):
+        """지원하는 출력 형식"""
+        return ('png', 'webp') if self.webp else ('png',)
+
+    def negotiate(self, accept):
+        """Accept 헤더로 응답 형식 결정 (WebP를 명시한 클라이언트만 WebP)"""
+        return 'webp' if self.webp and accepts_webp(accept) else 'png'
+
+    def encode(self, img, fmt='png'):
+        """PIL 이미지를 fmt 형식 바이트로 변환"""
+        buffer = io.BytesIO()
+        with stage_timer('encode'):
+            if fmt == 'webp':
+                if img.mode != 'RGBA':
+                    img = img.convert('RGBA')
+                img.save(buffer, format='WEBP', lossless=True, method=self.webp_method,
+                         exact=True)
+            else:
+                palette_img = to_palette(img)
+                if palette_img is not None:
+                    palette_img.save(buffer, format='PNG', compress_level=self.png_compress,
+                                     bits=_palette_bits(palette_img))
+                else:
+                    img.save(buffer, format='PNG', compress_level=self.png_compress)
+        return buffer.getvalue()
+
+
+# 환경변수 설정을 따르는 기본 인코더
+TILE_ENCODER = TileEncoder()
+
+
+def encode_png(img):
+    """PIL 이미지를 PNG 바이트로 변환 (가능하면 팔레트 PNG)"""
+    return TILE_ENCODER.encode(img, 'png')
+
+
+def render_debug_tile(fog_level, zoom, x, y, user_id, extra_lines=()):
+    """디버그 모드 타일: 좌표/사용자/level 정보를 그려 넣은 PNG 바이트 (캐시 불가)"""
+    img = render_fog_level(fog_level)
+    draw = ImageDraw.Draw(img)
+    debug_color = FOG_LEVEL_LABELS.get(fog_level, "기본검은색")
+    lines = [
+        f"Z:{zoom} X:{x} Y:{y}",
+        f"User:{user_id[:8]}...",
+        f"Level:{fog_level} ({debug_color})",
+        *extra_lines,
+    ]
+    try:
+        for i, line in enumerate(lines):
+            draw.text((10, 10 + 20 * i), line, fill=(255, 255, 255, 255))
+    except:
+        pass  # 텍스트 렌더링 실패해도 무시
+    return encode_png(img)
+
+
+class RenderedTileCache:
+    """키(fog level 등)와 출력 형식별로 인코딩된 타일 바이트를 보관하는 캐시
+
+    render_func(key)는 PIL 이미지를 반환해야 하며, 키/형식마다 최초 1회만 호출됩니다.
+    키 공간이 작다는 전제(fog level 몇 종류)이므로 별도 eviction은 없습니다.
+    """
+
+    def __init__(self, render_func, encoder=None):
+        self._render_func = render_func
+        self.encoder = encoder or TILE_ENCODER
+        self._tiles = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fmt='png'):
+        """키에 해당하는 타일 바이트 반환 (없으면 렌더링 후 저장)"""
+        data = self._tiles.get((key, fmt))
+        if data is not None:
+            self.hits += 1
+            return data
+
+        with self._lock:
+            data = self._tiles.get((key, fmt))
+            if data is None:
+                data = self.encoder.encode(self._render_func(key), fmt)
+                self._tiles[(key, fmt)] = data
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def warm(self, keys):
+        """서버 시작 시 지원하는 모든 형식으로 미리 렌더링해 두기"""
+        for key in keys:
+            for fmt in self.encoder.formats:
+                self.get(key, fmt)
+
+    def __len__(self):
+        return len(self._tiles)
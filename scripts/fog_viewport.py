@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+뷰포트 단위 fog level 일괄 조회
+
+화면에 보이는 타일마다 /tiles/... 요청과 Firestore 조회를 하는 대신
+타일 범위(bbox) 전체의 fog level을 한 번에 돌려줍니다.
+
+URL 형식:
+    /viewport/{userId}/{zoom}?x0=26900&y0=12660&x1=26915&y1=12670&format=json
+
+- x0..x1, y0..y1: 타일 좌표 범위 (양 끝 포함)
+- format=json (기본): {"grid": "3332...", ...} 행 우선(row-major), 타일당 한 글자
+- format=bin: 타일당 2비트로 패킹한 바이트열 (한 바이트에 4타일, 하위 비트부터)
+- format=rle: 같은 level이 이어지는 구간(run)마다 varint 하나 (아래 참고)
+  대부분 검은 지도는 뷰포트 전체가 3바이트 안팎 → 클라이언트가 받아서 직접 래스터화
+
+RLE 형식 (행 우선 순서의 level 배열을 run으로 나눔):
+    run마다 (길이 << 2 | level)을 LEB128 varint로 기록 (7비트씩, 하위부터, 상위 비트 = 계속)
+    예: 64x64 전체가 level 3 → (4096 << 2 | 3) = 16387 → b'\x83\x80\x01'
+
+버전: 응답마다 ETag를 붙이고 If-None-Match가 같으면 304 (본문 없음)
+- 방문 인덱스가 있으면 사용자 방문 버전(UserVisitIndex.version_tag)으로 만들어
+  조회 없이 304 응답 (X-Fog-Version 헤더로도 전달)
+- 인덱스가 없으면(로컬 저장소 등) level 배열의 CRC32로 만든 ETag
+"""
+
+import json
+import re
+import zlib
+from itertools import groupby
+from urllib.parse import parse_qs
+from fog_index import tile_key
+from fog_tiles import normalize_fog_level
+
+VIEWPORT_PATTERN = re.compile(r'/viewport/([^/]+)/(\d+)$')
+
+MAX_ZOOM = 30
+
+# 한 번에 조회할 수 있는 최대 타일 수 (64 x 64)
+MAX_VIEWPORT_TILES = 4096
+
+# Firestore get_all 한 번에 묶을 문서 수
+GET_ALL_CHUNK_SIZE = 300
+
+VIEWPORT_FORMATS = ('json', 'bin', 'rle')
+
+
+class Viewport:
+    """줌 레벨 + 타일 좌표 범위 (양 끝 포함)"""
+
+    def __init__(self, zoom, x0, y0, x1, y1):
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom은 0~{MAX_ZOOM} 범위여야 합니다: {zoom}")
+        limit = 1 << zoom
+        if not (0 <= x0 <= x1 < limit and 0 <= y0 <= y1 < limit):
+            raise ValueError(f"타일 범위가 올바르지 않습니다: z={zoom} x={x0}..{x1} y={y0}..{y1}")
+        self.zoom = zoom
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.width = x1 - x0 + 1
+        self.height = y1 - y0 + 1
+        if self.width * self.height > MAX_VIEWPORT_TILES:
+            raise ValueError(f"한 번에 최대 {MAX_VIEWPORT_TILES}개 타일까지 조회할 수 있습니다")
+
+    @classmethod
+    def from_query(cls, zoom, query):
+        """쿼리 문자열(x0, y0, x1, y1)에서 Viewport 생성 (잘못되면 ValueError)"""
+        params = parse_qs(query)
+        try:
+            coords = [int(params[name][0]) for name in ('x0', 'y0', 'x1', 'y1')]
+        except (KeyError, ValueError):
+            raise ValueError("x0, y0, x1, y1 쿼리 파라미터(정수)가 필요합니다")
+        return cls(zoom, *coords)
+
+    def tiles(self):
+        """(x, y) 좌표를 행 우선 순서로 반환"""
+        return [(x, y)
+                for y in range(self.y0, self.y1 + 1)
+                for x in range(self.x0, self.x1 + 1)]
+
+    def tile_ids(self):
+        return [tile_key(self.zoom, x, y) for x, y in self.tiles()]
+
+    def __len__(self):
+        return self.width * self.height
+
+
+def parse_format(query):
+    """format 쿼리 파라미터 확인 (기본 json)"""
+    fmt = parse_qs(query).get('format', ['json'])[0]
+    if fmt not in VIEWPORT_FORMATS:
+        raise ValueError(f"지원하지 않는 format: {fmt} ({', '.join(VIEWPORT_FORMATS)})")
+    return fmt
+
+
+def levels_from_index(index, viewport):
+    """메모리 인덱스에서 뷰포트 fog level 목록 생성"""
+    return [normalize_fog_level(index.fog_level(viewport.zoom, x, y))
+            for x, y in viewport.tiles()]
+
+
+def _visited_refs(db, user_id, tile_ids):
+    visited = db.collection('visits_tiles').document(user_id).collection('visited')
+    return [visited.document(tile_id) for tile_id in tile_ids]
+
+
+def _levels_from_snapshots(tile_ids, found):
+    return [normalize_fog_level(found.get(tile_id, 3)) for tile_id in tile_ids]
+
+
+def _lookup_ids(tile_ids, skip):
+    """skip(tile_id)이 True인 타일(미방문이 확실한 타일)은 조회하지 않음"""
+    return [tile_id for tile_id in tile_ids if not skip(tile_id)] if skip else tile_ids
+
+
+def fetch_tile_levels(db, user_id, tile_ids, skip=None):
+    """Firestore get_all 일괄 조회 → 방문 기록이 있는 타일만 {tile_id: fog level} (동기 클라이언트)"""
+    lookup = _lookup_ids(tile_ids, skip)
+    found = {}
+    for i in range(0, len(lookup), GET_ALL_CHUNK_SIZE):
+        refs = _visited_refs(db, user_id, lookup[i:i + GET_ALL_CHUNK_SIZE])
+        for doc in db.get_all(refs):
+            if doc.exists:
+                found[doc.id] = (doc.to_dict() or {}).get('fogLevel', 3)
+    return found
+
+
+def fetch_levels(db, user_id, viewport, skip=None):
+    """Firestore get_all 일괄 조회로 뷰포트 fog level 목록 생성 (동기 클라이언트)"""
+    tile_ids = viewport.tile_ids()
+    return _levels_from_snapshots(tile_ids, fetch_tile_levels(db, user_id, tile_ids, skip))
+
+
+async def fetch_levels_async(db, user_id, viewport, skip=None):
+    """Firestore get_all 일괄 조회로 뷰포트 fog level 목록 생성 (비동기 클라이언트)"""
+    tile_ids = viewport.tile_ids()
+    lookup = _lookup_ids(tile_ids, skip)
+    found = {}
+    for i in range(0, len(lookup), GET_ALL_CHUNK_SIZE):
+        refs = _visited_refs(db, user_id, lookup[i:i + GET_ALL_CHUNK_SIZE])
+        async for doc in db.get_all(refs):
+            if doc.exists:
+                found[doc.id] = (doc.to_dict() or {}).get('fogLevel', 3)
+    return _levels_from_snapshots(tile_ids, found)
+
+
+def pack_levels(levels):
+    """fog level(0~3)을 타일당 2비트로 패킹 (한 바이트에 4타일, 하위 비트부터)"""
+    packed = bytearray((len(levels) + 3) // 4)
+    for i, level in enumerate(levels):
+        packed[i >> 2] |= (level & 0b11) << ((i & 3) * 2)
+    return bytes(packed)
+
+
+def rle_levels(levels):
+    """fog level 배열 → run마다 (길이 << 2 | level) LEB128 varint"""
+    encoded = bytearray()
+    for level, run in groupby(levels):
+        value = (sum(1 for _ in run) << 2) | (level & 0b11)
+        while value > 0x7f:
+            encoded.append((value & 0x7f) | 0x80)
+            value >>= 7
+        encoded.append(value)
+    return bytes(encoded)
+
+
+def unrle_levels(data):
+    """rle_levels의 역변환 (클라이언트 구현 확인용)"""
+    levels, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            levels.extend([value & 0b11] * (value >> 2))
+            value, shift = 0, 0
+    return levels
+
+
+def viewport_etag(fmt, version=None, levels=None):
+    """뷰포트 응답 ETag (방문 버전이 있으면 버전, 없으면 level 배열 CRC32)"""
+    if version is not None:
+        return f'"v{fmt}-{version}"'
+    return f'"v{fmt}-c{zlib.crc32(bytes(levels)):08x}"'
+
+
+def etag_matches(header, etag):
+    """If-None-Match 헤더에 etag가 있는지 (약한 비교)"""
+    if not header:
+        return False
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def encode_viewport(user_id, viewport, levels, fmt, version=None):
+    """응답 본문 생성 → (content_type, body, extra_headers)"""
+    bbox = f"{viewport.zoom},{viewport.x0},{viewport.y0},{viewport.x1},{viewport.y1}"
+    headers = {'X-Fog-Bbox': bbox, 'ETag': viewport_etag(fmt, version, levels)}
+    if version is not None:
+        headers['X-Fog-Version'] = version
+    if fmt in ('bin', 'rle'):
+        headers['X-Fog-Width'] = str(viewport.width)
+        body = pack_levels(levels) if fmt == 'bin' else rle_levels(levels)
+        return 'application/octet-stream', body, headers
+
+    payload = {
+        "userId": user_id,
+        "zoom": viewport.zoom,
+        "x0": viewport.x0,
+        "y0": viewport.y0,
+        "x1": viewport.x1,
+        "y1": viewport.y1,
+        "width": viewport.width,
+        "height": viewport.height,
+        "grid": ''.join(str(level) for level in levels),
+    }
+    if version is not None:
+        payload["version"] = version
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return 'application/json', body, headers
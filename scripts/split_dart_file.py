@@ -4,14 +4,66 @@ Dart 파일을 Part 파일로 자동 분할하는 스크립트
 
 사용법:
   python split_dart_file.py lib/features/map_system/screens/map_screen.dart
+  python split_dart_file.py --compare [dart 파일...]   # 기존 정규식 추출과 속도/결과 비교
+  python split_dart_file.py --project [lib 디렉터리] [--jobs N] [--top N] [--write]
+
+--project: lib/**/*.dart 전체를 프로세스 풀로 분석해 큰 파일/메서드 순위와 분류(classify_methods)를
+보고합니다. 파일별 결과는 내용 해시(sha1)로 캐시(<프로젝트>/.dart_tool/split_dart_file_cache.json)하여
+다음 실행에서 바뀌지 않은 파일은 다시 분석하지 않습니다. --write는 순위에 든 파일의 Part 파일을
+만들되 내용이 바뀐 Part 파일만 다시 씁니다.
+
+메서드 추출은 dart_lexer로 파일을 한 번만 훑어(O(n)) 문자열/주석 안의 중괄호를 세지 않고,
+반환 타입과 상관없이 private 메서드/getter/setter/최상위 함수를 찾습니다.
 """
 
+import argparse
+import hashlib
+import json
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from dart_lexer import extract_members
+
+# Part 파일로 옮기는 선언 종류 (생성자/operator는 원본 클래스에 남김)
+MOVABLE_KINDS = ('method', 'getter', 'setter', 'function')
+
+# --compare에서 파일을 지정하지 않았을 때 비교할 큰 파일 수 / 반복 횟수
+COMPARE_FILES = 5
+COMPARE_REPEAT = 5
+
+# 프로젝트 분석 캐시 (추출/분류 방식이 바뀌면 CACHE_VERSION을 올려 전체를 다시 분석)
+CACHE_VERSION = 1
+CACHE_FILE = Path('.dart_tool') / 'split_dart_file_cache.json'
+
+# 보고서에 보여 줄 파일/메서드 수
+REPORT_TOP = 15
+
+# --project에서 분석/분할하지 않는 파일: 생성된 Part 디렉터리, 백업 사본, `part of` 파일
+PARTS_DIR = 'parts'
+BACKUP_PATTERN = re.compile(r'_backup_\d+\.dart$')
+PART_OF_PATTERN = re.compile(rb'\A(?:\xef\xbb\xbf)?(?:\s+|//[^\n]*|/\*.*?\*/)*part\s+of\b', re.S)
 
 def extract_methods(content):
-    """메서드들을 추출"""
+    """private 메서드들을 추출 (name: 본문 앞까지의 시그니처, method: 메서드 이름)"""
+    methods = []
+    for member in extract_members(content):
+        if member['kind'] not in MOVABLE_KINDS or not member['name'].startswith('_'):
+            continue
+        methods.append({
+            'name': member['signature'],
+            'method': member['name'],
+            'kind': member['kind'],
+            'code': member['code'],
+            'start': member['start'],
+            'end': member['end']
+        })
+    return methods
+
+def extract_methods_regex(content):
+    """메서드들을 추출 (기존 정규식 + 중괄호 세기 방식, --compare 비교용)"""
     # Dart 메서드 패턴: void|Future|Widget 등으로 시작
     pattern = r'((?:Future<[^>]+>|void|Widget|bool|String|int|double|List<[^>]+>)\s+_\w+\([^)]*\)(?:\s+async)?\s*\{)'
     
@@ -81,34 +133,235 @@ def classify_methods(methods):
     return categories
 
 def create_part_files(file_path, categories):
-    """Part 파일들 생성"""
+    """Part 파일들 생성 (내용이 같은 기존 Part 파일은 다시 쓰지 않음) → (쓴 파일 수, 그대로인 파일 수)"""
     base_path = Path(file_path).parent / 'parts'
     base_path.mkdir(exist_ok=True)
     
     file_name = Path(file_path).stem
+    written = unchanged = 0
     
     for category, methods in categories.items():
         if not methods:
             continue
         
         part_file = base_path / f'{file_name}_{category}.dart'
+        parts = [f"part of '../{Path(file_path).name}';\n\n",
+                 f"// ==================== {category.upper()} ====================\n\n"]
+        for method in methods:
+            parts.append(method['code'])
+            parts.append('\n\n')
+        content = ''.join(parts)
         
-        with open(part_file, 'w', encoding='utf-8') as f:
-            f.write(f"part of '../{Path(file_path).name}';\n\n")
-            f.write(f"// ==================== {category.upper()} ====================\n\n")
-            
-            for method in methods:
-                f.write(method['code'])
-                f.write('\n\n')
+        if part_file.exists() and part_file.read_text(encoding='utf-8') == content:
+            unchanged += 1
+            print(f"⏭️  Unchanged: {part_file} ({len(methods)} methods)")
+            continue
         
+        with open(part_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        written += 1
         print(f"✅ Created: {part_file} ({len(methods)} methods)")
+    
+    return written, unchanged
+
+def analyze_file(path):
+    """Dart 파일 하나 분석 → 캐시 항목 (프로세스 풀 작업 함수)"""
+    data = Path(path).read_bytes()
+    content = data.decode('utf-8', errors='replace')
+    categories = classify_methods(extract_methods(content))
+    methods = []
+    for category, method_list in categories.items():
+        for method in method_list:
+            methods.append({
+                'method': method['method'],
+                'kind': method['kind'],
+                'category': category,
+                'start': method['start'],
+                'lines': method['code'].count('\n') + 1
+            })
+    methods.sort(key=lambda m: m['start'])
+    return {
+        'hash': hashlib.sha1(data).hexdigest(),
+        'size': len(data),
+        'lines': content.count('\n') + 1,
+        'methods': methods
+    }
+
+def load_cache(cache_path):
+    """캐시 파일 → {상대 경로: 캐시 항목} (없거나 버전이 다르면 빈 dict)"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache.get('files', {})
+
+def save_cache(cache_path, files):
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'files': files}, f)
+    os.replace(tmp_path, cache_path)
+
+def is_part_file(data):
+    """첫 지시어가 `part of`인 파일인지 (앞의 공백/주석은 건너뜀)"""
+    return PART_OF_PATTERN.match(data) is not None
+
+def project_files(root):
+    """root 아래 분석 대상 .dart 파일 (parts/ 디렉터리와 *_backup_* 사본 제외)"""
+    for path in sorted(root.rglob('*.dart')):
+        relative = path.relative_to(root)
+        if PARTS_DIR in relative.parts[:-1] or BACKUP_PATTERN.search(path.name):
+            continue
+        yield path
+
+def analyze_project(root, jobs=None, cache_path=None, use_cache=True):
+    """root 아래 .dart 파일 분석 → ({상대 경로: 캐시 항목}, 새로 분석한 파일 수)
+
+    내용 해시가 캐시와 같은 파일은 건너뛰고, 나머지만 프로세스 풀에서 분석합니다.
+    이미 다른 파일의 Part인 파일(`part of`)은 다시 나누지 않도록 보고서와 --write 대상에서 뺍니다.
+    """
+    root = Path(root)
+    cache_path = root.parent / CACHE_FILE if cache_path is None else Path(cache_path)
+    cache = load_cache(cache_path) if use_cache else {}
+    
+    results = {}
+    stale = []
+    for path in project_files(root):
+        data = path.read_bytes()
+        if is_part_file(data):
+            continue
+        key = path.relative_to(root).as_posix()
+        entry = cache.get(key)
+        if entry is not None and entry['hash'] == hashlib.sha1(data).hexdigest():
+            results[key] = entry
+        else:
+            stale.append(key)
+    
+    jobs = jobs or os.cpu_count() or 1
+    paths = [root / key for key in stale]
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(stale))) as pool:
+            chunksize = max(1, len(stale) // (jobs * 4))
+            analyzed = list(pool.map(analyze_file, paths, chunksize=chunksize))
+    else:
+        analyzed = [analyze_file(path) for path in paths]
+    results.update(zip(stale, analyzed))
+    
+    # 삭제된 파일은 캐시에서도 빠짐
+    save_cache(cache_path, results)
+    return results, len(stale)
+
+def print_report(results, top=REPORT_TOP):
+    """큰 파일/메서드 순위와 분류 보고서 출력"""
+    files = sorted(results.items(), key=lambda item: item[1]['lines'], reverse=True)[:top]
+    print(f"\n📊 Largest files (top {len(files)})")
+    for rank, (key, entry) in enumerate(files, 1):
+        counts = {}
+        for method in entry['methods']:
+            counts[method['category']] = counts.get(method['category'], 0) + 1
+        breakdown = ', '.join(f"{category} {count}" for category, count
+                              in sorted(counts.items(), key=lambda item: -item[1]))
+        print(f"  {rank:2}. {key}  {entry['lines']} lines, {len(entry['methods'])} methods"
+              + (f" ({breakdown})" if breakdown else ''))
+    
+    methods = sorted(((method, key) for key, entry in results.items() for method in entry['methods']),
+                     key=lambda item: item[0]['lines'], reverse=True)[:top]
+    print(f"\n📏 Largest methods (top {len(methods)})")
+    for rank, (method, key) in enumerate(methods, 1):
+        print(f"  {rank:2}. {method['method']} [{method['category']}]  {method['lines']} lines  - {key}")
+
+def split_project(root, results, top=REPORT_TOP):
+    """순위에 든 파일의 Part 파일 생성 (내용이 바뀐 Part 파일만 씀)"""
+    written = unchanged = 0
+    files = sorted(results.items(), key=lambda item: item[1]['lines'], reverse=True)[:top]
+    for key, entry in files:
+        if not entry['methods']:
+            continue
+        content = (Path(root) / key).read_text(encoding='utf-8')
+        file_written, file_unchanged = create_part_files(Path(root) / key,
+                                                         classify_methods(extract_methods(content)))
+        written += file_written
+        unchanged += file_unchanged
+    print(f"\n✅ Part 파일: {written}개 작성, {unchanged}개 변경 없음")
+
+def project_main(args):
+    root = Path(args.paths[0]) if args.paths else Path(__file__).resolve().parent.parent / 'lib'
+    if not root.is_dir():
+        print(f"❌ Directory not found: {root}")
+        sys.exit(1)
+    
+    started = time.perf_counter()
+    results, analyzed = analyze_project(root, args.jobs, args.cache, not args.no_cache)
+    elapsed = time.perf_counter() - started
+    print(f"🔍 {len(results)} files: {analyzed} analyzed, {len(results) - analyzed} cached "
+          f"({elapsed:.2f}s)")
+    
+    print_report(results, args.top)
+    if args.write:
+        split_project(root, results, args.top)
+
+def _best_time(extract, content):
+    """COMPARE_REPEAT번 실행 중 가장 빠른 시간(ms)과 결과"""
+    best = None
+    for _ in range(COMPARE_REPEAT):
+        started = time.perf_counter()
+        methods = extract(content)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, methods
+
+def compare_extractors(paths):
+    """기존 정규식 추출과 dart_lexer 추출의 속도/찾은 메서드 비교"""
+    if not paths:
+        lib = Path(__file__).resolve().parent.parent / 'lib'
+        paths = sorted(lib.rglob('*.dart'), key=lambda p: p.stat().st_size, reverse=True)[:COMPARE_FILES]
+    
+    total_old = total_new = 0.0
+    for path in paths:
+        content = Path(path).read_text(encoding='utf-8')
+        old_ms, old_methods = _best_time(extract_methods_regex, content)
+        new_ms, new_methods = _best_time(extract_methods, content)
+        total_old += old_ms
+        total_new += new_ms
+        old_names = {re.search(r'(_\w+)\(', m['name']).group(1) for m in old_methods}
+        new_names = {m['method'] for m in new_methods}
+        print(f"📄 {Path(path).name} ({len(content) // 1024}KB)")
+        print(f"  regex: {old_ms:6.2f}ms, {len(old_methods)} methods")
+        print(f"  lexer: {new_ms:6.2f}ms, {len(new_methods)} methods")
+        if old_names - new_names:
+            print(f"  ⚠️  regex only: {', '.join(sorted(old_names - new_names))}")
+        if new_names - old_names:
+            print(f"  ➕ lexer only: {', '.join(sorted(new_names - old_names))}")
+    
+    print(f"\n⏱️  total: regex {total_old:.2f}ms / lexer {total_new:.2f}ms")
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python split_dart_file.py <dart_file_path>")
+    parser = argparse.ArgumentParser(description="Dart 파일을 Part 파일로 분할")
+    parser.add_argument('paths', nargs='*', help="Dart 파일 (--project면 lib 디렉터리)")
+    parser.add_argument('--compare', action='store_true', help="기존 정규식 추출과 속도/결과 비교")
+    parser.add_argument('--project', action='store_true', help="lib/**/*.dart 전체 분석 보고서")
+    parser.add_argument('--jobs', type=int, default=None, help="분석 프로세스 수 (기본 CPU 수)")
+    parser.add_argument('--top', type=int, default=REPORT_TOP, help="보고서/분할 대상 파일 수")
+    parser.add_argument('--write', action='store_true', help="--project: 순위에 든 파일의 Part 파일 생성")
+    parser.add_argument('--cache', default=None, help="분석 캐시 파일 경로")
+    parser.add_argument('--no-cache', action='store_true', help="캐시를 무시하고 모두 다시 분석")
+    args = parser.parse_args()
+    
+    if args.compare:
+        compare_extractors(args.paths)
+        return
+    if args.project:
+        project_main(args)
+        return
+    if len(args.paths) != 1:
+        parser.print_usage()
         sys.exit(1)
     
-    file_path = sys.argv[1]
+    file_path = args.paths[0]
     
     if not Path(file_path).exists():
         print(f"❌ File not found: {file_path}")
@@ -119,6 +372,10 @@ def main():
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
     
+    if is_part_file(content.encode('utf-8')):
+        print(f"❌ 이미 Part 파일입니다 (part of): {file_path}")
+        sys.exit(1)
+    
     print(f"📊 File size: {len(content)} characters")
     
     # 메서드 추출
@@ -5,7 +5,8 @@
 이 서버는 동적으로 타일을 생성하여 HTTP 기반 TileOverlay 시스템을 테스트할 수 있게 해줍니다.
 
 사용법:
-python tile_server.py
+python tile_server.py [포트]
+python tile_server.py --profile 60        # 시작 후 60초 샘플링 프로파일 (fog_profile.py)
 
 URL 예시:
 http://localhost:8080/tiles/user123/15/26910/12667.png
@@ -16,46 +17,98 @@ import json
 import re
 from urllib.parse import urlparse, parse_qs
 from PIL import Image, ImageDraw
-import io
 import math
+from fog_tiles import (
+    TILE_CONTENT_TYPES, TILE_SIZE, RenderedTileCache, debug_mode_enabled, encode_png,
+)
+from fog_http import cache_control_from_env, level_matches, make_etag
+from fog_metrics import REQUEST_LOG, InstrumentedHandlerMixin, register_tile_cache, stage_timer
+from fog_profile import PROFILE_PATH, ProfileRun, add_profile_arguments
 
-class TileHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """GET 요청 처리"""
+# 개발 서버의 fog 타입 → RGBA 색상
+FOG_TYPE_COLORS = {
+    'clear': (0, 0, 0, 0),               # 투명 - 지도 완전히 보임
+    'gray': (128, 128, 128, 128),        # 회색 틴트 (50% 불투명)
+    'dark_gray': (64, 64, 64, 179),      # 어두운 회색 (70% 불투명)
+    'dark': (0, 0, 0, 255),              # 검은 포그 (100% 불투명 - 지도 완전히 안 보임)
+    'test': (255, 0, 0, 100),            # 테스트용 빨간색 격자
+}
+
+
+def render_fog_type(fog_level):
+    """fog 타입별 타일 이미지 생성 (좌표 정보 없이 타입에만 의존)"""
+    size = TILE_SIZE
+    img = Image.new('RGBA', (size, size), FOG_TYPE_COLORS[fog_level])
+    if fog_level == 'test':
+        draw = ImageDraw.Draw(img)
+        # 격자 그리기
+        for i in range(0, size, 32):
+            draw.line([(i, 0), (i, size)], fill=(255, 255, 255, 200), width=2)
+            draw.line([(0, i), (size, i)], fill=(255, 255, 255, 200), width=2)
+    return img
+
+
+# fog 타입별 인코딩된 PNG 캐시 (디버그 모드가 아니면 모든 요청이 공유)
+TILE_CACHE = RenderedTileCache(render_fog_type)
+DEBUG_TILES = debug_mode_enabled()
+
+# 합성 타일은 사용자와 무관하므로 공유 캐시 허용 (FOG_TILE_MAX_AGE / FOG_TILE_SWR로 조정)
+TILE_CACHE_CONTROL = cache_control_from_env('public')
+
+class TileHandler(InstrumentedHandlerMixin, BaseHTTPRequestHandler):
+    def handle_get(self):
+        """GET 요청 처리 (/metrics는 InstrumentedHandlerMixin이 처리)"""
         path = self.path
         
-        # CORS 헤더 추가 (Flutter Web용)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
-        
         # 타일 요청 패턴 매칭
-        tile_pattern = r'/tiles/([^/]+)/(\d+)/(\d+)/(\d+)\.png'
-        match = re.match(tile_pattern, path)
+        with stage_timer('route'):
+            tile_pattern = r'/tiles/([^/]+)/(\d+)/(\d+)/(\d+)\.png'
+            match = re.match(tile_pattern, path)
         
         if match:
+            self.metrics_route = 'tile'
             user_id, zoom, x, y = match.groups()
             zoom, x, y = int(zoom), int(x), int(y)
-            
-            print(f"🎯 타일 요청: user={user_id}, z={zoom}, x={x}, y={y}")
+            self.log_fields = {"userId": user_id, "z": zoom, "x": x, "y": y}
             
             try:
-                tile_png = self.generate_fog_tile(user_id, zoom, x, y)
+                fog_level = self.get_fog_type(zoom, x, y)
+                # Accept 헤더에 image/webp가 있으면 WebP (디버그 타일은 항상 PNG)
+                fmt = 'png' if DEBUG_TILES else TILE_CACHE.encoder.negotiate(self.headers.get('Accept'))
+                etag = make_etag(fog_level, fmt=fmt)
+                
+                # 같은 fog 타입이면 타일 내용도 같으므로 렌더링 없이 304
+                if not DEBUG_TILES and level_matches(self.headers.get('If-None-Match'), fog_level, fmt):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', TILE_CACHE_CONTROL)
+                    self.send_vary()
+                    self.end_headers()
+                    return
+                
+                with stage_timer('render'):
+                    tile_png = self.generate_fog_tile(user_id, zoom, x, y, fog_level, fmt)
                 
                 self.send_response(200)
-                self.send_header('Content-Type', 'image/png')
-                self.send_header('Cache-Control', 'public, max-age=3600')  # 1시간 캐시
+                self.send_header('Content-Type', TILE_CONTENT_TYPES[fmt])
+                self.send_header('Content-Length', str(len(tile_png)))
+                if DEBUG_TILES:
+                    self.send_header('Cache-Control', 'no-cache')  # 디버그 타일은 캐시 안 함
+                else:
+                    self.send_header('Cache-Control', TILE_CACHE_CONTROL)
+                    self.send_header('ETag', etag)
+                    self.send_vary()
                 self.end_headers()
-                self.wfile.write(tile_png)
-                
-                print(f"✅ 타일 전송 완료: {len(tile_png)} bytes")
+                self.write_body(tile_png)
+                self.log_fields["bytes"] = len(tile_png)
                 
             except Exception as e:
-                print(f"❌ 타일 생성 오류: {e}")
-                self.send_error(500, f"타일 생성 실패: {e}")
+                REQUEST_LOG.error('tile_error', error=str(e), **self.log_fields)
+                self.send_error(500, "Tile generation failed", str(e))
                 
         elif path == '/health':
             # 헬스 체크
+            self.metrics_route = 'health'
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.end_headers()
@@ -65,18 +118,26 @@ class TileHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404, "Not Found")
     
-    def do_OPTIONS(self):
-        """CORS preflight 요청 처리"""
-        self.send_response(200)
+    def send_vary(self):
+        """WebP 협상을 하면 Accept에 따라 응답이 달라지므로 Vary 헤더 추가"""
+        if TILE_CACHE.encoder.webp:
+            self.send_header('Vary', 'Accept')
+    
+    def end_headers(self):
+        """모든 응답(에러 포함)에 CORS 헤더 추가 (Flutter Web용)"""
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+        super().end_headers()
+    
+    def do_OPTIONS(self):
+        """CORS preflight 요청 처리"""
+        self.send_response(200)
         self.end_headers()
     
-    def generate_fog_tile(self, user_id, zoom, x, y):
-        """동적 Fog 타일 생성"""
-        size = 256
-        
+    def get_fog_type(self, zoom, x, y):
+        """서울 중심과의 거리로 합성 fog 타입 결정"""
         # 서울 중심 좌표 (타일 좌표계)
         seoul_center_x = 26910
         seoul_center_y = 12667
@@ -102,55 +163,38 @@ class TileHandler(BaseHTTPRequestHandler):
         if (x + y) % 4 == 0:
             fog_level = 'test'  # 격자 패턴
         
-        # 이미지 생성
-        img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
+        return fog_level
+    
+    def generate_fog_tile(self, user_id, zoom, x, y, fog_level, fmt='png'):
+        """동적 Fog 타일 생성 (fog 타입/형식별 캐시된 타일 바이트 반환)"""
+        if not DEBUG_TILES:
+            return TILE_CACHE.get(fog_level, fmt)
         
-        if fog_level == 'clear':
-            # 투명 - 지도 완전히 보임
+        # 디버그 모드: 타일 좌표 표시 (타일마다 달라지므로 캐시 미사용)
+        img = render_fog_type(fog_level)
+        draw = ImageDraw.Draw(img)
+        try:
+            draw.text((10, 10), f"{zoom}/{x}/{y}", fill=(255, 255, 255, 255))
+        except:
             pass
-        elif fog_level == 'gray':
-            # 회색 틴트 (50% 불투명)
-            draw.rectangle([0, 0, size, size], fill=(128, 128, 128, 128))
-        elif fog_level == 'dark_gray':
-            # 어두운 회색 (70% 불투명)
-            draw.rectangle([0, 0, size, size], fill=(64, 64, 64, 179))
-        elif fog_level == 'dark':
-            # 검은 포그 (100% 불투명 - 지도 완전히 안 보임)
-            draw.rectangle([0, 0, size, size], fill=(0, 0, 0, 255))
-        elif fog_level == 'test':
-            # 테스트용 빨간색 격자
-            draw.rectangle([0, 0, size, size], fill=(255, 0, 0, 100))
-            # 격자 그리기
-            for i in range(0, size, 32):
-                draw.line([(i, 0), (i, size)], fill=(255, 255, 255, 200), width=2)
-                draw.line([(0, i), (size, i)], fill=(255, 255, 255, 200), width=2)
-            # 타일 좌표 표시
-            try:
-                draw.text((10, 10), f"{zoom}/{x}/{y}", fill=(255, 255, 255, 255))
-            except:
-                pass
-        
-        # PNG로 변환
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
         
-        return img_buffer.read()
-    
-    def log_message(self, format, *args):
-        """로그 메시지 포맷팅"""
-        print(f"🌐 {self.address_string()} - {format % args}")
+        return encode_png(img)
 
-def run_server(host='localhost', port=8080):
-    """타일 서버 실행"""
+def run_server(host='localhost', port=8080, profile=None):
+    """타일 서버 실행 (profile: --profile로 시작한 ProfileRun, 종료 시 저장)"""
     server_address = (host, port)
     httpd = HTTPServer(server_address, TileHandler)
+    TILE_CACHE.warm(FOG_TYPE_COLORS)
+    register_tile_cache('flat', TILE_CACHE)
     
     print(f"🚀 Fog of War 타일 서버 시작됨")
     print(f"📍 주소: http://{host}:{port}")
     print(f"🧪 테스트 URL: http://{host}:{port}/tiles/user123/15/26910/12667.png")
     print(f"❤️ 헬스 체크: http://{host}:{port}/health")
+    print(f"📈 메트릭: http://{host}:{port}/metrics")
+    print(f"🔬 프로파일: http://{host}:{port}{PROFILE_PATH}?seconds=10 (관리자 전용)")
+    if DEBUG_TILES:
+        print(f"🐞 디버그 타일 모드: 타일마다 좌표를 렌더링합니다 (캐시 미사용)")
     print(f"🛑 중지하려면 Ctrl+C")
     print("=" * 60)
     
@@ -159,18 +203,16 @@ def run_server(host='localhost', port=8080):
     except KeyboardInterrupt:
         print(f"\n🛑 서버 종료 중...")
         httpd.shutdown()
+        if profile is not None:
+            profile.finish()
         print(f"✅ 서버가 정상적으로 종료되었습니다")
 
 if __name__ == "__main__":
-    import sys
+    import argparse
     
-    # 포트 번호 옵션
-    port = 8080
-    if len(sys.argv) > 1:
-        try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("❌ 올바른 포트 번호를 입력하세요")
-            sys.exit(1)
+    parser = argparse.ArgumentParser(description='개발용 Fog of War 타일 서버')
+    parser.add_argument('port', nargs='?', type=int, default=8080, help='포트 번호 (기본 8080)')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
     
-    run_server('localhost', port)
+    run_server('localhost', args.port, ProfileRun.from_args(args))